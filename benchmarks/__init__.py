@@ -0,0 +1,7 @@
+""" Benchmarks for the hot paths, run against a seeded synthetic dataset:
+
+    python -m benchmarks --scale small --out bench/small.json
+    python -m benchmarks --scale large --compare bench/large.json
+
+See `python -m benchmarks --help`.
+"""
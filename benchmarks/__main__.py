@@ -0,0 +1,266 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from . import synthetic
+
+
+def timeit(fn, repeat=5, number=1, setup=None):
+    """ Seconds per call of `fn`: `repeat` runs of `number` calls each,
+    with `setup()` (untimed) before each run.
+    """
+    runs = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        runs.append((time.perf_counter() - start) / number)
+    return {
+        'min_s': min(runs),
+        'median_s': statistics.median(runs),
+        'repeat': repeat,
+        'number': number,
+    }
+
+# Run in a fresh interpreter per repeat, so nothing is already imported.
+_STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from rrecords import create_app
+imported = time.perf_counter()
+app = create_app({'SQLALCHEMY_DATABASE_URI': sys.argv[1], 'TESTING': True})
+created = time.perf_counter()
+assert app.test_client().get('/').status_code == 200
+served = time.perf_counter()
+print(json.dumps({
+    'startup.import': imported - start,
+    'startup.create_app': created - imported,
+    'startup.first_request': served - created,
+    'modules': sorted(m for m in sys.modules if m.split('.')[0] in sys.argv[2:]),
+}))
+"""
+
+# Libraries web processes shouldn't need to import.
+_MATCHER_MODULES = ['numpy', 'scipy', 'rapidfuzz', 'rrecords.musicbrainz']
+
+def startup_benchmarks(database, repeat):
+    """ Cold start of a web process: importing the app, create_app() and
+    its first request. Also returns which of _MATCHER_MODULES it imported.
+    """
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', _STARTUP_SCRIPT, database, *_MATCHER_MODULES],
+            capture_output=True, text=True, check=True
+        ).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+
+    results = {
+        name: {
+            'min_s': min(r[name] for r in runs),
+            'median_s': statistics.median(r[name] for r in runs),
+            'repeat': repeat,
+            'number': 1,
+        }
+        for name in runs[0] if name.startswith('startup.')
+    }
+    return results, runs[0]['modules']
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(app, user_id, scale, seed, repeat):
+    from scipy.optimize import linear_sum_assignment
+    from rrecords import db
+    from rrecords.discogs import DiscogsIngest, add_from_discogs
+    from rrecords.models.base import User, Release
+    from rrecords.models.loading import RELEASE_PAGE
+    from rrecords.models.scrobbyls import ReleaseScrobbyl
+    from rrecords.musicbrainz import _track_distance_matrix
+    from rrecords.schemas.base import collection_schema, release_w_disc_schema
+    from types import SimpleNamespace
+
+    rng = random.Random(seed + 1)
+    client = synthetic.discogs_client.Client('rrecords-benchmarks')
+    results = {}
+
+    # Ingest brand new releases, each run with its own Discogs ids.
+    next_id = [10**8]
+    def new_releases(n):
+        releases = [
+            synthetic.discogs_release(client, synthetic.release_payload(rng, next_id[0] + i))
+            for i in range(n)
+        ]
+        next_id[0] += n
+        return releases
+
+    batch = []
+    def add_one_by_one():
+        ingest = DiscogsIngest()
+        for release in batch:
+            add_from_discogs(release, ingest=ingest)
+        db.session.commit()
+    def add_many():
+        DiscogsIngest().add_many(batch)
+        db.session.commit()
+
+    def setup(n):
+        return lambda: batch.__setitem__(slice(None), new_releases(n))
+    results['ingest.add_from_discogs[50]'] = timeit(
+        add_one_by_one, repeat=repeat, setup=setup(50)
+    )
+    results['ingest.add_many[200]'] = timeit(
+        add_many, repeat=repeat, setup=setup(200)
+    )
+
+    box_set = Release.query.options(*RELEASE_PAGE).filter(Release.discogs_id==1).one()
+    album = (
+        Release.query.options(*RELEASE_PAGE)
+        .filter(Release.discogs_id==synthetic.SCALES[scale]['box_sets'] + 1).one()
+    )
+    for label, release in [('album', album), ('box_set', box_set)]:
+        mb_release = SimpleNamespace(tracks=synthetic.mb_tracks_for(rng, release.tracks))
+        n = f"[{label}:{len(release.tracks)}]"
+
+        def match(release=release, mb_release=mb_release):
+            linear_sum_assignment(_track_distance_matrix(release, mb_release))
+        results[f"match.distance_and_assignment{n}"] = timeit(match, repeat=repeat, number=10)
+        results[f"release.discs{n}"] = timeit(lambda: release.discs, repeat=repeat, number=10)
+        results[f"release.discs_unresolved{n}"] = timeit(
+            release._assign_tracks_to_discs, repeat=repeat, number=10
+        )
+
+    user = User.query.get(user_id)
+    def dump_collections():
+        db.session.expire(user, ['collections'])
+        collection_schema.dump(user.collections)
+    results['collection_schema.dump'] = timeit(dump_collections, repeat=repeat, number=10)
+
+    # Scrobbling the box set, without committing.
+    form = release_w_disc_schema.dump(box_set) | {
+        'timestamp': datetime.now(timezone.utc), 't0': 'started', 'offset': 0,
+    }
+    def scrobble():
+        ReleaseScrobbyl.from_form(user, form, commit=False)
+        db.session.rollback()
+    results['scrobbyl.from_form[box_set]'] = timeit(scrobble, repeat=repeat, number=5)
+
+    collection_id = user.collections[0].id
+    http = app.test_client()
+    with http.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+    for name, url in [
+        ('route.collection', f"/collection/{collection_id}"),
+        ('route.release[album]', f"/release/{album.id}"),
+        ('route.release[box_set]', f"/release/{box_set.id}"),
+    ]:
+        def get(url=url):
+            assert http.get(url).status_code == 200, url
+        results[name] = timeit(get, repeat=repeat, number=5)
+
+    return results
+
+def compare(results, baseline, threshold):
+    """ Prints each benchmark's change against `baseline`; returns the
+    names that got slower by more than `threshold` (a ratio).
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print(f"{name:55s} {result['min_s']*1000:10.3f}ms  (new)")
+            continue
+        ratio = result['min_s'] / before['min_s']
+        flag = ""
+        if ratio > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(
+            f"{name:55s} {result['min_s']*1000:10.3f}ms  "
+            f"x{ratio:.2f} vs {before['min_s']*1000:.3f}ms{flag}"
+        )
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__)
+    parser.add_argument('--scale', choices=synthetic.SCALES, default='small')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--database', help="SQLAlchemy URL (default: a fresh SQLite file)")
+    parser.add_argument('--out', help="Write results here as JSON")
+    parser.add_argument('--compare', help="Earlier results to compare against")
+    parser.add_argument(
+        '--threshold', type=float, default=1.25,
+        help="Slowdown ratio counted as a regression (default 1.25)"
+    )
+    args = parser.parse_args(argv)
+
+    from rrecords import create_app, db
+
+    tmp = tempfile.TemporaryDirectory()
+    database = args.database or f"sqlite:///{os.path.join(tmp.name, 'bench.db')}"
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database, 'TESTING': True})
+
+    with app.app_context():
+        db.create_all()
+        start = time.perf_counter()
+        user = synthetic.populate(args.scale, seed=args.seed)
+        populate_s = time.perf_counter() - start
+        print(f"Populated {args.scale} dataset in {populate_s:.1f}s")
+        results = run_benchmarks(app, user.id, args.scale, args.seed, args.repeat)
+
+    startup, startup_modules = startup_benchmarks(database, args.repeat)
+    results |= startup
+    if startup_modules:
+        print(f"Web startup imported: {', '.join(startup_modules)}")
+
+    report = {
+        'meta': {
+            'scale': args.scale,
+            'params': synthetic.SCALES[args.scale],
+            'seed': args.seed,
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'database': database.split(':')[0],
+            'populate_s': round(populate_s, 3),
+            'startup_modules': startup_modules,
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+        },
+        'results': results,
+    }
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+    else:
+        for name, result in results.items():
+            print(f"{name:55s} {result['min_s']*1000:10.3f}ms")
+
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    tmp.cleanup()
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,196 @@
+""" Seeded synthetic data: Discogs-shaped release payloads, the matching
+MusicBrainz tracklists, and bulk-loaded scrobbles. The same seed always
+produces the same dataset.
+"""
+import random
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import discogs_client
+
+SCALES = {
+    'small': {
+        'releases': 500, 'box_sets': 2, 'box_set_tracks': 300,
+        'collections': 5, 'scrobbyls': 20_000,
+    },
+    'large': {
+        'releases': 10_000, 'box_sets': 20, 'box_set_tracks': 300,
+        'collections': 50, 'scrobbyls': 1_000_000,
+    },
+}
+
+_WORDS = (
+    "love night blue heart time day dream fire road home light rain city "
+    "sun river song girl world moon dance star gold soul wild black white "
+    "summer winter morning midnight sweet lonely broken electric silver"
+).split()
+
+_DESCRIPTIONS = ['LP', 'Album', 'Reissue', 'Stereo', 'Remastered', '180g', 'Gatefold']
+
+
+def _title(rng, n_words):
+    return " ".join(rng.choice(_WORDS) for _ in range(n_words)).title()
+
+def _duration(rng):
+    seconds = rng.randint(90, 600)
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+def _vinyl_positions(n_tracks, n_discs):
+    """ A1, A2, B1, ... spread over two sides per disc. """
+    sides = [chr(ord('A') + i) for i in range(2 * n_discs)]
+    per_side = -(-n_tracks // len(sides))
+    return [f"{sides[i // per_side]}{i % per_side + 1}" for i in range(n_tracks)]
+
+def _cd_positions(n_tracks, n_discs):
+    per_disc = -(-n_tracks // n_discs)
+    return [f"{i // per_disc + 1}-{i % per_disc + 1}" for i in range(n_tracks)]
+
+def release_payload(rng, discogs_id, n_tracks=None, box_set=False):
+    """ A release as the Discogs API returns it. """
+    if box_set:
+        name, n_discs = rng.choice([('Vinyl', 12), ('CD', 15)])
+    else:
+        name = rng.choice(['Vinyl', 'Vinyl', 'Vinyl', 'CD'])
+        n_discs = rng.choice([1, 1, 1, 2])
+    n_tracks = n_tracks or rng.randint(8, 16) * n_discs
+
+    positions = (_vinyl_positions if name == 'Vinyl' else _cd_positions)(
+        n_tracks, n_discs
+    )
+    artist_id = rng.randint(1, max(1, discogs_id // 5))
+    return {
+        'id': discogs_id,
+        'title': _title(rng, rng.randint(1, 4)),
+        'artists_sort': f"Artist {artist_id}",
+        'artists': [{
+            'id': artist_id, 'name': f"Artist {artist_id}",
+            'resource_url': f"https://api.discogs.com/artists/{artist_id}",
+        }],
+        'year': rng.randint(1955, 2023),
+        'master_id': rng.randint(1, 10**6),
+        'thumb': f"https://i.discogs.com/{discogs_id}-thumb.jpg",
+        'cover_image': f"https://i.discogs.com/{discogs_id}.jpg",
+        'formats': [{
+            'name': name, 'qty': str(n_discs),
+            'descriptions': rng.sample(_DESCRIPTIONS, rng.randint(1, 3)),
+        }],
+        'tracklist': [{
+            'position': position, 'type_': 'track',
+            'title': _title(rng, rng.randint(1, 5)), 'duration': _duration(rng),
+        } for position in positions],
+    }
+
+def discogs_release(client, payload):
+    """ `payload` as a discogs_client Release that won't try to refresh. """
+    release = discogs_client.Release(client, dict(payload))
+    release.previous_request = payload['cover_image']
+    return release
+
+def mb_tracks_for(rng, dc_tracks):
+    """ MusicBrainz-side tracks for a release: the same songs with titles
+    decorated, durations jittered and the order lightly shuffled, as the
+    matcher sees them.
+    """
+    tracks = []
+    for i, track in enumerate(dc_tracks):
+        title = track.title
+        if rng.random() < 0.2:
+            title += rng.choice([" (Remastered)", " - 2011 Mix", " (Live)"])
+        tracks.append(SimpleNamespace(
+            position=str(i + 1), title=title,
+            duration_s=(track.duration_s or 200) + rng.randint(-3, 3),
+        ))
+    for i in range(0, len(tracks) - 1, 7):
+        tracks[i], tracks[i + 1] = tracks[i + 1], tracks[i]
+    return tracks
+
+def populate(scale, seed=0, batch_size=200):
+    """ Fills the (empty) app database: one user with `collections`
+    folders, `releases` releases of which `box_sets` have
+    `box_set_tracks` tracks each, and `scrobbyls` track scrobbles.
+    Returns the user.
+    """
+    from rrecords import db
+    from rrecords.discogs import DiscogsIngest
+    from rrecords.models.base import User, Collection, Track, release_to_collection
+
+    params = SCALES[scale]
+    rng = random.Random(seed)
+    client = discogs_client.Client('rrecords-benchmarks')
+
+    user = User(name='bench', email='bench@example.com', password='benchmark')
+    user.collections = [
+        Collection(discogs_id=i, name=f"Folder {i}", count=0)
+        for i in range(params['collections'])
+    ]
+    db.session.add(user)
+    db.session.commit()
+    collection_ids = [c.id for c in user.collections]
+
+    ingest = DiscogsIngest()
+    payloads = (
+        release_payload(
+            rng, discogs_id, box_set=discogs_id <= params['box_sets'],
+            n_tracks=params['box_set_tracks'] if discogs_id <= params['box_sets'] else None,
+        )
+        for discogs_id in range(1, params['releases'] + 1)
+    )
+    memberships = []
+    batch = []
+    for payload in payloads:
+        batch.append(discogs_release(client, payload))
+        if len(batch) == batch_size:
+            memberships += _ingest(ingest, batch, collection_ids, rng)
+            batch = []
+    if batch:
+        memberships += _ingest(ingest, batch, collection_ids, rng)
+    db.session.execute(release_to_collection.insert(), memberships)
+    Collection.refresh_counts()
+    db.session.commit()
+
+    # Scrobbles: one ReleaseScrobbyl per play, one TrackScrobbyl per track.
+    tracks_by_release = {}
+    for track_id, release_id in db.session.query(Track.id, Track.release_id):
+        tracks_by_release.setdefault(release_id, []).append(track_id)
+    release_ids = sorted(tracks_by_release)
+    t = datetime(2020, 1, 1)
+    n_scrobbyls, scrobbyl_id = 0, 0
+    release_rows, track_rows = [], []
+    while n_scrobbyls < params['scrobbyls']:
+        release_id = rng.choice(release_ids)
+        track_ids = tracks_by_release[release_id][:params['scrobbyls'] - n_scrobbyls]
+        scrobbyl_id += 1
+        release_rows.append({
+            'id': scrobbyl_id, 'user_id': user.id, 'release_id': release_id,
+            'start_time': t, 'end_time': t + timedelta(seconds=200 * len(track_ids)),
+        })
+        track_rows += [{
+            'release_scrobbyl_id': scrobbyl_id, 'track_id': track_id,
+            'start_time': t + timedelta(seconds=200 * i),
+        } for i, track_id in enumerate(track_ids)]
+        n_scrobbyls += len(track_ids)
+        t += timedelta(seconds=200 * len(track_ids) + rng.randint(60, 86400))
+
+        if len(track_rows) >= 50_000:
+            _flush_scrobbyls(release_rows, track_rows)
+            release_rows, track_rows = [], []
+    _flush_scrobbyls(release_rows, track_rows)
+    db.session.commit()
+
+    return user
+
+def _ingest(ingest, batch, collection_ids, rng):
+    from rrecords import db
+    release_ids = ingest.add_many(batch)
+    db.session.commit()
+    return [{
+        'collection_id': collection_id, 'release_id': release_id,
+    } for release_id in release_ids.values()
+      for collection_id in {collection_ids[0], rng.choice(collection_ids)}]
+
+def _flush_scrobbyls(release_rows, track_rows):
+    from rrecords import db
+    from rrecords.models.scrobbyls import ReleaseScrobbyl, TrackScrobbyl
+    if release_rows:
+        db.session.execute(ReleaseScrobbyl.__table__.insert(), release_rows)
+    if track_rows:
+        db.session.execute(TrackScrobbyl.__table__.insert(), track_rows)
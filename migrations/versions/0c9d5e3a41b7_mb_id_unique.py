@@ -0,0 +1,59 @@
+"""unique musicbrainz ids
+
+Revision ID: 0c9d5e3a41b7
+Revises: b4e2f81c07a5
+Create Date: 2026-10-18 12:00:00.000000
+
+MusicBrainz releases and tracks are unique by mb_id: they're upserted
+with ON CONFLICT (mb_id). Duplicates are merged into the oldest row
+first, with the rows pointing at them moved over.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0c9d5e3a41b7'
+down_revision = 'b4e2f81c07a5'
+branch_labels = None
+depends_on = None
+
+
+def _duplicates(table):
+    """ Each duplicate row of `table`, and the (oldest) row it's merged into. """
+    return f"""
+        SELECT id AS dup, keep FROM (
+            SELECT id, (
+                SELECT MIN(t2.id) FROM {table} t2 WHERE t2.mb_id = t.mb_id
+            ) AS keep
+            FROM {table} t
+        ) AS d
+        WHERE id != keep
+    """
+
+def _merge(table, references):
+    duplicates = _duplicates(table)
+    for referencing_table, column in references:
+        op.execute(f"""
+            UPDATE {referencing_table}
+            SET {column} = (
+                SELECT keep FROM ({duplicates}) d WHERE d.dup = {referencing_table}.{column}
+            )
+            WHERE {column} IN (SELECT dup FROM ({duplicates}) d)
+        """)
+    op.execute(f"DELETE FROM {table} WHERE id IN (SELECT dup FROM ({duplicates}) d)")
+
+
+def upgrade():
+    # Releases first: their tracks then become duplicates of the kept
+    # release's tracks.
+    _merge('mb_releases', [('releases', 'mb_match_id'), ('mb_tracks', 'mb_release_id')])
+    _merge('mb_tracks', [('tracks', 'mb_match_id')])
+    op.create_index('ix_mb_releases_mb_id', 'mb_releases', ['mb_id'], unique=True)
+    op.create_index('ix_mb_tracks_mb_id', 'mb_tracks', ['mb_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_mb_tracks_mb_id', table_name='mb_tracks')
+    op.drop_index('ix_mb_releases_mb_id', table_name='mb_releases')
@@ -0,0 +1,31 @@
+"""collection sync high-water mark
+
+Revision ID: 3a61c7d2e9f0
+Revises: 5d33df4f29d4
+Create Date: 2026-10-18 12:00:00.000000
+
+High-water mark for incremental collection syncs. Existing collections
+have none, so their next sync reads the whole listing.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a61c7d2e9f0'
+down_revision = '5d33df4f29d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('collections', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('synced_until', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('synced_count', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('collections', schema=None) as batch_op:
+        batch_op.drop_column('synced_count')
+        batch_op.drop_column('synced_until')
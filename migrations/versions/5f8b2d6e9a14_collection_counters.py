@@ -0,0 +1,54 @@
+"""collection counters
+
+Revision ID: 5f8b2d6e9a14
+Revises: 7e15a9b3c2d8
+Create Date: 2026-10-18 12:00:00.000000
+
+Counters kept on collections instead of counted per page view, filled
+in for the collections already there.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f8b2d6e9a14'
+down_revision = '7e15a9b3c2d8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('collections', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('n_synced', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('n_matched', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('n_tracks', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('last_synced_at', sa.DateTime(), nullable=True))
+
+    # As Collection.refresh_counts().
+    op.execute("""
+        UPDATE collections SET
+            n_synced = (
+                SELECT COUNT(*) FROM release_to_collection_associations m
+                WHERE m.collection_id = collections.id
+            ),
+            n_matched = (
+                SELECT COUNT(*) FROM release_to_collection_associations m
+                JOIN releases r ON r.id = m.release_id
+                WHERE m.collection_id = collections.id AND r.mb_match_id IS NOT NULL
+            ),
+            n_tracks = (
+                SELECT COUNT(t.id) FROM release_to_collection_associations m
+                JOIN tracks t ON t.release_id = m.release_id
+                WHERE m.collection_id = collections.id
+            )
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('collections', schema=None) as batch_op:
+        batch_op.drop_column('last_synced_at')
+        batch_op.drop_column('n_tracks')
+        batch_op.drop_column('n_matched')
+        batch_op.drop_column('n_synced')
@@ -0,0 +1,52 @@
+"""disc layout
+
+Revision ID: 7e15a9b3c2d8
+Revises: 0c9d5e3a41b7
+Create Date: 2026-10-18 12:00:00.000000
+
+Disc / side layout of releases, and tracks' places in it. Releases
+already in the database get theirs from `flask tasks resolve_discs`.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e15a9b3c2d8'
+down_revision = '0c9d5e3a41b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('discs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('release_id', sa.Integer(), nullable=False),
+    sa.Column('number', sa.Integer(), nullable=False),
+    sa.Column('label', sa.String(length=16), nullable=True),
+    sa.Column('format_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['format_id'], ['formats.id'], ),
+    sa.ForeignKeyConstraint(['release_id'], ['releases.id'], onupdate='CASCADE', ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('release_id', 'number')
+    )
+    with op.batch_alter_table('tracks', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('sort_key', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('disc_label', sa.String(length=16), nullable=True))
+        batch_op.add_column(sa.Column('track_no', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('on_vinyl', sa.Boolean(), nullable=True))
+        batch_op.add_column(sa.Column('disc_number', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_tracks_release_id'), ['release_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('tracks', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_tracks_release_id'))
+        batch_op.drop_column('disc_number')
+        batch_op.drop_column('on_vinyl')
+        batch_op.drop_column('track_no')
+        batch_op.drop_column('disc_label')
+        batch_op.drop_column('sort_key')
+
+    op.drop_table('discs')
@@ -0,0 +1,35 @@
+"""release keyset indexes
+
+Revision ID: 9d3c6f1b8e27
+Revises: 5f8b2d6e9a14
+Create Date: 2026-10-18 12:00:00.000000
+
+Indexes for keyset pagination of collections, one per browsable
+ordering with id as the tie-breaker.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3c6f1b8e27'
+down_revision = '5f8b2d6e9a14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('releases', schema=None) as batch_op:
+        batch_op.create_index('ix_releases_artists_sort_id', ['artists_sort', 'id'], unique=False)
+        batch_op.create_index('ix_releases_created_at_id', ['created_at', 'id'], unique=False)
+        batch_op.create_index('ix_releases_title_id', ['title', 'id'], unique=False)
+        batch_op.create_index('ix_releases_year_id', ['year', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('releases', schema=None) as batch_op:
+        batch_op.drop_index('ix_releases_year_id')
+        batch_op.drop_index('ix_releases_title_id')
+        batch_op.drop_index('ix_releases_created_at_id')
+        batch_op.drop_index('ix_releases_artists_sort_id')
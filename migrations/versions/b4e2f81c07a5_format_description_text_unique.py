@@ -0,0 +1,61 @@
+"""unique format description text
+
+Revision ID: b4e2f81c07a5
+Revises: 3a61c7d2e9f0
+Create Date: 2026-10-18 12:00:00.000000
+
+Format descriptions are unique by text: the ingest upserts them with
+ON CONFLICT (text). Duplicates are merged into the oldest row first.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4e2f81c07a5'
+down_revision = '3a61c7d2e9f0'
+branch_labels = None
+depends_on = None
+
+
+# Each duplicate description, and the (oldest) row it's merged into.
+_DUPLICATES = """
+    SELECT id AS dup, keep FROM (
+        SELECT id, (
+            SELECT MIN(f2.id) FROM format_descriptions f2 WHERE f2.text = f.text
+        ) AS keep
+        FROM format_descriptions f
+    ) AS d
+    WHERE id != keep
+"""
+
+
+def upgrade():
+    # Formats move to the surviving description, unless they have it already.
+    op.execute(f"""
+        INSERT INTO format_to_description_associations (format_id, format_description_id)
+        SELECT DISTINCT a.format_id, d.keep
+        FROM format_to_description_associations a
+        JOIN ({_DUPLICATES}) d ON a.format_description_id = d.dup
+        WHERE NOT EXISTS (
+            SELECT 1 FROM format_to_description_associations b
+            WHERE b.format_id = a.format_id AND b.format_description_id = d.keep
+        )
+    """)
+    op.execute(f"""
+        DELETE FROM format_to_description_associations
+        WHERE format_description_id IN (SELECT dup FROM ({_DUPLICATES}) d)
+    """)
+    op.execute(f"""
+        DELETE FROM format_descriptions
+        WHERE id IN (SELECT dup FROM ({_DUPLICATES}) d)
+    """)
+    op.create_index(
+        'ix_format_descriptions_text', 'format_descriptions', ['text'],
+        unique=True
+    )
+
+
+def downgrade():
+    op.drop_index('ix_format_descriptions_text', table_name='format_descriptions')
@@ -4,11 +4,11 @@ from flask_marshmallow import Marshmallow
 from flask_login import LoginManager
 from flask_moment import Moment
 from flask_migrate import Migrate
+from flask_session import Session
 from sqlalchemy import event
 from celery import Celery
 from config import Config
 
-from .base import CustomJSONDecoder, CustomJSONEncoder
 import os
 
 db = SQLAlchemy()
@@ -17,24 +17,67 @@ migrate = Migrate()
 moment = Moment()
 celery = Celery(__name__,
     broker=Config.CELERY_BROKER_URL,
-    result_backend=Config.CELERY_RESULT_BACKEND
+    result_backend=Config.CELERY_RESULT_BACKEND,
+    include=['rrecords.discogs', 'rrecords.musicbrainz', 'rrecords.covers'],
 )
 
-def _fk_pragma_on_connect(dbapi_con, con_record):
-    dbapi_con.execute('pragma foreign_keys=ON')
-
-def create_app():
+# Applied to every SQLite connection. The web app and the Celery worker
+# share the database file: in WAL mode readers don't block on a writer (or
+# vice versa), and busy_timeout makes a second writer wait for the lock
+# instead of failing straight away. SQLITE_PRAGMAS overrides these; set one
+# to None to leave SQLite's default.
+SQLITE_PRAGMAS = {
+    'foreign_keys': 'ON',
+    'journal_mode': 'WAL',
+    'busy_timeout': 5000,
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+def _sqlite_pragmas_on_connect(pragmas):
+    def on_connect(dbapi_con, con_record):
+        for name, value in pragmas.items():
+            if value is not None:
+                dbapi_con.execute(f'pragma {name}={value}')
+    return on_connect
+
+def _init_session(app):
+    """ Server-side sessions: the cookie only holds the (signed) session
+    id. Kept in Redis when there is one, so every web process sees them,
+    otherwise in files under the instance folder. SESSION_* config
+    overrides either.
+    """
+    from .locks import has_redis, redis_client
+    if has_redis():
+        app.config.setdefault('SESSION_TYPE', 'redis')
+        app.config.setdefault('SESSION_REDIS', redis_client())
+    else:
+        app.config.setdefault('SESSION_TYPE', 'filesystem')
+        app.config.setdefault(
+            'SESSION_FILE_DIR', os.path.join(app.instance_path, 'sessions')
+        )
+    # As with Flask's cookie sessions: a session only ends up stored (and
+    # given a cookie) once something is put in it, not on every request.
+    app.config.setdefault('SESSION_PERMANENT', False)
+    app.config.setdefault('SESSION_USE_SIGNER', True)
+    app.config.setdefault('SESSION_KEY_PREFIX', 'rrecords:session:')
+    Session(app)
+
+def create_app(config=None):
+    """ `config` overrides settings from CONFIG_TYPE, e.g. to point the
+    benchmarks at their own database.
+    """
     app = Flask(__name__)
 
     CONFIG_TYPE = os.getenv('CONFIG_TYPE', default='config.DevelopmentConfig')
     app.config.from_object(CONFIG_TYPE)
-
-    app.json_encoder = CustomJSONEncoder
-    app.json_decoder = CustomJSONDecoder
+    app.config.update(config or {})
 
     db.init_app(app)
     ma.init_app(app)
-    migrate.init_app(app, db)
+    migrate.init_app(app, db, render_as_batch=True)
     celery.conf.update(app.config)
     moment.init_app(app)
     
@@ -45,14 +88,24 @@ def create_app():
     from .models import base
     from .models import scrobbyls
     from .models import musicbrainz
+    from .accounts import UserPrincipal
 
     @login_manager.user_loader
     def load_user(user_id):
-        return base.User.query.get(int(user_id))
+        return UserPrincipal.load(int(user_id))
 
     with app.app_context():
-        db.create_all()
-        event.listen(db.engine, 'connect', _fk_pragma_on_connect)
+        if db.engine.dialect.name == 'sqlite':
+            pragmas = SQLITE_PRAGMAS | app.config.get('SQLITE_PRAGMAS', {})
+            event.listen(db.engine, 'connect', _sqlite_pragmas_on_connect(pragmas))
+
+        _init_session(app)
+
+        from . import instrumentation
+        instrumentation.init_app(app, db.engine)
+
+        from . import transport
+        transport.install(app)
 
         from .views.auth import auth_bp
         app.register_blueprint(auth_bp)
@@ -0,0 +1,195 @@
+""" Cached per-user account state: the logged-in user's principal (what
+every page needs to know about them) and their Discogs identity and
+collection folders. Both are kept in Redis when there is one, so that
+invalidating them on login / logout reaches every process.
+"""
+import json
+import time
+from threading import Lock
+from flask import current_app as app
+from flask_login import UserMixin
+from .locks import has_redis, redis_client
+
+
+class AccountCache():
+    """ JSON values with a TTL, in Redis if there is one, otherwise in this
+    process.
+    """
+
+    def __init__(self, redis=None):
+        self._redis = redis
+        self._local = {}
+        self._lock = Lock()
+
+    def get(self, key):
+        if self._redis is not None:
+            value = self._redis.get(key)
+            return None if value is None else json.loads(value)
+        with self._lock:
+            expires, value = self._local.get(key, (0, None))
+            return value if expires > time.monotonic() else None
+
+    def set(self, key, value, ttl):
+        if self._redis is not None:
+            self._redis.set(key, json.dumps(value), ex=int(ttl))
+            return
+        with self._lock:
+            self._local[key] = (time.monotonic() + ttl, value)
+
+    def delete(self, *keys):
+        if self._redis is not None:
+            self._redis.delete(*keys)
+            return
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+
+def account_cache():
+    if 'account_cache' not in app.extensions:
+        app.extensions['account_cache'] = AccountCache(
+            redis_client() if has_redis() else None
+        )
+    return app.extensions['account_cache']
+
+def _principal_key(user_id):
+    return f"rrecords:account:user:{user_id}"
+
+def _discogs_key(user_id):
+    return f"rrecords:account:discogs:{user_id}"
+
+def invalidate(user_id, discogs=False):
+    """ Drops the cached principal (and Discogs identity) of a user. Call
+    after changing their row, their collections or their Discogs login.
+    """
+    keys = [_principal_key(user_id)]
+    if discogs:
+        keys.append(_discogs_key(user_id))
+    account_cache().delete(*keys)
+
+
+class _CollectionLink():
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+class UserPrincipal(UserMixin):
+    """ The logged-in user, as far as the navbar and most pages need to
+    know: loaded from the cache, so most requests never query the users
+    table. Anything else is read from their User row, loaded on first use;
+    changes must be made to that row (`current_user.row`), then
+    `invalidate`d.
+    """
+
+    def __init__(self, id, name, discogs_account, discogs_linked, collections):
+        self.id = id
+        self.name = name
+        self.discogs_account = discogs_account
+        self.discogs_linked = discogs_linked
+        self.collections = [_CollectionLink(**c) for c in collections]
+        self._row = None
+
+    @classmethod
+    def load(cls, user_id):
+        """ The principal for `user_id`, or None if there's no such user. """
+        cache = account_cache()
+        key = _principal_key(user_id)
+        fields = cache.get(key)
+        if fields is None:
+            from .models.base import User
+            from .models.loading import CURRENT_USER
+            user = User.query.options(*CURRENT_USER).get(user_id)
+            if user is None:
+                return None
+            fields = {
+                'id': user.id,
+                'name': user.name,
+                'discogs_account': user.discogs_account,
+                'discogs_linked': user.discogs_token is not None,
+                'collections': [
+                    {'id': c.id, 'name': c.name} for c in user.collections
+                ],
+            }
+            cache.set(key, fields, app.config.get('USER_CACHE_TTL', 300))
+        return cls(**fields)
+
+    @property
+    def row(self):
+        if self._row is None:
+            from .models.base import User
+            self._row = User.query.get(self.id)
+        return self._row
+
+    @property
+    def n_collections(self):
+        return len(self.collections)
+
+    def logged_into_discogs(self):
+        if not self.discogs_linked:
+            return False
+        return discogs_identity(self, stale_ok=True)['logged_in']
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.row, name)
+
+
+def _fetch_identity(user):
+    from discogs_client.exceptions import HTTPError
+    client = user.open_discogs()
+    try:
+        identity = client.identity()
+        folders = identity.collection_folders
+    except HTTPError:
+        return {'logged_in': False, 'username': None, 'folders': []}
+    return {
+        'logged_in': True,
+        'username': identity.username,
+        'folders': [f.data for f in folders],
+    }
+
+def discogs_identity(user, max_age=None, stale_ok=False):
+    """ The Discogs identity of `user` (a User, or UserPrincipal): whether
+    their token still works, their username, and their collection folders
+    (raw API data). Cached for DISCOGS_IDENTITY_TTL seconds.
+
+    Fetched again if older than `max_age` seconds. With `stale_ok`, a
+    cached identity is returned however old it is, and one older than
+    DISCOGS_IDENTITY_REFRESH seconds is refreshed by a worker; it's only
+    fetched right away if nothing is cached.
+    """
+    cache = account_cache()
+    key = _discogs_key(user.id)
+    cached = cache.get(key)
+    age = time.time() - cached['fetched_at'] if cached else None
+
+    if stale_ok:
+        refresh_age = app.config.get('DISCOGS_IDENTITY_REFRESH', 600)
+        if has_redis() and (cached is not None):
+            if age > refresh_age:
+                _refresh_in_background(user.id)
+            return cached
+        # Nothing cached yet, or no worker to hand the refresh to (or cache
+        # to share it through).
+        max_age = refresh_age
+
+    if (cached is not None) and ((max_age is None) or (age <= max_age)):
+        return cached
+    identity = _fetch_identity(user) | {'fetched_at': time.time()}
+    cache.set(key, identity, app.config.get('DISCOGS_IDENTITY_TTL', 3600))
+    return identity
+
+def _refresh_in_background(user_id):
+    from .locks import enqueue_once
+    from .signatures import refresh_discogs_identity_task
+    # The key outlives the task, so refreshes happen at most once a minute.
+    enqueue_once(
+        f"rrecords:lock:discogs:identity:{user_id}",
+        refresh_discogs_identity_task, args=[user_id], ttl=60
+    )
+
+def discogs_folders(client, identity):
+    """ CollectionFolder objects for the cached folder data. """
+    from discogs_client.models import CollectionFolder
+    return [CollectionFolder(client, data) for data in identity['folders']]
@@ -0,0 +1,174 @@
+""" Local copies of release covers. After a sync, a worker downloads each
+new cover once and stores resized variants of it, which the collection and
+release pages serve instead of linking Discogs' full-size images.
+"""
+import hashlib
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import local
+from flask import current_app as app
+from sqlalchemy import select
+
+from .helpers import batched, write_atomic
+from .instrumentation import StageTimer
+from .locks import claim
+from .signatures import FETCH_COVERS, covers_lock
+from . import db, celery
+
+# Longest side, in pixels, of each variant: 'grid' for the collection
+# thumbnails (at 2x), 'page' for the release page.
+VARIANTS = {'grid': 300, 'page': 600}
+FORMATS = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+_SAVE_OPTIONS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 85, 'optimize': True, 'progressive': True},
+}
+_COVERS_BATCH = 100
+
+
+class CoverStore():
+    """ Covers kept under the sha1 of the downloaded image, one file per
+    variant and format (ab/ab12.../grid.webp), so a cover shared by
+    several releases is stored once and a stored file never changes.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, sha, variant, fmt):
+        return os.path.join(self.root, sha[:2], sha, f"{variant}.{fmt}")
+
+    def has(self, sha):
+        return all(
+            os.path.exists(self.path(sha, variant, fmt))
+            for variant in VARIANTS for fmt in FORMATS
+        )
+
+    def put(self, content):
+        """ Stores the variants of an image (unless they already are), and
+        returns its sha.
+        """
+        sha = hashlib.sha1(content).hexdigest()
+        if not self.has(sha):
+            for (variant, fmt), data in _render(content).items():
+                write_atomic(self.path(sha, variant, fmt), data)
+        return sha
+
+
+def _render(content):
+    from PIL import Image, ImageOps
+
+    image = Image.open(io.BytesIO(content))
+    largest = max(VARIANTS.values())
+    # Lets JPEGs decode at a reduced scale, which is much faster.
+    image.draft('RGB', (largest, largest))
+    image = ImageOps.exif_transpose(image).convert('RGB')
+
+    rendered = {}
+    for variant, size in sorted(VARIANTS.items(), key=lambda v: -v[1]):
+        image.thumbnail((size, size), Image.LANCZOS)
+        for fmt, options in _SAVE_OPTIONS.items():
+            out = io.BytesIO()
+            image.save(out, **options)
+            rendered[variant, fmt] = out.getvalue()
+    return rendered
+
+
+def cover_store():
+    """ The app's CoverStore (COVER_STORE, default instance/covers). """
+    if 'cover_store' not in app.extensions:
+        app.extensions['cover_store'] = CoverStore(app.config.get(
+            'COVER_STORE', os.path.join(app.instance_path, 'covers')
+        ))
+    return app.extensions['cover_store']
+
+
+class CoverDownloader():
+    """ Downloads covers on up to `max_workers` threads, storing each as it
+    arrives. Discogs' image CDN wants a User-Agent like its API does.
+    """
+
+    def __init__(self, store, max_workers=4, timeout=30):
+        self.store = store
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.failed = 0
+        self._sessions = local()
+
+    def _session(self):
+        if not hasattr(self._sessions, 'session'):
+            import requests
+            session = requests.Session()
+            session.headers['User-Agent'] = 'my_user_agent/1.0'
+            self._sessions.session = session
+        return self._sessions.session
+
+    def _fetch(self, url):
+        import requests
+        try:
+            response = self._session().get(url, timeout=self.timeout)
+            response.raise_for_status()
+            return self.store.put(response.content)
+        except (requests.RequestException, OSError):
+            # Unreachable, or not an image Pillow can read; the release
+            # keeps linking the original until the next sync tries again.
+            self.failed += 1
+            return None
+
+    def fetch(self, covers):
+        """ Yields `(key, sha)` for every `(key, url)` in `covers`, in
+        order; sha is None if the cover couldn't be stored.
+        """
+        covers = list(covers)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            shas = executor.map(self._fetch, [url for _, url in covers])
+            for (key, _), sha in zip(covers, shas):
+                yield key, sha
+
+
+def fetch_covers(collection_id):
+    """ Stores the covers of a collection's releases that don't have a
+    local one yet. Returns how many it stored.
+    """
+    from .models.base import Release, release_to_collection
+
+    missing = db.session.execute(
+        select(Release.id, Release.cover_image)
+        .join(release_to_collection, release_to_collection.c.release_id == Release.id)
+        .where(release_to_collection.c.collection_id == collection_id)
+        .where(Release.cover_image.isnot(None), Release.cover_image != '')
+        .where(Release.cover_sha.is_(None))
+    ).all()
+
+    timer = StageTimer('fetch_covers')
+    downloader = CoverDownloader(
+        cover_store(), max_workers=app.config.get('COVER_DOWNLOAD_WORKERS', 4)
+    )
+    n_stored = 0
+    fetched = timer.timed('download', downloader.fetch(missing))
+    for batch in batched(fetched, _COVERS_BATCH):
+        rows = [{'id': id, 'cover_sha': sha} for id, sha in batch if sha]
+        with timer.stage('commit'):
+            if rows:
+                db.session.bulk_update_mappings(Release, rows)
+            db.session.commit()
+        n_stored += len(rows)
+
+    timer.count('cover_failures', downloader.failed)
+    timer.finish(n_releases=len(missing), collection_id=collection_id)
+    return n_stored
+
+@celery.task(name=FETCH_COVERS, bind=True)
+def fetch_covers_task(self, collection_id):
+    if app.config.get('TRANSPORT_MODE') in ('replay', 'stub'):
+        # Offline: there are no recorded images to replay.
+        return 'offline'
+    with claim(
+        covers_lock(collection_id), token=self.request.id,
+        ttl=app.config.get('TASK_LEASE_TTL', 60), renew=True
+    ) as claimed:
+        if not claimed:
+            return 'duplicate'
+        return fetch_covers(collection_id)
@@ -1,118 +1,465 @@
-
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+from itertools import chain
+from threading import Lock
+from flask import current_app as app
+from discogs_client.exceptions import HTTPError
 from sqlalchemy_get_or_create import get_or_create
 from .models.base import (
     User, Artist, Release, Track, FormatDescription, Format, Collection,
-    unique_field_value
+    Disc, release_to_collection, artist_to_release, format_to_description,
+    upsert, resolve_disc_layout
 )
 
 from .schemas.base import (
     release_w_track_schema, track_schema, CollectionSchema
 )
 import click
+from .payloads import payload_store, DISCOGS_RELEASE
+from .accounts import discogs_folders, discogs_identity, invalidate
+from .helpers import batched
+from .instrumentation import StageTimer
+from .locks import claim, enqueue_once
+from .progress import Progress, SYNC
+from .signatures import sync_lock, covers_lock, fetch_covers_task
 from .tasks import tasks_bp
 from . import db, celery
 
+_INGEST_BATCH = 25
+_MAX_PER_PAGE = 100     # Largest page size Discogs allows for listings
+_RATE_WINDOW_S = 60     # Discogs rate limits are per (moving) minute
+_ALL_FOLDER = 0         # The folder holding every instance in a collection
+_TRACK_FIELDS = ['position', 'type', 'title', 'duration', 'duration_s']
+
+def _utc_naive(timestamp):
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+def _scan_instances(instances, synced_until=None):
+    """ Walks a folder listing sorted newest first. Stops at the first
+    instance added before `synced_until` and returns the instances seen,
+    how many of those are strictly newer than the mark, and an iterator
+    over whatever is left unread (None if the listing was exhausted).
+    """
+    seen, n_newer = [], 0
+    listing = iter(instances)
+    for instance in listing:
+        if synced_until is not None:
+            added = _utc_naive(instance.date_added)
+            if added < synced_until:
+                return seen, n_newer, chain([instance], listing)
+            n_newer += added > synced_until
+        else:
+            n_newer += 1
+        seen.append(instance)
+
+    return seen, n_newer, None
+
+def _listing_delta(folder, local_ids, synced_until=None, synced_count=None):
+    """ Reads a remote folder's listing, newest first, as far as needed to
+    tell what changed since the last sync. Returns the instances read, and
+    the discogs ids to add and to remove.
+
+    The listing stops at `synced_until` only in the "All" folder, when the
+    instances below the mark are exactly the `synced_count` there were:
+    anything added to it gets a new date_added, so nothing can have moved
+    in below the mark to make up for a removal. An instance moved into any
+    other folder keeps its date_added, so those are always read in full.
+    """
+    instances = folder.releases
+    instances.per_page = _MAX_PER_PAGE
+    instances.sort('added', 'desc')
+    seen, n_newer, rest = _scan_instances(instances, synced_until)
+
+    unchanged_below_mark = (
+        (folder.id == _ALL_FOLDER) and (synced_count == folder.count - n_newer)
+    )
+    if (rest is not None) and not unchanged_below_mark:
+        seen += list(rest)
+        rest = None
+
+    remote_ids = {i.id for i in seen}
+    add_ids = remote_ids - local_ids
+    remove_ids = local_ids - remote_ids if rest is None else set()
+    return seen, add_ids, remove_ids
+
+class DiscogsFetcher():
+    """ Refreshes (i.e. fetches the full payload of) Discogs objects on a
+    bounded thread pool, yielding them as they complete. Once the
+    X-Discogs-Ratelimit-Remaining header drops to `reserve`, requests are
+    spaced out to the rate limit so we don't get 429s.
+    """
+
+    def __init__(self, client, max_workers=4, reserve=5, store=None):
+        self.client = client
+        self.max_workers = max_workers
+        self.reserve = reserve
+        self.store = store
+        self._lock = Lock()
+        self.api_calls, self.store_hits = 0, 0
+
+    def _rate_limit(self, field):
+        value = getattr(self.client._fetcher, field, None)
+        return None if value is None else int(value)
+
+    def _wait_for_quota(self):
+        with self._lock:
+            remaining = self._rate_limit('rate_limit_remaining')
+            if (remaining is not None) and (remaining <= self.reserve):
+                limit = self._rate_limit('rate_limit') or _RATE_WINDOW_S
+                time.sleep(_RATE_WINDOW_S / limit)
+
+    def _refresh(self, discogs_object):
+        if discogs_object.previous_request is not None:
+            return discogs_object
+
+        fetched = False
+        def fetch(etag):
+            nonlocal fetched
+            self._wait_for_quota()
+            discogs_object.refresh()
+            fetched = True
+            return discogs_object.data, None
+
+        if self.store is None:
+            fetch(None)
+        else:
+            discogs_object.data.update(self.store.fetch(
+                DISCOGS_RELEASE, discogs_object.id, fetch
+            ))
+            discogs_object.previous_request = discogs_object.data.get('resource_url')
+
+        with self._lock:
+            self.api_calls += fetched
+            self.store_hits += not fetched
+
+        return discogs_object
+
+    def fetch(self, discogs_objects):
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            pending = set()
+            for discogs_object in discogs_objects:
+                pending.add(pool.submit(self._refresh, discogs_object))
+                if len(pending) >= 2*self.max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    yield from (f.result() for f in done)
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from (f.result() for f in done)
+
 # @tasks_bp.cli.command('sync_collection')
 # @click.argument("user_id")
 # @click.argument("collection_id")
 @celery.task(name='scrobblyr.discogs.sync_collection', bind=True)
-def sync_discogs_collection_task(self, user_id, collection_id):
+def sync_discogs_collection_task(self, user_id, collection_id, incremental=True):
+    """ Syncs one collection. A duplicate of a sync that's already running
+    returns without doing anything.
+    """
+    with claim(
+        sync_lock(collection_id), token=self.request.id,
+        ttl=app.config.get('TASK_LEASE_TTL', 60), renew=True
+    ) as claimed:
+        if not claimed:
+            return 'duplicate'
+        progress = Progress(SYNC, collection_id)
+        progress.start()
+        try:
+            _sync_collection(progress, user_id, collection_id, incremental)
+        except Exception:
+            progress.finish(state='failed')
+            raise
+
+def _sync_collection(progress, user_id, collection_id, incremental):
     local = Collection.query.get(collection_id)
     if not local:
         raise ValueError(f"Collection ID {collection_id} not found.")
 
-    client = User.query.get(user_id).open_discogs()
-    remote_collections = client.identity().collection_folders
+    user = User.query.get(user_id)
+    client = user.open_discogs()
+    # Folder counts decide whether removals need looking for, so they
+    # mustn't be much older than the sync.
+    identity = discogs_identity(
+        user, max_age=app.config.get('SYNC_IDENTITY_MAX_AGE', 60)
+    )
+    remote_collections = discogs_folders(client, identity)
 
     remote = [c for c in remote_collections if c.id == local.discogs_id]
     if not remote:
         raise ValueError(f"No matching remote collection found.")
     
     n_releases = remote[0].count
-    if n_releases != local.count:
-        local.count = n_releases
-        db.session.commit()
 
-    discogs_ids = []
-    for i, instance in enumerate(remote[0].releases):
-        do_commit = False
-        discogs_release = instance.release
-        release = Release.query.filter(Release.discogs_id==discogs_release.id).first()
-        discogs_ids.append(discogs_release.id)
+    synced_until = local.synced_until if incremental else None
+    timer = StageTimer('sync_collection')
+    local_ids = local.synced_discogs_ids()
+    with timer.stage('discogs_listing'):
+        seen, add_ids, remove_ids = _listing_delta(
+            remote[0], local_ids, synced_until, local.synced_count
+        )
 
-        if release is None:
-            release = add_from_discogs(discogs_release, commit=False)
-            do_commit = True
+    release_ids = dict(
+        db.session.query(Release.discogs_id, Release.id)
+        .filter(Release.discogs_id.in_(add_ids))
+    ) if add_ids else {}
 
-        if release not in local.releases:
-            local.releases.append(release)
-            do_commit = True
+    new_releases = list({
+        i.id: i.release for i in seen
+        if (i.id in add_ids) & (i.id not in release_ids)
+    }.values())
 
-        if do_commit:
+    # Full release payloads are fetched concurrently; this thread is the
+    # only one writing them to the DB. Nothing is written until a batch is
+    # ready and each batch is its own transaction, so the write lock is
+    # never held across API calls and pages keep loading during a sync.
+    ingest = DiscogsIngest(timer=timer)
+    fetcher = DiscogsFetcher(
+        client, max_workers=app.config.get('DISCOGS_FETCH_WORKERS', 4),
+        store=payload_store()
+    )
+    n_done = 0
+    progress.update(
+        done=0, total=len(new_releases), n_synced=len(local_ids),
+        count=n_releases
+    )
+    fetched = timer.timed('discogs_fetch', fetcher.fetch(new_releases))
+    for batch in batched(fetched, app.config.get('SYNC_WRITE_BATCH', _INGEST_BATCH)):
+        release_ids |= ingest.add_many(batch)
+        with timer.stage('commit'):
             db.session.commit()
 
-        self.update_state(
-            state='PROGRESS', 
-            meta={'progress': i*100.0/n_releases, 'synced': i-1}
+        n_done += len(batch)
+        progress.update(done=n_done, n_synced=len(local_ids) + n_done)
+
+    with timer.stage('db_write'):
+        _update_membership(local.id, release_ids, remove_ids)
+
+    if seen:
+        newest = _utc_naive(seen[0].date_added)
+        local.synced_until = max(filter(None, [newest, synced_until]))
+    local.count = n_releases
+    local.synced_count = n_releases
+    local.last_synced_at = datetime.utcnow()
+    with timer.stage('commit'):
+        db.session.flush()
+        Collection.refresh_counts(local.id)
+        db.session.commit()
+
+    progress.finish(
+        done=n_done, n_synced=local.n_synced, count=local.count,
+        n_matched=local.n_matched
+    )
+    # Covers are downloaded once, by a worker of their own, so the sync
+    # isn't held up by the image CDN.
+    enqueue_once(covers_lock(local.id), fetch_covers_task, args=[local.id])
+
+    timer.count('discogs_api_calls', fetcher.api_calls)
+    timer.count('payload_store_hits', fetcher.store_hits)
+    timer.finish(
+        n_releases=len(new_releases), collection_id=local.id,
+        added=len(add_ids), removed=len(remove_ids)
+    )
+
+def _update_membership(collection_id, release_ids, remove_ids):
+    if release_ids:
+        db.session.execute(release_to_collection.insert(), [
+            {'collection_id': collection_id, 'release_id': release_id}
+            for release_id in release_ids.values()
+        ])
+
+    if remove_ids:
+        db.session.execute(
+            release_to_collection.delete()
+            .where(release_to_collection.c.collection_id==collection_id)
+            .where(release_to_collection.c.release_id.in_(
+                db.session.query(Release.id)
+                .filter(Release.discogs_id.in_(remove_ids))
+                .scalar_subquery()
+            ))
         )
 
-    keep_releases = [r for r in local.releases if r.discogs_id in discogs_ids]
-    local.releases = keep_releases
-    db.session.commit()
 
 @celery.task(name='scrobbylr.discogs.sync_folders')
 def sync_folders_task(user_id):
     collection_schema = CollectionSchema()
-    client = User.query.get(user_id).open_discogs()
-    folders = client.identity().collection_folders
-    for folder in folders:
+    user = User.query.get(user_id)
+    client = user.open_discogs()
+    identity = discogs_identity(user)
+    if not identity['logged_in']:
+        raise HTTPError("Discogs login expired or revoked", 401)
+    for folder in discogs_folders(client, identity):
         folder_data = collection_schema.load(folder) | {'user_id': user_id}
         collection, _ = get_or_create(db.session, Collection, **folder_data)
         
     db.session.commit()
+    invalidate(user_id)
 
-def add_from_discogs(discogs_release, commit=False):
+@celery.task(name='scrobbylr.discogs.refresh_identity')
+def refresh_discogs_identity_task(user_id):
+    user = User.query.get(user_id)
+    if user is not None:
+        discogs_identity(user, max_age=0)
 
-    data = release_w_track_schema.load(discogs_release)
-    
-    if not unique_field_value(Collection, 'discogs_id', data['discogs_id']):
-        print(f"Already found {data['title']}")
-        return
-
-    artists_data = data.pop('artists', None)
-    formats_data = data.pop('formats', None)
-    release = Release(**data)
-
-    # Create / Find artists, append to .artists list on this release
-    if artists_data:
-        for artist_data in artists_data:
-            artist, _ = get_or_create(db.session, Artist, **artist_data)
-            release.artists.append(artist)
-
-    # Create each format entry for this release, and append to list
-    # Search for existing matching descriptions, if doesn't exist then
-    # create it, and attach to the format entry.
-    if formats_data:
-        for format_data in formats_data:
-            descriptions = format_data.pop('descriptions', None)
-            format = Format(**format_data)
-            if descriptions:
-                for description in descriptions:
-                    desc, _ = get_or_create(db.session, FormatDescription, **description)
-                    format.descriptions.append(desc)
-
-            release.formats.append(format)
-
-    # Creat the tracks on this release
-    for track in discogs_release.tracklist:
-        track_data = track_schema.load(track.data)
-        if track_data['type'] == 'track':
-            new_track = Track(**track_data)
-            release.tracks.append(new_track)
-
-    # Add release (and related children) to session, then commit?
-    db.session.add(release)
+class DiscogsIngest():
+    """ Writes Discogs releases (and their tracks / formats) with batched
+    INSERTs. Artists and format descriptions are upserted the first time
+    they're seen in a run, and looked up from in-memory maps after that.
+    Releases already in the DB (e.g. added by another worker) are skipped.
+    """
+
+    def __init__(self, timer=None):
+        self._artist_ids = {}       # Artist.discogs_id -> Artist.id
+        self._description_ids = {}  # FormatDescription.text -> id
+        self.timer = timer or StageTimer('ingest')
+
+    def _map_artists(self, artists_data):
+        new = {
+            a['discogs_id']: a for a in artists_data
+            if a['discogs_id'] not in self._artist_ids
+        }
+        if not new:
+            return
+
+        upsert(
+            Artist.__table__, ['discogs_id'],
+            [{
+                'discogs_id': discogs_id,
+                'name': a['name'],
+                'resource_url': a.get('resource_url'),
+                'thumbnail_url': a.get('thumbnail_url'),
+            } for discogs_id, a in new.items()],
+            update=['name', 'resource_url', 'thumbnail_url']
+        )
+        self._artist_ids |= dict(
+            db.session.query(Artist.discogs_id, Artist.id)
+            .filter(Artist.discogs_id.in_(new))
+        )
+
+    def _map_descriptions(self, texts):
+        new = set(texts) - self._description_ids.keys()
+        if not new:
+            return
+
+        upsert(
+            FormatDescription.__table__, ['text'],
+            [{'text': text} for text in new]
+        )
+        self._description_ids |= dict(
+            db.session.query(FormatDescription.text, FormatDescription.id)
+            .filter(FormatDescription.text.in_(new))
+        )
+
+    def _insert_release(self, data):
+        row = {k: v for k, v in data.items() if k in Release.__table__.c}
+        return upsert(Release.__table__, ['discogs_id'], row)
+
+    def add_many(self, discogs_releases):
+        """ Returns {discogs_id: Release.id} for every release given, whether
+        it was inserted now or already existed.
+        """
+        with self.timer.stage('schema_load'):
+            loaded = [self._load(r) for r in discogs_releases]
+        with self.timer.stage('db_write'):
+            return self._write(loaded)
+
+    @staticmethod
+    def _load(discogs_release):
+        data = release_w_track_schema.load(discogs_release)
+        data['tracks'] = [
+            t for t in (
+                track_schema.load(dict(track.data))
+                for track in discogs_release.tracklist
+            ) if t['type'] == 'track'
+        ]
+        return data
+
+    def _write(self, loaded):
+
+        self._map_artists(
+            [a for data in loaded for a in data.get('artists') or []]
+        )
+        self._map_descriptions({
+            d['text'] for data in loaded
+            for f in data.get('formats') or []
+            for d in f.get('descriptions') or []
+        })
+
+        release_ids = {}
+        artist_rows, track_rows, description_rows, disc_rows = [], [], [], []
+        for data in loaded:
+            release_id = self._insert_release(data)
+            if release_id is None:
+                continue
+            release_ids[data['discogs_id']] = release_id
+
+            artist_rows += [{
+                'artist_id': self._artist_ids[a['discogs_id']],
+                'release_id': release_id
+            } for a in {
+                a['discogs_id']: a for a in data.get('artists') or []
+            }.values()]
+
+            formats = data.get('formats') or []
+            track_layout, disc_layout = resolve_disc_layout(
+                [t.get('position') for t in data['tracks']],
+                [(f.get('name'), f.get('qty')) for f in formats]
+            )
+            track_rows += [
+                dict.fromkeys(_TRACK_FIELDS) | track | layout | {'release_id': release_id}
+                for track, layout in zip(data['tracks'], track_layout)
+            ]
+
+            # Formats one at a time, their ids are needed for descriptions
+            # and discs.
+            format_ids = []
+            for format_data in formats:
+                descriptions = format_data.pop('descriptions', None) or []
+                format_id = db.session.execute(
+                    Format.__table__.insert(),
+                    format_data | {'release_id': release_id}
+                ).inserted_primary_key[0]
+                format_ids.append(format_id)
+                description_rows += [{
+                    'format_id': format_id,
+                    'format_description_id': description_id
+                } for description_id in {
+                    self._description_ids[d['text']] for d in descriptions
+                }]
+
+            disc_rows += [{
+                'release_id': release_id,
+                'number': number,
+                'label': d['label'],
+                'format_id': None if d['format'] is None else format_ids[d['format']],
+            } for number, d in enumerate(disc_layout)]
+
+        if artist_rows:
+            db.session.execute(artist_to_release.insert(), artist_rows)
+        if track_rows:
+            db.session.execute(Track.__table__.insert(), track_rows)
+        if description_rows:
+            db.session.execute(format_to_description.insert(), description_rows)
+        if disc_rows:
+            db.session.execute(Disc.__table__.insert(), disc_rows)
+
+        skipped = [
+            data['discogs_id'] for data in loaded
+            if data['discogs_id'] not in release_ids
+        ]
+        if skipped:
+            release_ids |= dict(
+                db.session.query(Release.discogs_id, Release.id)
+                .filter(Release.discogs_id.in_(skipped))
+            )
+
+        return release_ids
+
+def add_from_discogs(discogs_release, commit=False, ingest=None):
+    ingest = ingest or DiscogsIngest()
+    release_id = ingest.add_many([discogs_release])[discogs_release.id]
     if commit:
         db.session.commit()
 
-    return release
\ No newline at end of file
+    return Release.query.get(release_id)
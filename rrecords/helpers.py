@@ -1,4 +1,6 @@
+import os
 from string import Template
+from threading import get_ident
 
 class DeltaTemplate(Template):
     delimiter = "%"
@@ -21,3 +23,24 @@ def strfdelta(tdelta, fmt):
     d["S"] = '{:02d}'.format(seconds)
     t = DeltaTemplate(fmt)
     return t.substitute(**d)
+
+def write_atomic(path, content):
+    """ Writes `content` (bytes) to `path` through a temporary file, so
+    readers only ever see a whole file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def batched(iterable, n):
+    """ Yields lists of up to `n` items from `iterable`. """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,263 @@
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter as _Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import Response, current_app as app, g, request
+from celery.signals import task_prerun, task_postrun
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest
+)
+from sqlalchemy import event
+
+slow_query_log = logging.getLogger('rrecords.sql.slow')
+task_log = logging.getLogger('rrecords.tasks')
+
+_QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+SQL_STATEMENT_SECONDS = Histogram(
+    'rrecords_sql_statement_seconds', "Time spent in single SQL statements",
+    ['operation']
+)
+REQUEST_SQL_QUERIES = Histogram(
+    'rrecords_request_sql_queries', "SQL statements per request",
+    ['endpoint'], buckets=_QUERY_BUCKETS
+)
+REQUEST_SQL_SECONDS = Histogram(
+    'rrecords_request_sql_seconds', "Time spent in SQL per request",
+    ['endpoint']
+)
+TASK_SQL_QUERIES = Histogram(
+    'rrecords_task_sql_queries', "SQL statements per Celery task",
+    ['task'], buckets=_QUERY_BUCKETS
+)
+TASK_SQL_SECONDS = Histogram(
+    'rrecords_task_sql_seconds', "Time spent in SQL per Celery task",
+    ['task']
+)
+
+TASK_STAGE_SECONDS = Histogram(
+    'rrecords_task_stage_seconds', "Time spent in each stage of a task run",
+    ['task', 'stage']
+)
+TASK_RELEASES = Counter(
+    'rrecords_task_releases', "Releases processed by tasks", ['task']
+)
+TASK_EVENTS = Counter(
+    'rrecords_task_events', "API calls, cache hits etc. made by tasks",
+    ['task', 'event']
+)
+CELERY_QUEUE_DEPTH = Gauge(
+    'rrecords_celery_queue_depth', "Messages waiting in a Celery queue",
+    ['queue'], multiprocess_mode='max'
+)
+
+
+class QueryStats():
+    """ SQL statements run, and the time spent in them, by one request or
+    task.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.seconds += seconds
+
+# The stats of whatever request / task is running in this thread, if any.
+_query_stats = ContextVar('query_stats', default=None)
+
+_normalize_res = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(\.\d+)?\b'), '?'),
+    (re.compile(r'\s+'), ' '),
+    (re.compile(r'\(\s*\?(\s*,\s*\?)*\s*\)'), '(?)'),
+    (re.compile(r'(\(\?\))(\s*,\s*\(\?\))+'), r'\1'),
+]
+
+def normalize_statement(statement):
+    """ A statement with its literals and parameter lists collapsed, so that
+    the same query with different values logs the same way.
+    """
+    for pattern, replacement in _normalize_res:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(slow_query_ms):
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        operation = statement.lstrip().split(' ', 1)[0].upper()
+        SQL_STATEMENT_SECONDS.labels(operation).observe(elapsed)
+
+        stats = _query_stats.get()
+        if stats is not None:
+            stats.add(elapsed)
+
+        if elapsed * 1000 >= slow_query_ms:
+            slow_query_log.warning(
+                "%.1fms %s", elapsed * 1000, normalize_statement(statement)
+            )
+    return after_cursor_execute
+
+def _start_request():
+    g.query_stats_token = _query_stats.set(QueryStats())
+
+def _record_request(response):
+    stats = _query_stats.get()
+    if stats is None:
+        return response
+
+    endpoint = request.endpoint or 'unknown'
+    REQUEST_SQL_QUERIES.labels(endpoint).observe(stats.count)
+    REQUEST_SQL_SECONDS.labels(endpoint).observe(stats.seconds)
+    if app.debug:
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={stats.seconds * 1000:.1f};desc="{stats.count} queries"'
+        )
+    return response
+
+def _end_request(exc):
+    token = g.pop('query_stats_token', None)
+    if token is not None:
+        _query_stats.reset(token)
+
+@task_prerun.connect(weak=False)
+def _start_task(task_id=None, task=None, **kwargs):
+    task.request.query_stats_token = _query_stats.set(QueryStats())
+
+@task_postrun.connect(weak=False)
+def _record_task(task_id=None, task=None, **kwargs):
+    stats = _query_stats.get()
+    token = getattr(task.request, 'query_stats_token', None)
+    if (stats is None) or (token is None):
+        return
+
+    TASK_SQL_QUERIES.labels(task.name).observe(stats.count)
+    TASK_SQL_SECONDS.labels(task.name).observe(stats.seconds)
+    _query_stats.reset(token)
+
+class StageTimer():
+    """ Wall-clock time spent in each stage of a task run, and counts of
+    events (API calls, cache hits, ...). `finish` exports them as metrics
+    and a structured log record, timing the run from `started` (a Unix
+    timestamp, default now).
+    """
+
+    def __init__(self, task, started=None):
+        self.task = task
+        self.started = started or time.time()
+        self.seconds = _Counter()
+        self.events = _Counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+
+    def timed(self, name, iterable):
+        """ Iterates `iterable`, timing the waits for each item as `name`. """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, event, n=1):
+        self.events[event] += n
+
+    def finish(self, n_releases=0, **fields):
+        elapsed = time.time() - self.started
+        for stage, seconds in self.seconds.items():
+            TASK_STAGE_SECONDS.labels(self.task, stage).observe(seconds)
+        for event, n in self.events.items():
+            TASK_EVENTS.labels(self.task, event).inc(n)
+        TASK_RELEASES.labels(self.task).inc(n_releases)
+
+        record = {
+            'task': self.task,
+            'releases': n_releases,
+            'seconds': round(elapsed, 3),
+            'releases_per_s': round(n_releases / elapsed, 2) if elapsed else None,
+            'stages': {k: round(v, 4) for k, v in self.seconds.most_common()},
+            'events': dict(self.events),
+        } | fields
+        task_log.info(json.dumps(record, default=str))
+        return record
+
+def _broker_client():
+    """ A Redis connection to the Celery broker, which needn't be REDIS_URL. """
+    if 'broker_redis' not in app.extensions:
+        from redis import Redis
+        app.extensions['broker_redis'] = Redis.from_url(app.config['CELERY_BROKER_URL'])
+    return app.extensions['broker_redis']
+
+def _update_queue_depths():
+    from .locks import is_redis_url
+    if not is_redis_url(app.config.get('CELERY_BROKER_URL')):
+        return
+    broker = _broker_client()
+    for queue in app.config.get('METRICS_QUEUES', ['celery']):
+        CELERY_QUEUE_DEPTH.labels(queue).set(broker.llen(queue))
+
+def metrics():
+    """ Prometheus metrics. With PROMETHEUS_MULTIPROC_DIR set (gunicorn
+    workers, Celery worker processes) they're collected across processes.
+    """
+    _update_queue_depths()
+    registry = None
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(
+        generate_latest(registry) if registry else generate_latest(),
+        mimetype=CONTENT_TYPE_LATEST
+    )
+
+def init_app(app, engine):
+    """ Times every statement run on `engine`, per request and per task.
+    Statements slower than SLOW_QUERY_MS go to the 'rrecords.sql.slow'
+    logger, and to the SLOW_QUERY_LOG file (through the app's logger) if
+    set.
+    """
+    # Safe to call again, e.g. for another app on the same engine.
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(
+            engine, 'after_cursor_execute',
+            _after_cursor_execute(app.config.get('SLOW_QUERY_MS', 100))
+        )
+
+    path = app.config.get('SLOW_QUERY_LOG')
+    if path and not any(
+        getattr(h, 'baseFilename', None) == os.path.abspath(path)
+        for h in app.logger.handlers
+    ):
+        handler = logging.FileHandler(path)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        # The app's logger sees everything under 'rrecords'; only slow
+        # queries go to this file.
+        handler.addFilter(logging.Filter(slow_query_log.name))
+        app.logger.addHandler(handler)
+
+    if 'metrics' not in app.view_functions:
+        app.before_request(_start_request)
+        app.after_request(_record_request)
+        app.teardown_request(_end_request)
+        app.add_url_rule('/metrics', 'metrics', metrics)
@@ -0,0 +1,131 @@
+from contextlib import contextmanager
+from threading import Event, Thread
+from uuid import uuid4
+from flask import current_app as app
+
+# Deletes the key only if it still holds our token.
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Extends the key's TTL (ms) only if it still holds our token.
+_RENEW_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Takes the key for our token if it's free, or already ours. Returns the
+# token holding it afterwards.
+_ACQUIRE_LUA = """
+local holder = redis.call('GET', KEYS[1])
+if (not holder) or (holder == ARGV[1]) then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return ARGV[1]
+end
+return holder
+"""
+
+def _redis_url():
+    return app.config.get('REDIS_URL', app.config['CELERY_BROKER_URL'])
+
+def is_redis_url(url):
+    """ Whether `url` (e.g. the Celery broker's) points at Redis. """
+    return (url or '').startswith(('redis://', 'rediss://', 'unix://'))
+
+def has_redis():
+    """ Whether the app has Redis to talk to (it doesn't when, e.g., Celery
+    runs on an in-memory broker for tests).
+    """
+    return is_redis_url(_redis_url())
+
+def redis_client():
+    """ The app's Redis connection (REDIS_URL, or the Celery broker). """
+    if 'redis' not in app.extensions:
+        from redis import Redis
+        app.extensions['redis'] = Redis.from_url(_redis_url())
+    return app.extensions['redis']
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+def acquire(key, token, ttl):
+    """ Claims `key` for `token` for `ttl` seconds, if it's free (or
+    already `token`'s). Returns the token holding it afterwards. Without
+    Redis every claim succeeds: there's nothing to coordinate through.
+    """
+    if not has_redis():
+        return token
+    return _decode(
+        redis_client().eval(_ACQUIRE_LUA, 1, key, token, int(ttl * 1000))
+    )
+
+def renew(key, token, ttl):
+    """ Extends a claim on `key` for another `ttl` seconds, if `token` still
+    holds it. Returns whether it did.
+    """
+    if not has_redis():
+        return True
+    return bool(redis_client().eval(_RENEW_LUA, 1, key, token, int(ttl * 1000)))
+
+def release(key, token):
+    if has_redis():
+        redis_client().eval(_RELEASE_LUA, 1, key, token)
+
+def _keep_renewed(redis, key, token, ttl, stop):
+    while not stop.wait(ttl / 3):
+        if not redis.eval(_RENEW_LUA, 1, key, token, int(ttl * 1000)):
+            return
+
+@contextmanager
+def claim(key, ttl=600, token=None, renew=False):
+    """ Yields True while holding `key`, or False if someone else has it.
+    The claim lapses after `ttl` seconds in case the holder dies; with
+    `renew`, a background thread keeps extending it for as long as the
+    block runs. A claim already holding `token` (e.g. made by
+    `enqueue_once` for this task) is taken over. Without Redis, every
+    claim is granted.
+    """
+    if not has_redis():
+        yield True
+        return
+    redis = redis_client()
+    token = token or uuid4().hex
+    claimed = acquire(key, token, ttl) == token
+
+    stop = Event()
+    if claimed and renew:
+        Thread(
+            target=_keep_renewed, args=(redis, key, token, ttl, stop),
+            daemon=True
+        ).start()
+    try:
+        yield claimed
+    finally:
+        stop.set()
+        if claimed:
+            redis.eval(_RELEASE_LUA, 1, key, token)
+
+def enqueue_once(key, signature, args=(), ttl=3600):
+    """ Enqueues `signature` unless a task claiming `key` is already queued
+    or running. Returns the id of the task that will do the work: the new
+    one, or the one already there.
+
+    The new task's id is stored under `key` (for `ttl` seconds, in case it
+    never runs); the task should `claim(key, token=self.request.id)` while
+    it runs, so duplicates keep collapsing onto it until it's done.
+    Without Redis, every call enqueues a task.
+    """
+    task_id = uuid4().hex
+    holder = acquire(key, task_id, ttl)
+    if holder == task_id:
+        try:
+            signature.apply_async(args=args, task_id=task_id)
+        except Exception:
+            release(key, task_id)
+            raise
+    return holder
@@ -0,0 +1,150 @@
+import json
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from copy import deepcopy
+from threading import Lock
+from flask import current_app as app
+from .locks import is_redis_url
+
+# Atomically refills the bucket from the time elapsed since the last call,
+# then takes a token. Returns how long to wait (seconds) if there wasn't one.
+_TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisTokenBucket():
+    """ A token bucket shared by every process using the same Redis key. """
+
+    def __init__(self, redis, key, rate=1.0, capacity=1):
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity
+        self._take = redis.register_script(_TOKEN_BUCKET_LUA)
+
+    def acquire(self):
+        while True:
+            wait = float(self._take(keys=[self.key], args=[self.rate, self.capacity]))
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+
+class MusicbrainzClient():
+    """ Wraps the musicbrainzngs module (or anything shaped like it).
+    Identical calls share one in-flight request, responses are kept in a
+    TTL / LRU cache, and every request to the wrapped module first takes a
+    token from `bucket`, if given.
+    """
+
+    _methods = ['search_releases', 'browse_urls', 'get_release_by_id']
+
+    def __init__(self, mb, bucket=None, ttl=24*60*60, maxsize=1024):
+        self._mb = mb
+        self._bucket = bucket
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._in_flight = {}
+        self._lock = Lock()
+        self.hits, self.misses, self.coalesced = 0, 0, 0
+
+    def __getattr__(self, name):
+        if name in self._methods:
+            return lambda *args, **kwargs: self._call(name, *args, **kwargs)
+        return getattr(self._mb, name)
+
+    def stats(self):
+        return {
+            'hits': self.hits, 'misses': self.misses,
+            'coalesced': self.coalesced, 'size': len(self._cache),
+        }
+
+    def _call(self, method, *args, **kwargs):
+        key = json.dumps([method, args, kwargs], sort_keys=True, default=str)
+        with self._lock:
+            cached = self._cache.get(key)
+            if (cached is not None) and (cached[0] > time.monotonic()):
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return deepcopy(cached[1])
+
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = self._in_flight[key] = Future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            return deepcopy(future.result())
+
+        try:
+            if self._bucket is not None:
+                self._bucket.acquire()
+            result = getattr(self._mb, method)(*args, **kwargs)
+        except Exception as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.ttl, result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+            del self._in_flight[key]
+        future.set_result(result)
+
+        return deepcopy(result)
+
+
+def musicbrainz_client():
+    """ The process-wide MusicbrainzClient around musicbrainzngs. With a
+    Redis URL (MB_RATE_LIMIT_URL, or the Celery broker) the 1 req/s budget
+    is shared by all workers; otherwise musicbrainzngs' own per-process
+    limit applies.
+    """
+    if 'musicbrainz_client' not in app.extensions:
+        import musicbrainzngs
+        musicbrainzngs.set_useragent(
+            app.config['NAME'],
+            app.config['VERSION'],
+            app.config['AUTHOR'],
+        )
+
+        bucket = None
+        url = app.config.get('MB_RATE_LIMIT_URL', app.config.get('CELERY_BROKER_URL'))
+        if is_redis_url(url):
+            from redis import Redis
+            bucket = RedisTokenBucket(
+                Redis.from_url(url), 'rrecords:musicbrainz:bucket',
+                rate=app.config.get('MB_RATE_LIMIT', 1.0)
+            )
+            musicbrainzngs.set_rate_limit(False)
+
+        app.extensions['musicbrainz_client'] = MusicbrainzClient(
+            musicbrainzngs, bucket=bucket,
+            ttl=app.config.get('MB_CACHE_TTL', 24*60*60),
+            maxsize=app.config.get('MB_CACHE_SIZE', 1024),
+        )
+    return app.extensions['musicbrainz_client']
@@ -0,0 +1,235 @@
+import gzip
+import json
+import lzma
+import re
+import sqlite3
+import tarfile
+import zlib
+from flask import current_app as app
+from musicbrainzngs import ResponseError
+from rapidfuzz.fuzz import token_sort_ratio
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS releases (
+        mb_id TEXT PRIMARY KEY,
+        title TEXT,
+        artist TEXT,
+        date TEXT,
+        track_count INTEGER,
+        medium_count INTEGER,
+        formats TEXT,
+        payload BLOB
+    )""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS releases_fts USING fts5(
+        mb_id UNINDEXED, title, artist
+    )""",
+    "CREATE TABLE IF NOT EXISTS urls (url TEXT, mb_id TEXT)",
+    "CREATE INDEX IF NOT EXISTS ix_urls_url ON urls (url)",
+]
+
+_N_CANDIDATES = 200
+
+def _open_dump(path):
+    """ Yields lines of a MusicBrainz release JSON dump, either the
+    `release.tar.xz` archive itself or its (optionally compressed) `release`
+    file.
+    """
+    if path.endswith('.tar.xz'):
+        with tarfile.open(path, mode='r|xz') as tar:
+            for member in tar:
+                if member.name.endswith('release'):
+                    yield from tar.extractfile(member)
+                    return
+        return
+
+    opener = {'.xz': lzma.open, '.gz': gzip.open}.get(path[-3:], open)
+    with opener(path, 'rb') as f:
+        yield from f
+
+def _ngs_track(track):
+    recording = track.get('recording') or {}
+    length = track.get('length') or recording.get('length')
+    ngs_track = {
+        'id': track['id'],
+        'position': str(track['position']),
+        'number': track.get('number', str(track['position'])),
+        'recording': {
+            'id': recording.get('id'),
+            'title': recording.get('title', track.get('title')),
+        },
+    }
+    if length is not None:
+        ngs_track['track_or_recording_length'] = str(length)
+    if track.get('length') is not None:
+        ngs_track['length'] = str(track['length'])
+    if recording.get('length') is not None:
+        ngs_track['recording']['length'] = str(recording['length'])
+    return ngs_track
+
+def _ngs_release(release):
+    """ Converts a release from the JSON web service / dump format to the
+    shape musicbrainzngs returns (`medium-list`, `track-list`, ...).
+    """
+    media = []
+    for medium in release.get('media') or []:
+        tracks = [_ngs_track(t) for t in medium.get('tracks') or []]
+        media.append({
+            'position': str(medium.get('position')),
+            'track-count': len(tracks),
+            'track-list': tracks,
+        } | ({'format': medium['format']} if medium.get('format') else {}))
+
+    return {
+        'id': release['id'],
+        'title': release.get('title', ''),
+        'date': release.get('date') or '',
+        'artist-credit-phrase': ''.join(
+            c.get('name', '') + c.get('joinphrase', '')
+            for c in release.get('artist-credit') or []
+        ),
+        'medium-count': len(media),
+        'medium-list': media,
+    }
+
+def _discogs_urls(release):
+    return [
+        r['url']['resource'].rstrip('/')
+        for r in release.get('relations') or []
+        if (r.get('type') == 'discogs') and ('url' in r)
+    ]
+
+def _fts_query(*texts):
+    words = {w for t in texts if t for w in re.findall(r'\w+', str(t).lower())}
+    return ' OR '.join(f'"{w}"' for w in sorted(words))
+
+
+class MusicbrainzIndex():
+    """ Local (SQLite FTS5) index of MusicBrainz releases, built from the
+    JSON dumps. Answers `search_releases`, `browse_urls` and
+    `get_release_by_id` with musicbrainzngs-shaped results, so it can stand
+    in for the `musicbrainzngs` module in `MusicbrainzNGS`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        for statement in _SCHEMA:
+            self._con.execute(statement)
+
+    def set_useragent(self, *args, **kwargs):
+        pass
+
+    def load(self, dump_path, batch_size=1000):
+        """ Streams a release dump into the index. Returns the number of
+        releases added; releases already in the index are left alone.
+        """
+        n_added = 0
+        with self._con:
+            for i, line in enumerate(_open_dump(dump_path)):
+                raw = json.loads(line)
+                release = _ngs_release(raw)
+                media = release['medium-list']
+                inserted = self._con.execute(
+                    "INSERT OR IGNORE INTO releases VALUES (?,?,?,?,?,?,?,?)", (
+                        release['id'], release['title'],
+                        release['artist-credit-phrase'], release['date'],
+                        sum(m['track-count'] for m in media), len(media),
+                        json.dumps([m.get('format', '') for m in media]),
+                        zlib.compress(json.dumps(release).encode()),
+                    )
+                ).rowcount
+                if not inserted:
+                    continue
+
+                n_added += 1
+                self._con.execute(
+                    "INSERT INTO releases_fts VALUES (?,?,?)",
+                    (release['id'], release['title'], release['artist-credit-phrase'])
+                )
+                self._con.executemany(
+                    "INSERT INTO urls VALUES (?,?)",
+                    [(url, release['id']) for url in _discogs_urls(raw)]
+                )
+                if i % batch_size == batch_size - 1:
+                    self._con.commit()
+
+        return n_added
+
+    def _summary(self, row, score):
+        mb_id, title, artist, date, track_count, medium_count, formats = row
+        return {
+            'id': mb_id,
+            'ext:score': str(score),
+            'title': title,
+            'artist-credit-phrase': artist,
+            'date': date,
+            'medium-count': medium_count,
+            'medium-track-count': track_count,
+            'medium-list': [
+                {'format': f} if f else {} for f in json.loads(formats)
+            ],
+        }
+
+    def search_releases(self, query='', limit=None, offset=None, strict=False,
+                        release=None, artist=None, tracks=None, mediums=None,
+                        **fields):
+        """ Scores candidates out of 100, like the search server's ext:score:
+        title and artist similarity, plus agreement on track / medium counts.
+        """
+        fts_query = _fts_query(query, release, artist)
+        rows = self._con.execute(
+            "SELECT r.mb_id, r.title, r.artist, r.date, r.track_count, "
+            "r.medium_count, r.formats FROM releases_fts f "
+            "JOIN releases r ON r.mb_id = f.mb_id "
+            "WHERE releases_fts MATCH ? ORDER BY bm25(releases_fts) LIMIT ?",
+            (fts_query, _N_CANDIDATES)
+        ).fetchall() if fts_query else []
+
+        def score(row):
+            return round(
+                0.5 * token_sort_ratio(release or query, row[1]) +
+                0.3 * (token_sort_ratio(artist, row[2]) if artist else 100) +
+                10 * ((tracks is None) or (int(tracks) == row[4])) +
+                10 * ((mediums is None) or (int(mediums) == row[5]))
+            )
+
+        scored = sorted(
+            (self._summary(row, score(row)) for row in rows),
+            key=lambda r: -int(r['ext:score'])
+        )
+        offset = offset or 0
+        return {
+            'release-count': len(scored),
+            'release-list': scored[offset:offset + (limit or 25)],
+        }
+
+    def browse_urls(self, resource=None, includes=[], limit=None, offset=None):
+        mb_ids = [r[0] for r in self._con.execute(
+            "SELECT mb_id FROM urls WHERE url = ?", (resource.rstrip('/'),)
+        )]
+        if not mb_ids:
+            raise ResponseError(f"No URL {resource} in the local index")
+
+        return {'url': {
+            'resource': resource,
+            'release-relation-list': [
+                {'type': 'discogs', 'target': mb_id, 'release': {'id': mb_id}}
+                for mb_id in mb_ids
+            ]
+        }}
+
+    def get_release_by_id(self, id, includes=[], release_status=[],
+                          release_type=[]):
+        row = self._con.execute(
+            "SELECT payload FROM releases WHERE mb_id = ?", (id,)
+        ).fetchone()
+        if row is None:
+            raise ResponseError(f"No release {id} in the local index")
+        return {'release': json.loads(zlib.decompress(row[0]))}
+
+
+def musicbrainz_index():
+    """ The app's MusicbrainzIndex at MB_INDEX, opened once per process. """
+    if 'musicbrainz_index' not in app.extensions:
+        app.extensions['musicbrainz_index'] = MusicbrainzIndex(app.config['MB_INDEX'])
+    return app.extensions['musicbrainz_index']
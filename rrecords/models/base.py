@@ -1,14 +1,16 @@
 import re
-from itertools import accumulate
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from datetime import datetime
+from importlib import import_module
 from flask_login import UserMixin
 from flask import current_app as app
 
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy import (
-    Table, Column, ForeignKey, Integer, String, DateTime,
-    asc, desc
+    Table, Column, ForeignKey, Integer, String, DateTime, Boolean,
+    Index, UniqueConstraint, and_, or_, func, select, tuple_, update
 )
 
 from ..base import DiscogsClient
@@ -17,6 +19,166 @@ from .. import db
 def unique_field_value(model, field, value):
     return model.query.filter(getattr(model, field)==value).first() is None
 
+# Backends with INSERT .. ON CONFLICT, and where SQLAlchemy has it.
+_ON_CONFLICT_INSERTS = {
+    'sqlite': 'sqlalchemy.dialects.sqlite',
+    'postgresql': 'sqlalchemy.dialects.postgresql',
+}
+
+def upsert(table, index_elements, rows, update=None):
+    """ Inserts `rows` (a dict, or a list of them) into `table`. Rows
+    clashing on `index_elements` are skipped, or have the `update` columns
+    overwritten if given. For a single row inserted without `update`,
+    returns its primary key (None if it was skipped).
+
+    Uses INSERT .. ON CONFLICT where the backend has it. Elsewhere, rows
+    are looked up first; that's only safe with one writer at a time.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect not in _ON_CONFLICT_INSERTS:
+        return _select_then_insert(table, index_elements, rows, update)
+
+    insert = import_module(_ON_CONFLICT_INSERTS[dialect]).insert
+    stmt = insert(table)
+    if update:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={c: stmt.excluded[c] for c in update}
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+    result = db.session.execute(stmt, rows)
+    if isinstance(rows, dict) and not update and result.rowcount:
+        return result.inserted_primary_key[0]
+    return None
+
+def _select_then_insert(table, index_elements, rows, update=None):
+    single = isinstance(rows, dict)
+    key_columns = [table.c[c] for c in index_elements]
+    by_key = {}
+    for row in [rows] if single else rows:
+        by_key.setdefault(tuple(row[c] for c in index_elements), row)
+    if not by_key:
+        return None
+
+    if len(key_columns) == 1:
+        in_keys = key_columns[0].in_([key for key, in by_key])
+    else:
+        in_keys = tuple_(*key_columns).in_(list(by_key))
+    existing = {
+        tuple(key) for key in db.session.execute(select(*key_columns).where(in_keys))
+    }
+    if update:
+        for key in existing:
+            db.session.execute(
+                table.update()
+                .where(and_(*(c == v for c, v in zip(key_columns, key))))
+                .values({c: by_key[key][c] for c in update})
+            )
+
+    new = [row for key, row in by_key.items() if key not in existing]
+    if not new:
+        return None
+    result = db.session.execute(table.insert(), new)
+    if single and not update:
+        return result.inserted_primary_key[0]
+    return None
+
+_track_re = re.compile(r'(?P<t>\d+)$')
+_disc_re = re.compile(r'^(LP-)?(?P<m>[a-zA-Z0-9]+)')
+_vinyl_disc_re = re.compile(r'^([a-zA-Z])\1*$')
+
+def parse_position(position):
+    """ Splits a tracklist position (e.g. 'A1', 'CD2-3', '1-04') into its
+    disc / side id, track number, and whether it looks like a vinyl side.
+    """
+    position = position or ''
+    m1 = re.search(_track_re, position)
+    m2 = re.match(_disc_re, position[:None if m1 is None else m1.span()[0]])
+    disc_id = "?" if m2 is None else m2.groups()[-1]
+    track_number = -1 if m1 is None else int(m1.group('t'))
+    return disc_id, track_number, re.match(_vinyl_disc_re, disc_id) is not None
+
+def resolve_disc_layout(positions, formats):
+    """ Works out which disc each track is on, in one pass over the
+    tracklist. Vinyl discs come first, each holding two consecutive sides,
+    then one disc per distinct id for everything else.
+
+    Args:
+        positions: tracklist positions, in tracklist order.
+        formats: (name, qty) for each of the release's formats.
+
+    Returns:
+        tracks: per track, the parsed position fields and `disc_number`.
+        discs: per disc, its `label` and the index of its entry in `formats`
+            (or None).
+    """
+    expanded = [
+        (i, name) for i, (name, qty) in enumerate(formats) for _ in range(qty or 0)
+    ]
+    vinyl_formats = [i for i, name in expanded if name in Format._vinyl_names]
+    other_formats = [i for i, name in expanded if name in Format._other_names]
+
+    tracks = [{
+        'disc_label': disc_id, 'track_no': track_number,
+        'on_vinyl': on_vinyl, 'sort_key': sort_key,
+    } for sort_key, (disc_id, track_number, on_vinyl) in enumerate(
+        parse_position(p) for p in positions
+    )]
+
+    discs, side, previous = [], -1, None
+    for track in (t for t in tracks if t['on_vinyl']):
+        side += track['disc_label'] != previous
+        previous = track['disc_label']
+        if side // 2 == len(discs):
+            discs.append({
+                'label': f"LP{len(discs)+1}",
+                'format': vinyl_formats[len(discs)] if len(discs) < len(vinyl_formats) else None,
+            })
+        track['disc_number'] = side // 2
+
+    n_vinyl, other_numbers = len(discs), {}
+    for track in (t for t in tracks if not t['on_vinyl']):
+        if track['disc_label'] not in other_numbers:
+            d_idx = len(other_numbers)
+            other_numbers[track['disc_label']] = n_vinyl + d_idx
+            discs.append({
+                'label': track['disc_label'],
+                'format': other_formats[d_idx] if d_idx < len(other_formats) else None,
+            })
+        track['disc_number'] = other_numbers[track['disc_label']]
+
+    return tracks, discs
+
+def _encode_cursor(value, id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return urlsafe_b64encode(json.dumps([value, id]).encode()).decode()
+
+def _decode_cursor(cursor, column):
+    try:
+        value, id = json.loads(urlsafe_b64decode(cursor.encode()))
+        if (value is not None) and isinstance(column.type, DateTime):
+            value = datetime.fromisoformat(value)
+        return value, int(id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor {cursor!r}") from e
+
+def _keyset_after(column, direction, value, id):
+    """ Rows after (value, id) under `column` / id ordering, with NULLs
+    ordered before any value.
+    """
+    if direction == 'asc':
+        if value is None:
+            return or_(column != None, and_(column == None, Release.id > id))
+        return or_(column > value, and_(column == value, Release.id > id))
+
+    if value is None:
+        return and_(column == None, Release.id < id)
+    return or_(
+        column < value, and_(column == value, Release.id < id), column == None
+    )
+
 release_to_collection = Table(
     "release_to_collection_associations",
     db.metadata,
@@ -40,11 +202,20 @@ format_to_description = Table(
     
 class Release(db.Model):
     __tablename__ = 'releases'
+    # One per browsable ordering, with id as the tie-breaker for keyset
+    # pagination (see Collection.page_releases).
+    __table_args__ = tuple(
+        Index(f'ix_releases_{field}_id', field, 'id')
+        for field in ['title', 'artists_sort', 'year', 'created_at']
+    )
     id = Column(Integer, primary_key=True)
     title = Column(String(255))
     artists_sort = Column(String(255))
     thumb = Column(String(255))
     cover_image = Column(String(255))
+    # sha1 of the cover in the local CoverStore (see covers.py), once it's
+    # been downloaded.
+    cover_sha = Column(String(40))
     year = Column(Integer)
     discogs_id = Column(Integer, unique=True, nullable=False)
     master_id = Column(Integer, nullable=False)
@@ -65,11 +236,17 @@ class Release(db.Model):
     )
 
     tracks = relationship(
-        "Track", back_populates="release", cascade='all, delete-orphan'
+        "Track", back_populates="release", cascade='all, delete-orphan',
+        order_by="[Track.sort_key, Track.id]"
     )
 
     formats = relationship(
-        "Format", back_populates="release"
+        "Format", back_populates="release", order_by="Format.id"
+    )
+
+    disc_layout = relationship(
+        "Disc", back_populates="release", cascade='all, delete-orphan',
+        order_by="Disc.number"
     )
 
     def __repr__(self):
@@ -92,7 +269,15 @@ class Release(db.Model):
 
     @property
     def discs(self):
-        return self._assign_tracks_to_discs()
+        if (not self.disc_layout) or any(t.disc_number is None for t in self.tracks):
+            return self._assign_tracks_to_discs()
+
+        discs = [{
+            'id': disc.label, 'format': disc.format, 'tracks': []
+        } for disc in self.disc_layout]
+        for track in self.tracks:
+            discs[track.disc_number]['tracks'].append(track)
+        return discs
 
     @property
     def discogs_url(self):
@@ -113,42 +298,62 @@ class Release(db.Model):
         return [track for track in self.tracks if not track.is_on_vinyl]
 
     def _assign_tracks_to_discs(self):
-
-        vinyl_discs = []
-        vinyl_ids = [track.disc_id for track in self.vinyl_tracks]
-        vinyl_formats = [
-            f_ for f in self.formats for f_ in [f]*f.qty if f_.name in Format._vinyl_names
-        ]
-
-        side_idxs = accumulate(
-            [vinyl_ids[i] != vinyl_ids[i-1] for i in range(len(vinyl_ids))]
+        """ Disc layout for releases that haven't been resolved yet. """
+        track_layout, disc_layout = resolve_disc_layout(
+            [t.position for t in self.tracks],
+            [(f.name, f.qty) for f in self.formats]
         )
-        disc_idxs = [(side-1)// 2 for side in list(side_idxs)]
-
-        for t_idx, d_idx in enumerate(disc_idxs):
-            if d_idx >= len(vinyl_discs):
-                vinyl_discs.append({
-                    'id': f"LP{d_idx+1}",
-                    'format': vinyl_formats[d_idx] if d_idx < len(vinyl_formats) else None,
-                    'tracks': [],
-                })
-            vinyl_discs[d_idx]['tracks'].append(self.vinyl_tracks[t_idx])
-
-        other_discs = {}
-        other_formats = [
-            f_ for f in self.formats for f_ in [f]*f.qty if f_.name in Format._other_names
+        discs = [{
+            'id': d['label'],
+            'format': None if d['format'] is None else self.formats[d['format']],
+            'tracks': [],
+        } for d in disc_layout]
+        for track, layout in zip(self.tracks, track_layout):
+            discs[layout['disc_number']]['tracks'].append(track)
+        return discs
+
+    def resolve_discs(self):
+        """ Stores each track's parsed position and disc, and the release's
+        disc table, so that rendering doesn't have to work them out.
+        """
+        track_layout, disc_layout = resolve_disc_layout(
+            [t.position for t in self.tracks],
+            [(f.name, f.qty) for f in self.formats]
+        )
+        for track, layout in zip(self.tracks, track_layout):
+            for field, value in layout.items():
+                setattr(track, field, value)
+
+        # Existing rows are reused by number: the unique (release, number)
+        # constraint would trip if new rows were flushed before old deletes.
+        existing = {disc.number: disc for disc in self.disc_layout}
+        self.disc_layout = [
+            existing.get(number) or Disc(number=number)
+            for number in range(len(disc_layout))
         ]
-        for t in self.nonvinyl_tracks:
-            other_discs.setdefault(t.disc_id, []).append(t)
+        for disc, d in zip(self.disc_layout, disc_layout):
+            disc.label = d['label']
+            disc.format = None if d['format'] is None else self.formats[d['format']]
 
-        other_discs = [{
-            'id': d_id,
-            'format': other_formats[d_idx] if d_idx < len(other_formats) else None,
-            'tracks': tracks,
-        } for d_idx, (d_id, tracks) in enumerate(other_discs.items())]
 
-        return vinyl_discs + other_discs
-        
+class Disc(db.Model):
+    __tablename__ = 'discs'
+    __table_args__ = (UniqueConstraint('release_id', 'number'),)
+    id = Column(Integer, primary_key=True)
+    release_id = Column(
+        Integer, 
+        ForeignKey('releases.id', onupdate="CASCADE", ondelete="CASCADE"),
+        nullable=False
+    )
+    number = Column(Integer, nullable=False)
+    label = Column(String(16))
+    format_id = Column(Integer, ForeignKey('formats.id'))
+
+    release = relationship("Release", back_populates="disc_layout")
+    format = relationship("Format")
+
+    def __repr__(self):
+        return f"<Disc {self.label} release={self.release_id}>"
 
 class Format(db.Model):
     __tablename__ = 'formats'
@@ -181,7 +386,7 @@ class Format(db.Model):
 class FormatDescription(db.Model):
     __tablename__ = 'format_descriptions'
     id = Column(Integer, primary_key=True)
-    text = Column(String(255))
+    text = Column(String(255), unique=True, index=True)
     formats = relationship(
         "Format", secondary=format_to_description,
         back_populates="descriptions"
@@ -200,11 +405,20 @@ class Track(db.Model):
     duration_s = Column(Integer)
     release_id = Column(
         Integer, 
-        ForeignKey('releases.id', onupdate="CASCADE", ondelete="CASCADE")
+        ForeignKey('releases.id', onupdate="CASCADE", ondelete="CASCADE"),
+        index=True
     )
     mb_match_id = Column(Integer, ForeignKey('mb_tracks.id'))
     mb_match_code = Column(Integer)
 
+    # Parsed from `position` and resolved against the release's formats by
+    # Release.resolve_discs().
+    sort_key = Column(Integer)
+    disc_label = Column(String(16))
+    track_no = Column(Integer)
+    on_vinyl = Column(Boolean)
+    disc_number = Column(Integer)
+
     release = relationship("Release", back_populates="tracks")
     mb_match = relationship("MusicbrainzTrack", back_populates="matches")
     scrobbyls = relationship("TrackScrobbyl", back_populates="track")
@@ -212,24 +426,17 @@ class Track(db.Model):
     def __repr__(self):
         return f"<Track(position='{self.position}', title='{self.title}')>"
 
-    _track_re = re.compile(r'(?P<t>\d+)$')
-    _disc_re = re.compile(r'^(LP-)?(?P<m>[a-zA-Z0-9]+)')
-    _vinyl_disc_re = re.compile(r'^([a-zA-Z])\1*$')
-
     @property
     def track_number(self):
-        m = re.search(self._track_re, self.position)    
-        if m is None:
-            return -1
-        return int(m.groups('t')[0])
+        if self.track_no is None:
+            return parse_position(self.position)[1]
+        return self.track_no
 
     @property
     def disc_id(self):
-        m1 = re.search(self._track_re, self.position)
-        m2 = re.match(self._disc_re, self.position[:None if m1 is None else m1.span()[0]])
-        if m2 is None:
-            return "?"
-        return m2.groups()[-1]
+        if self.disc_label is None:
+            return parse_position(self.position)[0]
+        return self.disc_label
         
     @property
     def disc_track_position(self):
@@ -237,10 +444,9 @@ class Track(db.Model):
 
     @property
     def is_on_vinyl(self):
-        try:
-            return re.match(self._vinyl_disc_re, self.disc_id) is not None
-        except:
-            pass
+        if self.on_vinyl is None:
+            return parse_position(self.position)[2]
+        return self.on_vinyl
 
     @property
     def musicbrainz_url(self):
@@ -285,6 +491,18 @@ class Collection(db.Model):
     discogs_id = Column(Integer, nullable=False, unique=True)
     resource_url = Column(String(length=255))
 
+    # High-water mark for incremental syncs: newest Discogs `date_added` seen
+    # and the remote instance count at the end of the last sync.
+    synced_until = Column(DateTime)
+    synced_count = Column(Integer)
+
+    # Kept up to date by the sync and match tasks, in the same transaction
+    # as the changes they count. `flask tasks rebuild_counts` recomputes them.
+    n_synced = Column(Integer, nullable=False, default=0, server_default='0')
+    n_matched = Column(Integer, nullable=False, default=0, server_default='0')
+    n_tracks = Column(Integer, nullable=False, default=0, server_default='0')
+    last_synced_at = Column(DateTime)
+
     user_id = Column(
         Integer,
         ForeignKey('users.id', onupdate="CASCADE", ondelete="CASCADE")
@@ -296,35 +514,85 @@ class Collection(db.Model):
         back_populates="collections"
     )
 
-    @hybrid_property
-    def n_synced(self):
-        return len(self.releases)
-
-    @hybrid_property
-    def n_matched(self):
-        return (
-            Release.query.join(Collection.releases)
-            .filter(Collection.id==self.id)
-            .filter(Release.mb_match != None)
-            .count()
+    @classmethod
+    def refresh_counts(cls, *ids):
+        """ Recomputes the counters of the given collections (all of them, if
+        none are given) with a single UPDATE.
+        """
+        collections = cls.__table__
+        members = release_to_collection.c
+        in_collection = members.collection_id==collections.c.id
+        stmt = update(collections).values(
+            n_synced=select(func.count())
+                .where(in_collection).scalar_subquery(),
+            n_matched=select(func.count())
+                .select_from(release_to_collection.join(Release))
+                .where(in_collection, Release.mb_match_id != None)
+                .scalar_subquery(),
+            n_tracks=select(func.count(Track.id))
+                .select_from(release_to_collection.join(
+                    Track, Track.release_id==members.release_id
+                ))
+                .where(in_collection).scalar_subquery(),
         )
+        if ids:
+            stmt = stmt.where(collections.c.id.in_(ids))
+        db.session.execute(stmt)
 
     @classmethod
-    def query_releases(cls, id, **order_kws):
-        _valid_fields = ['title', 'id', 'artists_sort', 'year', 'created_at']
-        _valid_directions = ['asc', 'desc']
-        ordering = []
-        for field, dir in order_kws.items():
-            if (field not in _valid_fields) | (dir not in _valid_directions):
-                raise ValueError
-            ordering.append(eval(dir)(field))
+    def count_matched(cls, release_id, delta=1):
+        """ Adjusts `n_matched` of every collection holding a release. """
+        db.session.execute(
+            update(cls.__table__)
+            .where(cls.__table__.c.id.in_(
+                select(release_to_collection.c.collection_id)
+                .where(release_to_collection.c.release_id==release_id)
+            ))
+            .values(n_matched=cls.__table__.c.n_matched + delta)
+        )
 
-        return (
-            Release.query.join(Collection.releases)
-            .filter(Collection.id==id)
-            .order_by(*ordering)
-            .all()
+    def synced_discogs_ids(self):
+        return {
+            discogs_id for discogs_id, in
+            db.session.query(Release.discogs_id)
+            .join(release_to_collection)
+            .filter(release_to_collection.c.collection_id==self.id)
+        }
+
+    _release_orderings = ['title', 'artists_sort', 'year', 'created_at']
+
+    @classmethod
+    def page_releases(cls, id, sort='created_at', direction='desc',
+                      after=None, limit=48, options=()):
+        """ One page of a collection's releases, ordered by `sort` then id,
+        starting after the opaque cursor `after`. NULLs sort first when
+        ascending, last when descending.
+
+        Returns:
+            releases, and the cursor for the next page (None on the last).
+        """
+        if (sort not in cls._release_orderings) or (direction not in ['asc', 'desc']):
+            raise ValueError(f"Can't order releases by {sort} {direction}")
+        column = getattr(Release, sort)
+
+        if direction == 'asc':
+            ordering = [column.asc().nullsfirst(), Release.id.asc()]
+        else:
+            ordering = [column.desc().nullslast(), Release.id.desc()]
+
+        query = (
+            Release.query.options(*options).join(release_to_collection)
+            .filter(release_to_collection.c.collection_id==id)
         )
+        if after is not None:
+            value, last_id = _decode_cursor(after, column)
+            query = query.filter(_keyset_after(column, direction, value, last_id))
+
+        releases = query.order_by(*ordering).limit(limit + 1).all()
+        if len(releases) <= limit:
+            return releases, None
+        releases = releases[:limit]
+        return releases, _encode_cursor(getattr(releases[-1], sort), releases[-1].id)
 
     def __repr__(self):
         return(
@@ -0,0 +1,39 @@
+""" Named eager-loading profiles: the relationships each serialization path
+reads, loaded up front so rendering a release costs a fixed number of
+queries however many tracks it has.
+"""
+from sqlalchemy.orm import joinedload, load_only, selectinload
+
+from .base import User, Release, Format, Track
+from .musicbrainz import MusicbrainzRelease
+
+# The logged-in user, with the collections listed in the navbar.
+CURRENT_USER = (
+    selectinload(User.collections),
+)
+
+# release_w_disc_schema, for the release page.
+RELEASE_PAGE = (
+    joinedload(Release.mb_match),
+    selectinload(Release.artists),
+    selectinload(Release.formats).selectinload(Format.descriptions),
+    selectinload(Release.disc_layout),
+    selectinload(Release.tracks).joinedload(Track.mb_match),
+)
+
+# Collection.page_releases, for the collection grid: covers and the
+# columns its cursors are built from.
+COLLECTION_GRID = (
+    load_only(
+        Release.id, Release.cover_image, Release.cover_sha, Release.title,
+        Release.artists_sort, Release.year, Release.created_at
+    ),
+)
+
+# MusicbrainzMatcher.match_release
+MATCHER = (
+    selectinload(Release.artists),
+    selectinload(Release.formats),
+    selectinload(Release.tracks),
+    joinedload(Release.mb_match).selectinload(MusicbrainzRelease.tracks),
+)
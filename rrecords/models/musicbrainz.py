@@ -1,13 +1,13 @@
 from sqlalchemy import Column, ForeignKey, Integer, String
-from sqlalchemy.orm import relationship
-from sqlalchemy_get_or_create import get_or_create
+from sqlalchemy.orm import relationship, selectinload
 
+from .base import upsert
 from .. import db
 
 class MusicbrainzRelease(db.Model):
     __tablename__ = 'mb_releases'
     id = Column(Integer, primary_key=True)
-    mb_id = Column(String(36))
+    mb_id = Column(String(36), unique=True, index=True)
     matches = relationship("Release", back_populates="mb_match")
 
     tracks = relationship(
@@ -20,17 +20,28 @@ class MusicbrainzRelease(db.Model):
 
     @classmethod
     def get_or_create(cls, release_data, commit=True):
-        tracks_data = release_data.pop('tracks', None)
-        mb_release, is_new = get_or_create(db.session, cls, **release_data)
+        """ Upserts the release and then all of its tracks in one statement,
+        both keyed on mb_id.
+        """
+        tracks_data = release_data.pop('tracks', None) or []
+        upsert(cls.__table__, ['mb_id'], release_data)
+        query = cls.query.filter(cls.mb_id==release_data['mb_id'])
 
-        if is_new:
-            for track_data in tracks_data:
-                mb_track, _ = get_or_create(
-                    db.session, MusicbrainzTrack, **track_data
-                )
-                mb_release.tracks.append(mb_track)
-
-        db.session.add(mb_release)
+        if tracks_data:
+            mb_release_id = query.with_entities(cls.id).scalar()
+            upsert(
+                MusicbrainzTrack.__table__, ['mb_id'],
+                [
+                    dict.fromkeys(MusicbrainzTrack._upsert_fields) | track_data
+                    | {'mb_release_id': mb_release_id}
+                    for track_data in tracks_data
+                ],
+                update=MusicbrainzTrack._upsert_fields
+            )
+        # Loaded with its tracks, which matching goes on to use.
+        mb_release = (
+            query.options(selectinload(cls.tracks)).populate_existing().one()
+        )
 
         if commit:
             db.session.commit()
@@ -40,7 +51,7 @@ class MusicbrainzRelease(db.Model):
 class MusicbrainzTrack(db.Model):
     __tablename__ = 'mb_tracks'
     id = Column(Integer, primary_key=True)
-    mb_id = Column(String(36))
+    mb_id = Column(String(36), unique=True, index=True)
     mb_release_id = Column(Integer, ForeignKey('mb_releases.id'))
     mb_release = relationship("MusicbrainzRelease", back_populates="tracks")
     title = Column(String(255))
@@ -51,5 +62,10 @@ class MusicbrainzTrack(db.Model):
     recording_mb_id = Column(String(36))
     matches = relationship("Track", back_populates="mb_match")
 
+    _upsert_fields = [
+        'mb_release_id', 'title', 'position', 'number', 'duration',
+        'duration_s', 'recording_mb_id'
+    ]
+
     def __repr__(self):
-        return f"<mbTrack {self.id} title=\"{self.title}\" pos=\"{self.position}\">"
\ No newline at end of file
+        return f"<mbTrack {self.id} title=\"{self.title}\" pos=\"{self.position}\">"
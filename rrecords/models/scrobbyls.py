@@ -1,5 +1,5 @@
-import numpy as np
 from datetime import datetime, timedelta, timezone
+from itertools import accumulate
 from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, asc, desc
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.associationproxy import association_proxy
@@ -90,12 +90,10 @@ class ReleaseScrobbyl(db.Model):
         
         tracks = [t for d in form['discs'] for t in d['tracks']]
         
-        track_durations = np.array([
-            timedelta(seconds=t['duration_s']) for t in tracks
-        ])
+        track_durations = [timedelta(seconds=t['duration_s']) for t in tracks]
 
         time_offset = timedelta(seconds=form['offset'])
-        total_duration = track_durations.sum()
+        total_duration = sum(track_durations, timedelta(0))
         if form['t0'] == "started":
             started = form['timestamp'] + time_offset
             ended = started + total_duration
@@ -107,15 +105,14 @@ class ReleaseScrobbyl(db.Model):
             id=None,
             user=user,
             release=Release.query.get(form['id']),
-            started_at=started,
-            ended_at=ended
+            start_time=started,
+            end_time=ended
         )
 
-        tracks_end = np.cumsum(track_durations)
-        tracks_start = np.insert(tracks_end, 0, timedelta(0))[:-1]
-        for i, track in enumerate(tracks):
-            t_start = started + tracks_start[i]
-            t_scrobbyl = TrackScrobbyl(started_at=t_start, track_id=track['id'])
+        tracks_start = accumulate(track_durations[:-1], initial=timedelta(0))
+        for track, track_start in zip(tracks, tracks_start):
+            t_start = started + track_start
+            t_scrobbyl = TrackScrobbyl(start_time=t_start, track_id=track['id'])
             r_scrobbyl.track_scrobbyls.append(t_scrobbyl)
 
         db.session.add(r_scrobbyl)
@@ -125,6 +122,6 @@ class ReleaseScrobbyl(db.Model):
         return r_scrobbyl
 
     def duration(self, format='%H:%M:%S'):
-        return strfdelta(self.ended_at - self.started_at, format)
+        return strfdelta(self.end_time - self.start_time, format)
 
 
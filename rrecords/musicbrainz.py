@@ -1,78 +1,216 @@
-from .models.base import Release, Collection
+import json
+import logging
+import re
+import time
+from collections import Counter
+from functools import lru_cache
+from hashlib import sha1
+from types import SimpleNamespace
+from uuid import uuid4
+from celery import chord, group
+from .models.base import Release, Collection, Format, release_to_collection
 from .models.musicbrainz import MusicbrainzRelease
+from .models.loading import MATCHER
 from .schemas.musicbrainz import mb_release_schema
+from .payloads import payload_store, MB_RELEASE, MB_URL
+from .mbindex import musicbrainz_index
+from .mbclient import musicbrainz_client
+from .locks import acquire, claim, renew, release as release_claim
+from .progress import Progress, MATCH
+from .signatures import match_lock, match_release_claim
+from .instrumentation import StageTimer
 from flask import current_app as app
 from musicbrainzngs import ResponseError as MusicBrainzResponseError
 
 from sqlalchemy_get_or_create import get_or_create
 
+log = logging.getLogger(__name__)
+
 import numpy as np
 
-from scipy.optimize import linear_sum_assignment
-from thefuzz.process import extractWithoutOrder
-from thefuzz.fuzz import ratio
+from rapidfuzz.process import cdist
+from rapidfuzz.fuzz import ratio
+from rapidfuzz.utils import default_process
 
 from . import db, celery
 
 _SCALE = 100
-
-def _fuzzy_distance_matrix(v1, v2):
-    return np.array([[
-        _SCALE-x[1] for x in extractWithoutOrder(item, v2, scorer=ratio)
-    ] for item in v1])
+_PAGE_SIZE = 25     # Search results per page (the MB default)
+_MAX_PAGES = 4
+
+_VERSION_RE = re.compile(
+    r'\s*([\(\[][^\)\]]*\b(remaster|feat\.?|featuring)[^\)\]]*[\)\]]'
+    r'|\s-\s[^-]*\bremaster.*$'
+    r'|\s(feat\.?|featuring|ft\.)\s.*$)',
+    flags=re.IGNORECASE
+)
+
+@lru_cache(maxsize=2**16)
+def _normalize_title(title):
+    """ Case folds and drops "(Remastered ...)" / "feat. ..." decorations,
+    which differ between Discogs and MusicBrainz more than the titles do.
+    """
+    return default_process(_VERSION_RE.sub('', title or ''))
+
+def _fuzzy_distance_matrix(v1, v2, workers=1):
+    return _SCALE - cdist(
+        v1, v2, scorer=ratio, processor=_normalize_title,
+        dtype=np.float64, workers=workers
+    )
 
 def _match_matrix(v1, v2):
-    return np.array([[
-        v1_item != v2_item for v2_item in v2
-    ] for v1_item in v1]) * _SCALE
+    return (np.asarray(v1)[:, None] != np.asarray(v2)[None, :]) * _SCALE
+
+def _duration_matrix(v1, v2):
+    """ Absolute difference in seconds, capped at _SCALE. Missing durations
+    count as a match, since there's nothing to go on.
+    """
+    d1 = np.array(v1, dtype=np.float64)
+    d2 = np.array(v2, dtype=np.float64)
+    return np.nan_to_num(
+        np.minimum(np.abs(d1[:, None] - d2[None, :]), _SCALE), nan=0.0
+    )
 
-def _track_distance_matrix(dc_release, mb_release):
 
-    title_distance = _fuzzy_distance_matrix(
-        [t.title for t in dc_release.tracks],
-        [t.title for t in mb_release.tracks]
-    )
+class TrackDistance():
+    """ Weighted (Discogs tracks x MusicBrainz tracks) distance matrix, on a
+    0 - _SCALE scale. Title similarity is computed on `workers` cores once
+    the matrix has at least `parallel_above` cells.
+    """
+
+    def __init__(self, title=0.9, position=0.1, duration=0.0,
+                 workers=-1, parallel_above=10000):
+        self.weights = {'title': title, 'position': position, 'duration': duration}
+        self.workers = workers
+        self.parallel_above = parallel_above
+
+    def __call__(self, dc_tracks, mb_tracks):
+        n_cells = len(dc_tracks) * len(mb_tracks)
+        distance = self.weights['title'] * _fuzzy_distance_matrix(
+            [t.title for t in dc_tracks],
+            [t.title for t in mb_tracks],
+            workers=self.workers if n_cells >= self.parallel_above else 1
+        )
 
-    position_match = _match_matrix(
-        [t.position for t in dc_release.tracks],
-        [t.position for t in mb_release.tracks]
-    )
+        if self.weights['position']:
+            distance += self.weights['position'] * _match_matrix(
+                [t.position for t in dc_tracks],
+                [t.position for t in mb_tracks]
+            )
 
-    return (
-        0.9 * title_distance + \
-        0.1 * position_match
-    )
+        if self.weights['duration']:
+            distance += self.weights['duration'] * _duration_matrix(
+                [t.duration_s for t in dc_tracks],
+                [t.duration_s for t in mb_tracks]
+            )
+
+        return distance
+
+_track_distance = TrackDistance()
+
+def _assign(distances):
+    """ Lowest-cost track assignment. SciPy takes a while to import, so it
+    isn't until something is actually being matched.
+    """
+    from scipy.optimize import linear_sum_assignment
+    return linear_sum_assignment(distances)
+
+def _track_distance_matrix(dc_release, mb_release, engine=None):
+    return (engine or _track_distance)(dc_release.tracks, mb_release.tracks)
 
 
 class MusicbrainzNGS():
-    import musicbrainzngs as MB
 
-    def __init__(self):
-        self.MB.set_useragent(
-            app.config['NAME'], 
-            app.config['VERSION'], 
-            app.config['AUTHOR'],
-        )
+    def __init__(self, backend=None):
+        """ `backend` stands in for the musicbrainzngs module, e.g. a local
+        MusicbrainzIndex. Defaults to the index at MB_INDEX if configured,
+        otherwise the shared rate-limited / caching client.
+        """
+        self._store = None
+        if backend is None:
+            if app.config.get('MB_INDEX'):
+                backend = musicbrainz_index()
+            else:
+                backend = musicbrainz_client()
+                self._store = payload_store()
+        self.MB = backend
+        self.counts = Counter()
+
+    @property
+    def cache_hits(self):
+        """ Requests the backend answered from its own cache, if it has one. """
+        return getattr(self.MB, 'hits', 0)
+
+    def _request(self, fetch_fn):
+        """ Calls the backend, counting it as a request unless its own cache
+        answered.
+        """
+        cache_hits = self.cache_hits
+        result = fetch_fn()
+        self.counts['mb_requests'] += self.cache_hits == cache_hits
+        return result
+
+    def _fetch(self, source, resource_id, fetch_fn):
+        if self._store is None:
+            return self._request(fetch_fn)
+        requested = []
+        def request(etag):
+            requested.append(etag)
+            return self._request(fetch_fn), None
+
+        payload = self._store.fetch(source, resource_id, request)
+        self.counts['payload_store_hits'] += not requested
+        return payload
+
+    def search_releases(self, **kwargs):
+        return self._request(lambda: self.MB.search_releases(**kwargs))
 
     def get_release_data(self, mb_release_id):
 
         if mb_release_id is None:
             return None
 
-        r = self.MB.get_release_by_id(
+        r = self._fetch(MB_RELEASE, mb_release_id, lambda: self.MB.get_release_by_id(
             mb_release_id,
             includes=['recordings']
-        )['release']
+        )['release'])
 
         return r
     
     def search_by_url(self, url, **kwargs):
-        return self.MB.browse_urls(url, **kwargs)
+        key = sha1(json.dumps([url, kwargs], sort_keys=True).encode()).hexdigest()
+        return self._fetch(
+            MB_URL, key, lambda: self.MB.browse_urls(url, **kwargs)
+        )
+
+def _has_vinyl(summary):
+    return any(
+        'vinyl' in ({'format': ''} | f)['format'].lower()
+        for f in summary.get('medium-list', [])
+    )
+
+def _summary_score(release, attributes, summary):
+    """ 0 - 1 score for a search result, using only what's in the summary. """
+    is_vinyl = any(f.name in Format._vinyl_names for f in release.formats)
+    title_similarity = ratio(
+        attributes['release'], summary.get('title', ''),
+        processor=_normalize_title
+    ) / 100
+    features = [
+        (0.35, int(summary['ext:score']) / 100),
+        (0.25, summary.get('medium-track-count') == attributes['tracks']),
+        (0.1, summary.get('medium-count') == attributes['mediums']),
+        (0.1, _has_vinyl(summary) == is_vinyl),
+        (0.1, str(summary.get('date', '')).startswith(str(attributes['date']))),
+        (0.1, title_similarity),
+    ]
+    return sum(weight * float(value) for weight, value in features)
 
 class MusicbrainzMatcher():
 
-    def __init__(self):
-        self._mb = MusicbrainzNGS()
+    def __init__(self, mb=None, timer=None):
+        self._mb = mb or MusicbrainzNGS()
+        self.timer = timer or StageTimer('match_release')
 
     def match_release_by_url(self, url):
         try: 
@@ -85,7 +223,7 @@ class MusicbrainzMatcher():
         
         results = results['url']['release-relation-list']
         if len(results) > 1:
-            print(f"WARNING: Multiple URL matches for {url}; taking first.")
+            log.warning("Multiple URL matches for %s; taking first.", url)
             # insert logic to test the various matches and select best
             results = [results[0]] # for now, take first
 
@@ -118,51 +256,119 @@ class MusicbrainzMatcher():
         'tracks': release.n_tracks,
     }
 
-    def find_best_matching_release(self, release, threshold_score=90):
+    def _track_confidence(self, release, mb_release_data):
+        """ 0 - 1, from how well the tracks line up under the assignment that
+        match_tracks would make, scaled down if the track counts differ.
+        """
+        mb_tracks = [
+            SimpleNamespace(**t) for t in
+            mb_release_schema.load(mb_release_data)['tracks']
+        ]
+        if not (mb_tracks and release.tracks):
+            return 0.0
+
+        with self.timer.stage('distance_matrix'):
+            distances = _track_distance(release.tracks, mb_tracks)
+        with self.timer.stage('assignment'):
+            dc_idx, mb_idx = _assign(distances)
+        coverage = min(len(mb_tracks), len(release.tracks)) / max(len(mb_tracks), len(release.tracks))
+        return (1 - distances[dc_idx, mb_idx].mean() / _SCALE) * coverage
+
+    def _candidates(self, release, attributes, threshold_score, confidence, decision):
+        """ Pages through search results (sorted by ext:score), scoring each
+        summary cheaply. Stops at the first page with a confident candidate,
+        or once results drop below `threshold_score`.
+        """
+        candidates = []
+        for page in range(_MAX_PAGES):
+            results = self._mb.search_releases(
+                **attributes, strict=False,
+                limit=_PAGE_SIZE, offset=page*_PAGE_SIZE
+            )
+            decision['pages'] += 1
+            page_results = results['release-list']
+            above_threshold = [
+                r for r in page_results if int(r['ext:score']) > threshold_score
+            ]
+            candidates += [
+                (_summary_score(release, attributes, r), r) for r in above_threshold
+            ]
+            if (
+                (len(above_threshold) < _PAGE_SIZE) or
+                any(score >= confidence for score, _ in candidates)
+            ):
+                break
+
+        return sorted(candidates, key=lambda c: -c[0])
+
+    def find_best_matching_release(self, release, threshold_score=90,
+                                   confidence=0.85, max_fetches=3):
+        self.last_decision = decision = {
+            'release_id': release.id, 'method': None, 'mb_id': None,
+            'pages': 0, 'fetches': 0,
+        }
 
         # First, try matching based on the discogs URL
-        mb_id = self.match_release_by_url(release.discogs_url)
+        with self.timer.stage('mb_url_lookup'):
+            mb_id = self.match_release_by_url(release.discogs_url)
         if mb_id is not None:
+            decision |= {'method': 'url', 'mb_id': mb_id}
             return (mb_id, 101)
 
         attributes = self._extract_attributes(release)
-        results = self._mb.MB.search_releases(**attributes, strict=False)
-        potential_matches = [
-            # should probably loop over pages here, we're currently only 
-            # looking at the first (best?) 25 items.
-            r for r in results['release-list'] if int(r['ext:score']) > threshold_score
-        ]
-        
-        if len(potential_matches) == 0:
-            return None
-
-        def has_vinyl(r):
-            return any(
-                ['vinyl' in ({'format': ''} | f)['format'].lower() for f in r['medium-list']]
+        with self.timer.stage('mb_search'):
+            candidates = self._candidates(
+                release, attributes, threshold_score, confidence, decision
             )
+        if len(candidates) == 0:
+            return None
 
-        for item in potential_matches:
-            if has_vinyl(item) & (item['medium-track-count'] == attributes['tracks']):
-                return (item['id'], int(item['ext:score']))
-
-        return (potential_matches[0]['id'], int(potential_matches[0]['ext:score']))
+        # Only now fetch full releases, best cheap score first, until one
+        # is confidently the same release once its tracks are compared.
+        best = None
+        for score, summary in candidates[:max_fetches]:
+            with self.timer.stage('mb_release_fetch'):
+                mb_release_data = self._mb.get_release_data(summary['id'])
+            decision['fetches'] += 1
+            combined = (score + self._track_confidence(release, mb_release_data)) / 2
+            if (best is None) or (combined > best[0]):
+                best = (combined, summary, mb_release_data)
+            if combined >= confidence:
+                break
+
+        combined, summary, mb_release_data = best
+        decision |= {
+            'method': 'search', 'mb_id': summary['id'],
+            'confidence': round(float(combined), 3),
+            # Handed to match_release, so it isn't fetched again.
+            'mb_release': mb_release_data,
+        }
+        return (summary['id'], int(summary['ext:score']))
         
     def match_release(self, release):
-        id, _code = self.find_best_matching_release(release)
+        id, _code = self.find_best_matching_release(release) or (None, None)
         if id is not None:
-            print(f"Found: {release}")
-            mb_release_data = mb_release_schema.load(
-                self._mb.get_release_data(id)
-            )
-
-            mb_release = MusicbrainzRelease.get_or_create(mb_release_data, commit=False)
-
+            # Only a URL match hasn't fetched the release already.
+            mb_release_data = self.last_decision.pop('mb_release', None)
+            if mb_release_data is None:
+                with self.timer.stage('mb_release_fetch'):
+                    mb_release_data = self._mb.get_release_data(id)
+                self.last_decision['fetches'] += 1
+            mb_release_data = mb_release_schema.load(mb_release_data)
+
+            with self.timer.stage('db_write'):
+                mb_release = MusicbrainzRelease.get_or_create(mb_release_data, commit=False)
+
+            was_matched = release.is_matched
             release.mb_match = mb_release
             release.mb_match_code = _code
 
             self.match_tracks(release)
+            if not was_matched:
+                Collection.count_matched(release.id)
 
-            db.session.commit()
+            with self.timer.stage('commit'):
+                db.session.commit()
             return True
         return False
 
@@ -171,8 +377,10 @@ class MusicbrainzMatcher():
             raise AttributeError(f"{release} must be matched.")
             # Alternatively, could initiate matching here.
 
-        distances = _track_distance_matrix(release, release.mb_match)
-        dc_idx, mb_idx = linear_sum_assignment(distances)
+        with self.timer.stage('distance_matrix'):
+            distances = _track_distance_matrix(release, release.mb_match)
+        with self.timer.stage('assignment'):
+            dc_idx, mb_idx = _assign(distances)
         for i in range(len(dc_idx)):
             idc, imb = dc_idx[i], mb_idx[i]
             release.tracks[idc].mb_match = release.mb_match.tracks[imb]
@@ -185,16 +393,104 @@ class MusicbrainzMatcher():
 #     m = MusicbrainzMatcher()
 #     m.match_release(Release.query.get(release_id))
 
+@celery.task(name='scrobbylr.musicbrainz.match_release')
+def musicbrainz_match_release_task(release_id, lease=None, collection_id=None):
+    """ Matches one release. Safe to run more than once, or at the same time
+    as another task for the same release: only one of them does the work.
+    `lease` (key, token) is the collection match claim to keep alive, and
+    `collection_id` the collection match to report progress to.
+    """
+    ttl = app.config.get('TASK_LEASE_TTL', 60)
+    with claim(match_release_claim(release_id), ttl=ttl, renew=True) as claimed:
+        if lease is not None:
+            renew(*lease, app.config.get('MATCH_LEASE_TTL', 600))
+        status = _match_release(release_id) if claimed else 'in_progress'
+
+    if collection_id is not None:
+        Progress(MATCH, collection_id).incr(
+            done=1, n_matched=int(status == 'matched')
+        )
+    return status
+
+def _match_release(release_id):
+    release = Release.query.options(*MATCHER).get(release_id)
+    if release is None:
+        return 'missing'
+    if release.is_matched:
+        return 'skipped'
+
+    timer = StageTimer('match_release')
+    matcher = MusicbrainzMatcher(timer=timer)
+    cache_hits = matcher._mb.cache_hits
+    try:
+        matched = matcher.match_release(release)
+    except Exception as e:
+        db.session.rollback()
+        log.warning("Matching release %s failed: %r", release_id, e)
+        status = 'failed'
+    else:
+        status = 'matched' if matched else 'unmatched'
+
+    timer.events.update(matcher._mb.counts)
+    timer.count('mb_cache_hits', matcher._mb.cache_hits - cache_hits)
+    timer.finish(
+        n_releases=1, release_id=release_id, status=status,
+        decision=getattr(matcher, 'last_decision', None)
+    )
+    return status
+
+@celery.task(name='scrobbylr.musicbrainz.collect_matches', bind=True)
+def collect_matches_task(self, results, collection_id, started=None):
+    counts = Counter(results)
+    timer = StageTimer('match_collection', started=started)
+    timer.events.update(counts)
+    timer.finish(n_releases=len(results), collection_id=collection_id)
+    Progress(MATCH, collection_id).finish(
+        n_matched=Collection.query.get(collection_id).n_matched
+    )
+    if self.request.id is not None:
+        release_claim(match_lock(collection_id), self.request.id)
+    return {'collection_id': collection_id} | counts
+
 @celery.task(name='scrobbylr.musicbrainz.match_releases', bind=True)
 def musicbrainz_match_releases_task(self, collection_id):
-    mb = MusicbrainzMatcher()
+    """ Matches a collection's unmatched releases. The collection's match
+    claim is held from here until collect_matches_task, renewed by each
+    release task; a duplicate returns without doing anything.
+    """
+    key, token = match_lock(collection_id), self.request.id or uuid4().hex
+    ttl = app.config.get('MATCH_LEASE_TTL', 600)
+    if acquire(key, token, ttl) != token:
+        return 'duplicate'
+
+    try:
+        release_ids = [id for id, in (
+            db.session.query(Release.id)
+            .join(release_to_collection)
+            .filter(release_to_collection.c.collection_id==collection_id)
+            .filter(Release.mb_match_id==None)
+        )]
+    except Exception:
+        release_claim(key, token)
+        raise
+    if not release_ids:
+        release_claim(key, token)
+        return collect_matches_task([], collection_id)
+
     collection = Collection.query.get(collection_id)
-    n_releases = collection.n_synced
-    for i, release in enumerate(collection.releases):
-        if not release.is_matched:
-            mb.match_release(release)
-        self.update_state(
-            state='PROGRESS', 
-            meta={'progress': (i+1)*100.0/n_releases, 'matched': i}
-        )
-    return True
\ No newline at end of file
+    Progress(MATCH, collection_id).start(
+        done=0, total=len(release_ids), n_matched=collection.n_matched,
+        n_synced=collection.n_synced
+    )
+
+    # The chord's callback takes over this task's id, so the collection
+    # match counts as in progress until every release has been tried.
+    return self.replace(chord(
+        group(
+            musicbrainz_match_release_task.s(
+                id, lease=(key, token), collection_id=collection_id
+            )
+            for id in release_ids
+        ),
+        collect_matches_task.s(collection_id, time.time())
+    ))
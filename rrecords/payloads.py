@@ -0,0 +1,102 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+from flask import current_app as app
+from .helpers import write_atomic
+
+# Payload sources
+DISCOGS_RELEASE = 'discogs-release'
+MB_RELEASE = 'musicbrainz-release'
+MB_URL = 'musicbrainz-url'
+
+
+class PayloadStore():
+    """ Local store of raw API payloads. Payloads are kept gzipped under the
+    sha1 of their content (objects/ab/ab12...json.gz), and an index file per
+    (source, resource id) points at the current one along with its ETag and
+    when it was fetched.
+    """
+
+    def __init__(self, root, ttl=None):
+        self.root = root
+        self.ttl = ttl
+
+    def _index_path(self, source, resource_id):
+        return os.path.join(self.root, 'index', source, f"{resource_id}.json")
+
+    def _object_path(self, sha):
+        return os.path.join(self.root, 'objects', sha[:2], f"{sha}.json.gz")
+
+    def _entry(self, source, resource_id):
+        try:
+            with open(self._index_path(source, resource_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _is_fresh(self, entry):
+        return (self.ttl is None) or (time.time() - entry['fetched_at'] < self.ttl)
+
+    def _load(self, sha):
+        with gzip.open(self._object_path(sha), 'rt') as f:
+            return json.load(f)
+
+    def get(self, source, resource_id, fresh_only=True):
+        entry = self._entry(source, resource_id)
+        if (entry is None) or (fresh_only and not self._is_fresh(entry)):
+            return None
+        return self._load(entry['sha'])
+
+    def put(self, source, resource_id, payload, etag=None):
+        content = json.dumps(payload, sort_keys=True).encode()
+        sha = hashlib.sha1(content).hexdigest()
+        if not os.path.exists(self._object_path(sha)):
+            write_atomic(self._object_path(sha), gzip.compress(content))
+
+        write_atomic(
+            self._index_path(source, resource_id),
+            json.dumps(
+                {'sha': sha, 'etag': etag, 'fetched_at': time.time()}
+            ).encode()
+        )
+        return sha
+
+    def fetch(self, source, resource_id, fetch_fn):
+        """ Returns the stored payload if it's fresh. Otherwise calls
+        `fetch_fn(etag)`, which should return `(payload, etag)`, or
+        `(None, etag)` if the server says the stored payload is unchanged.
+        """
+        entry = self._entry(source, resource_id)
+        if (entry is not None) and self._is_fresh(entry):
+            return self._load(entry['sha'])
+
+        payload, etag = fetch_fn(entry['etag'] if entry else None)
+        if payload is None:
+            payload = self._load(entry['sha'])
+        self.put(source, resource_id, payload, etag=etag)
+        return payload
+
+    def resource_ids(self, source):
+        try:
+            names = os.listdir(os.path.join(self.root, 'index', source))
+        except FileNotFoundError:
+            return []
+        return [n[:-len('.json')] for n in names if n.endswith('.json')]
+
+    def items(self, source):
+        for resource_id in self.resource_ids(source):
+            yield resource_id, self.get(source, resource_id, fresh_only=False)
+
+
+def payload_store():
+    """ The app's PayloadStore, or None if PAYLOAD_STORE is disabled. """
+    if 'payload_store' not in app.extensions:
+        root = app.config.get(
+            'PAYLOAD_STORE', os.path.join(app.instance_path, 'payloads')
+        )
+        app.extensions['payload_store'] = root and PayloadStore(
+            root, ttl=app.config.get('PAYLOAD_STORE_TTL', None)
+        )
+    return app.extensions['payload_store']
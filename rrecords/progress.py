@@ -0,0 +1,138 @@
+""" Live progress of collection syncs / matches. Tasks keep it in a Redis
+hash per collection and publish it to the collection's channel, which the
+collection page follows over Server-Sent Events.
+"""
+import json
+from flask import current_app as app
+from .locks import has_redis, redis_client
+from .signatures import sync_lock, match_lock
+
+SYNC = 'sync'
+MATCH = 'match'
+
+_LOCKS = {SYNC: sync_lock, MATCH: match_lock}
+
+def _key(kind, collection_id):
+    return f"rrecords:progress:{kind}:collection:{collection_id}"
+
+def channel(collection_id):
+    return f"rrecords:progress:collection:{collection_id}"
+
+
+class Progress():
+    """ Progress of one sync / match of a collection. Updates from every
+    process working on it are published at most once per `interval`
+    seconds (PROGRESS_INTERVAL); `start` and `finish` always are. Without
+    Redis there's nothing to keep it in, or follow it through, and it's
+    dropped.
+    """
+
+    def __init__(self, kind, collection_id, interval=None, ttl=24*60*60):
+        self.kind = kind
+        self.collection_id = collection_id
+        self.interval = interval or app.config.get('PROGRESS_INTERVAL', 0.25)
+        self.ttl = ttl
+        self._redis = redis_client() if has_redis() else None
+        self._key = _key(kind, collection_id)
+
+    def _set(self, fields):
+        self._redis.hset(
+            self._key, mapping={k: json.dumps(v) for k, v in fields.items()}
+        )
+        self._redis.expire(self._key, self.ttl)
+
+    def _publish(self, force=False):
+        throttled = not self._redis.set(
+            f"{self._key}:published", 1, nx=True, px=int(self.interval * 1000)
+        )
+        if throttled and not force:
+            return
+        self._redis.publish(
+            channel(self.collection_id),
+            json.dumps(_event(self.kind, self.collection_id, self.get()))
+        )
+
+    def get(self):
+        if self._redis is None:
+            return {}
+        return {
+            k.decode(): json.loads(v)
+            for k, v in self._redis.hgetall(self._key).items()
+        }
+
+    def start(self, **fields):
+        if self._redis is None:
+            return
+        self._redis.delete(self._key)
+        self._set({'state': 'running'} | fields)
+        self._publish(force=True)
+
+    def update(self, **fields):
+        if self._redis is None:
+            return
+        self._set(fields)
+        self._publish()
+
+    def incr(self, **fields):
+        """ Adds to counters, e.g. releases done by concurrent tasks. """
+        if self._redis is None:
+            return
+        pipeline = self._redis.pipeline()
+        for field, n in fields.items():
+            pipeline.hincrby(self._key, field, n)
+        pipeline.execute()
+        self._publish()
+
+    def finish(self, **fields):
+        if self._redis is None:
+            return
+        self._set({'state': 'done'} | fields)
+        self._publish(force=True)
+
+
+def _event(kind, collection_id, progress):
+    return {'kind': kind, 'collection_id': int(collection_id)} | progress
+
+def snapshot(collection_id):
+    """ The progress of each kind of task for a collection. `running` comes
+    from whether its lock is held (a task that died without finishing leaves
+    its progress behind); a finished task's counts are already in the DB.
+    Empty without Redis.
+    """
+    if not has_redis():
+        return {}
+    redis = redis_client()
+    progress = {}
+    for kind, lock in _LOCKS.items():
+        running = bool(redis.exists(lock(collection_id)))
+        fields = {
+            k.decode(): json.loads(v)
+            for k, v in redis.hgetall(_key(kind, collection_id)).items()
+        } if running else {}
+        progress[kind] = _event(kind, collection_id, fields) | {'running': running}
+    return progress
+
+def stream(collection_id, heartbeat=15):
+    """ Server-Sent Events: the current snapshot, then every update
+    published for the collection. A comment every `heartbeat` seconds
+    keeps proxies from closing an idle stream.
+    """
+    pubsub = redis_client().pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(channel(collection_id))
+    events = list(snapshot(collection_id).values())
+
+    def generate():
+        try:
+            for event in events:
+                yield f"event: {event['kind']}\ndata: {json.dumps(event)}\n\n"
+            while True:
+                message = pubsub.get_message(timeout=heartbeat)
+                if message is None:
+                    yield ": heartbeat\n\n"
+                    continue
+                event = json.loads(message['data'])
+                yield f"event: {event['kind']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            pubsub.close()
+
+    return generate()
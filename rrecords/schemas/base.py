@@ -78,8 +78,10 @@ class CollectionSchema(DiscogsSchema):
     discogs_id = auto_field()
     resource_url = auto_field()
     count = auto_field()
-    n_synced = fields.Integer()
-    n_matched = fields.Integer()
+    n_synced = auto_field(dump_only=True)
+    n_matched = auto_field(dump_only=True)
+    n_tracks = auto_field(dump_only=True)
+    last_synced_at = auto_field(dump_only=True)
 
 collection_schema = CollectionSchema(many=True)
 
@@ -0,0 +1,29 @@
+""" The Celery tasks the web app enqueues, by name, and the locks they hold.
+Enqueuing through these doesn't import the task modules, or the matching
+stack (NumPy, SciPy, rapidfuzz) they load; only worker processes need those.
+"""
+from . import celery
+
+SYNC_COLLECTION = 'scrobblyr.discogs.sync_collection'
+MATCH_RELEASES = 'scrobbylr.musicbrainz.match_releases'
+REFRESH_DISCOGS_IDENTITY = 'scrobbylr.discogs.refresh_identity'
+FETCH_COVERS = 'scrobbylr.covers.fetch_covers'
+
+sync_collection_task = celery.signature(SYNC_COLLECTION)
+match_releases_task = celery.signature(MATCH_RELEASES)
+refresh_discogs_identity_task = celery.signature(REFRESH_DISCOGS_IDENTITY)
+fetch_covers_task = celery.signature(FETCH_COVERS)
+
+# Held by the task (queued or running) syncing / matching a collection.
+def sync_lock(collection_id):
+    return f"rrecords:lock:sync:collection:{collection_id}"
+
+def match_lock(collection_id):
+    return f"rrecords:lock:match:collection:{collection_id}"
+
+def covers_lock(collection_id):
+    return f"rrecords:lock:covers:collection:{collection_id}"
+
+# Held while one release is being matched.
+def match_release_claim(release_id):
+    return f"rrecords:claim:match:release:{release_id}"
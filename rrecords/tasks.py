@@ -26,4 +26,137 @@ def fix_releases():
                 except AssertionError:
                     print("WARNING: SOMETHING")
 
+        release.resolve_discs()
         db.session.commit()
+
+@tasks_bp.cli.command('rebuild_counts')
+def rebuild_counts():
+    """ Recomputes every collection's synced / matched / track counters. """
+    from .models.base import Collection
+    Collection.refresh_counts()
+    db.session.commit()
+    print(f"Rebuilt counters for {Collection.query.count()} collections")
+
+@tasks_bp.cli.command('resolve_discs')
+@click.option("--chunk", default=500, help="Releases per transaction")
+@click.option("--all", "all_", is_flag=True, help="Also redo resolved releases")
+def resolve_discs(chunk, all_):
+    """ Stores the disc / side layout of releases that don't have one yet. """
+    from sqlalchemy.orm import selectinload
+
+    query = Release.query.options(
+        selectinload(Release.tracks), selectinload(Release.formats),
+        selectinload(Release.disc_layout)
+    ).order_by(Release.id)
+    if not all_:
+        query = query.filter(~Release.disc_layout.any())
+
+    last_id, n_resolved = 0, 0
+    while True:
+        releases = query.filter(Release.id > last_id).limit(chunk).all()
+        if not releases:
+            break
+        for release in releases:
+            release.resolve_discs()
+        last_id = releases[-1].id
+        n_resolved += len(releases)
+        db.session.commit()
+        print(f"Resolved {n_resolved} releases")
+
+@tasks_bp.cli.command('load_mb_index')
+@click.argument("dump_path")
+@click.option("--index", default=None, help="Index file (default: MB_INDEX)")
+def load_mb_index(dump_path, index):
+    """ Loads a MusicBrainz release JSON dump into the local match index. """
+    from flask import current_app as app
+    from .mbindex import MusicbrainzIndex
+    index = index or app.config.get('MB_INDEX')
+    if index is None:
+        raise click.UsageError("Set MB_INDEX or pass --index")
+    n_added = MusicbrainzIndex(index).load(dump_path)
+    print(f"Added {n_added} releases to {index}")
+
+@tasks_bp.cli.command('rederive')
+def rederive():
+    """ Rebuilds releases / tracks / MB tracks from stored API payloads. """
+    from sqlalchemy.orm import selectinload
+    from .models.musicbrainz import MusicbrainzRelease
+    from .schemas.base import release_w_track_schema, track_schema
+    from .schemas.musicbrainz import mb_release_schema
+    from .payloads import payload_store, DISCOGS_RELEASE, MB_RELEASE
+
+    release_fields = [
+        'title', 'artists_sort', 'thumb', 'cover_image', 'year', 'master_id'
+    ]
+    track_fields = ['position', 'type', 'title', 'duration', 'duration_s']
+    mb_track_fields = [
+        'title', 'position', 'number', 'duration', 'duration_s',
+        'recording_mb_id'
+    ]
+
+    store = payload_store()
+    releases = {r.discogs_id: r for r in Release.query.options(
+        selectinload(Release.tracks), selectinload(Release.formats),
+        selectinload(Release.disc_layout)
+    )}
+    for i, (discogs_id, payload) in enumerate(store.items(DISCOGS_RELEASE)):
+        release = releases.get(int(discogs_id))
+        if release is None:
+            continue
+
+        data = release_w_track_schema.load(payload)
+        for field in release_fields:
+            setattr(release, field, data.get(field))
+
+        tracks_data = [t for t in (
+            track_schema.load(t) for t in payload.get('tracklist', [])
+        ) if t['type'] == 'track']
+        if len(tracks_data) != release.n_tracks:
+            print(f"WARNING: {release} track count differs from payload")
+            continue
+
+        for track, track_data in zip(release.tracks, tracks_data):
+            for field in track_fields:
+                setattr(track, field, track_data.get(field))
+        release.resolve_discs()
+
+        if i % 100 == 99:
+            db.session.commit()
+
+    mb_releases = {r.mb_id: r for r in MusicbrainzRelease.query.options(
+        selectinload(MusicbrainzRelease.tracks)
+    )}
+    for i, (mb_id, payload) in enumerate(store.items(MB_RELEASE)):
+        mb_release = mb_releases.get(mb_id)
+        if mb_release is None:
+            continue
+
+        mb_tracks = {t.mb_id: t for t in mb_release.tracks}
+        for track_data in mb_release_schema.load(payload)['tracks']:
+            mb_track = mb_tracks.get(track_data['mb_id'])
+            if mb_track is not None:
+                for field in mb_track_fields:
+                    setattr(mb_track, field, track_data.get(field))
+
+        if i % 100 == 99:
+            db.session.commit()
+
+    db.session.commit()
+    print("Done. Re-run fix_releases to re-apply manual overrides.")
+
+@tasks_bp.cli.command('serve_fixtures')
+@click.option("--host", default='127.0.0.1')
+@click.option("--port", default=8099, type=int)
+@click.option("--latency-ms", default=None, type=float, help="Default: TRANSPORT_LATENCY_MS")
+@click.option("--error-rate", default=None, type=float, help="Default: TRANSPORT_ERROR_RATE")
+def serve_fixtures(host, port, latency_ms, error_rate):
+    """ Serves recorded API responses to workers with TRANSPORT_MODE = 'stub'. """
+    from flask import current_app as app
+    from .transport import from_config, serve
+    transport = from_config(app, mode='replay')
+    if latency_ms is not None:
+        transport.latency_ms = latency_ms
+    if error_rate is not None:
+        transport.error_rate = error_rate
+    print(f"Serving {transport.fixtures.root} on http://{host}:{port}")
+    serve(transport, host=host, port=port)
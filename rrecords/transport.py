@@ -0,0 +1,368 @@
+""" Record / replay transport for the Discogs, MusicBrainz and Last.fm
+clients, so that sync and match can run (and be profiled) offline.
+
+TRANSPORT_MODE selects what happens to every API request:
+
+    record  make the real request, and save the response under
+            TRANSPORT_FIXTURES (one JSON-lines file per service)
+    replay  answer from the fixtures, after TRANSPORT_LATENCY_MS (+/-
+            TRANSPORT_JITTER_MS), failing TRANSPORT_ERROR_RATE of requests
+            and any beyond TRANSPORT_RATE_LIMITS ({service: requests/s})
+            with a rate-limit error
+    stub    ask the fixture server at TRANSPORT_STUB_URL (started with
+            `flask tasks serve_fixtures`), which replays as above but with
+            one latency / rate-limit budget for every worker
+
+Requests are keyed by method, URL and body, minus credentials and
+signatures, so fixtures recorded by one user replay for another.
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from urllib.request import Request, urlopen
+
+DISCOGS = 'discogs'
+MUSICBRAINZ = 'musicbrainz'
+LASTFM = 'lastfm'
+
+# Left out of request keys: they differ per user / per request.
+_SECRET_PARAMS = {
+    'api_key', 'api_sig', 'sk', 'token', 'oauth_consumer_key', 'oauth_nonce',
+    'oauth_signature', 'oauth_signature_method', 'oauth_timestamp',
+    'oauth_token', 'oauth_version',
+}
+
+# Status each service answers with when rate limited.
+_RATE_LIMITED = {DISCOGS: 429, MUSICBRAINZ: 503, LASTFM: 429}
+
+_RECORDED_HEADERS = [
+    'Content-Type', 'ETag', 'X-Discogs-Ratelimit',
+    'X-Discogs-Ratelimit-Used', 'X-Discogs-Ratelimit-Remaining',
+]
+
+
+class FixtureMissing(KeyError):
+    pass
+
+
+def request_key(method, url, body=None):
+    parts = urlsplit(url)
+    query = urlencode(sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k not in _SECRET_PARAMS
+    ))
+    if isinstance(body, dict):
+        body = {k: v for k, v in body.items() if k not in _SECRET_PARAMS}
+    body_hash = '' if body is None else hashlib.sha1(
+        json.dumps(body, sort_keys=True, default=str).encode()
+    ).hexdigest()[:12]
+    url = urlunsplit((parts.scheme, parts.netloc, parts.path, query, ''))
+    return f"{method} {url} {body_hash}".rstrip()
+
+
+class Fixtures():
+    """ Recorded responses, per service. Identical requests replay their
+    responses in the order they were recorded; the last one repeats.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._responses = {}
+        self._replayed = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def _path(self, service):
+        return os.path.join(self.root, f"{service}.jsonl")
+
+    def _load(self, service):
+        if service not in self._responses:
+            responses = defaultdict(list)
+            try:
+                with open(self._path(service)) as f:
+                    for line in f:
+                        entry = json.loads(line)
+                        responses[entry.pop('key')].append(entry)
+            except FileNotFoundError:
+                pass
+            self._responses[service] = responses
+        return self._responses[service]
+
+    def get(self, service, key):
+        with self._lock:
+            responses = self._load(service).get(key)
+            if not responses:
+                raise FixtureMissing(f"No {service} fixture for {key}")
+            i = self._replayed[service, key]
+            self._replayed[service, key] += 1
+            return responses[min(i, len(responses) - 1)]
+
+    def add(self, service, key, response):
+        with self._lock:
+            self._load(service)[key].append(response)
+            os.makedirs(self.root, exist_ok=True)
+            with open(self._path(service), 'a') as f:
+                f.write(json.dumps({'key': key} | response) + '\n')
+
+
+class Transport():
+    """ Routes API requests according to `mode` (see the module docstring).
+    `send()` makes the real request and returns `(status, headers, body)`;
+    it's only called when recording.
+    """
+
+    def __init__(self, mode, fixtures=None, latency_ms=0, jitter_ms=0,
+                 error_rate=0.0, rate_limits=None, stub_url=None, seed=0):
+        self.mode = mode
+        self.fixtures = fixtures
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limits = rate_limits or {}
+        self.stub_url = stub_url
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._next_slot = defaultdict(float)
+
+    def _rate_limited(self, service):
+        rate = self.rate_limits.get(service)
+        with self._lock:
+            if self._rng.random() < self.error_rate:
+                return True
+            if not rate:
+                return False
+            now = time.monotonic()
+            if now < self._next_slot[service]:
+                return True
+            self._next_slot[service] = now + 1 / rate
+            return False
+
+    def replay(self, service, method, url, body=None):
+        with self._lock:
+            delay = self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)
+        time.sleep(max(delay, 0) / 1000)
+        if self._rate_limited(service):
+            return {
+                'status': _RATE_LIMITED[service],
+                'headers': {'Retry-After': '1'},
+                'body': json.dumps({'message': "Rate limit exceeded"}),
+            }
+        return self.fixtures.get(service, request_key(method, url, body))
+
+    def request(self, service, method, url, body=None, send=None):
+        if self.mode == 'replay':
+            return self.replay(service, method, url, body)
+
+        if self.mode == 'stub':
+            request = Request(
+                self.stub_url.rstrip('/') + '/request', method='POST',
+                data=json.dumps({
+                    'service': service, 'method': method, 'url': url,
+                    'body': body,
+                }, default=str).encode(),
+                headers={'Content-Type': 'application/json'},
+            )
+            try:
+                with urlopen(request) as response:
+                    return json.load(response)
+            except HTTPError as e:
+                if e.code == 404:
+                    raise FixtureMissing(json.load(e)['error']) from None
+                raise
+
+        status, headers, content = send()
+        response = {
+            'status': status,
+            'headers': {k: headers[k] for k in _RECORDED_HEADERS if k in headers},
+            'body': content.decode() if isinstance(content, bytes) else content,
+        }
+        if (self.mode == 'record') and (status < 500) and (status != 429):
+            self.fixtures.add(service, request_key(method, url, body), response)
+        return response
+
+
+_transport = None
+
+def active_transport():
+    return _transport
+
+
+# Discogs: requests go through the client's fetcher.
+
+class TransportFetcher():
+    """ Wraps a discogs_client fetcher. Rate-limit headers from replayed
+    responses are set on the wrapped fetcher, as a live request would.
+    """
+
+    _max_attempts = 8
+
+    def __init__(self, fetcher, transport):
+        self._fetcher = fetcher
+        self._transport = transport
+
+    def __getattr__(self, name):
+        return getattr(self._fetcher, name)
+
+    def fetch(self, client, method, url, data=None, headers=None, **kwargs):
+        # kwargs: `json` / `json_format`, depending on the client version.
+        def send():
+            content, status = self._fetcher.fetch(
+                client, method, url, data=data, headers=headers, **kwargs
+            )
+            return status, {
+                'X-Discogs-Ratelimit': self._fetcher.rate_limit,
+                'X-Discogs-Ratelimit-Used': self._fetcher.rate_limit_used,
+                'X-Discogs-Ratelimit-Remaining': self._fetcher.rate_limit_remaining,
+            }, content
+
+        for attempt in range(self._max_attempts):
+            response = self._transport.request(DISCOGS, method, url, data, send)
+            if (response['status'] != 429) or not getattr(self._fetcher, 'backoff_enabled', True):
+                break
+            time.sleep(min(2 ** attempt, 30))
+
+        response_headers = response['headers']
+        self._fetcher.rate_limit = response_headers.get('X-Discogs-Ratelimit')
+        self._fetcher.rate_limit_used = response_headers.get('X-Discogs-Ratelimit-Used')
+        self._fetcher.rate_limit_remaining = response_headers.get('X-Discogs-Ratelimit-Remaining')
+        return response['body'].encode(), response['status']
+
+def wrap_fetcher(fetcher):
+    if (_transport is None) or isinstance(fetcher, TransportFetcher):
+        return fetcher
+    return TransportFetcher(fetcher, _transport)
+
+
+# MusicBrainz: musicbrainzngs reads every response through _safe_read(),
+# which retries 503s itself.
+
+def _install_musicbrainz(transport):
+    from musicbrainzngs import musicbrainz, compat
+
+    safe_read = musicbrainz._safe_read
+
+    class TransportOpener():
+        def __init__(self, opener):
+            self._opener = opener
+
+        def open(self, req, body=None):
+            def send():
+                f = self._opener.open(req, body) if body else self._opener.open(req)
+                return f.getcode(), dict(f.headers), f.read()
+
+            response = transport.request(
+                MUSICBRAINZ, req.get_method(), req.get_full_url(), body, send
+            )
+            if response['status'] >= 400:
+                raise compat.HTTPError(
+                    req.get_full_url(), response['status'], 'Replayed error',
+                    response['headers'], None
+                )
+            return _ReplayedResponse(response['body'].encode())
+
+    def transport_safe_read(opener, req, body=None, **kwargs):
+        return safe_read(TransportOpener(opener), req, body, **kwargs)
+
+    musicbrainz._safe_read = transport_safe_read
+
+class _ReplayedResponse():
+    def __init__(self, content):
+        self._content = content
+
+    def read(self):
+        return self._content
+
+
+# Last.fm: every pylast call is a _Request, POSTed by _download_response().
+
+def _install_lastfm(transport):
+    import pylast
+
+    download_response = pylast._Request._download_response
+
+    def transport_download_response(self):
+        host_name, host_subdir = self.network.ws_server
+        url = f"https://{host_name}{host_subdir}"
+
+        def send():
+            return 200, {}, download_response(self)
+
+        response = transport.request(LASTFM, 'POST', url, dict(self.params), send)
+        if response['status'] == 429:
+            raise pylast.WSError(self.network, '29', "Rate limit exceeded")
+        if response['status'] >= 500:
+            raise pylast.WSError(
+                self.network, response['status'],
+                f"Connection to the API failed with HTTP code {response['status']}"
+            )
+        if transport.mode != 'record':
+            self._check_response_for_errors(response['body'])
+        return response['body']
+
+    pylast._Request._download_response = transport_download_response
+
+
+def from_config(app, mode=None):
+    """ A Transport set up from the app's TRANSPORT_* config. """
+    return Transport(
+        mode or app.config.get('TRANSPORT_MODE'),
+        fixtures=Fixtures(app.config.get(
+            'TRANSPORT_FIXTURES', os.path.join(app.instance_path, 'fixtures')
+        )),
+        latency_ms=app.config.get('TRANSPORT_LATENCY_MS', 0),
+        jitter_ms=app.config.get('TRANSPORT_JITTER_MS', 0),
+        error_rate=app.config.get('TRANSPORT_ERROR_RATE', 0.0),
+        rate_limits=app.config.get('TRANSPORT_RATE_LIMITS', {}),
+        stub_url=app.config.get('TRANSPORT_STUB_URL'),
+        seed=app.config.get('TRANSPORT_SEED', 0),
+    )
+
+def install(app):
+    """ Routes the API clients through a Transport, if TRANSPORT_MODE is
+    set. Applies to the whole process.
+    """
+    global _transport
+    if (not app.config.get('TRANSPORT_MODE')) or (_transport is not None):
+        return
+
+    _transport = from_config(app)
+    _install_musicbrainz(_transport)
+    _install_lastfm(_transport)
+
+
+def serve(transport, host='127.0.0.1', port=8099):
+    """ Serves `transport.replay` over HTTP, for TRANSPORT_MODE = 'stub'. """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            try:
+                response = transport.replay(
+                    request['service'], request['method'], request['url'],
+                    request.get('body')
+                )
+                status = 200
+            except FixtureMissing as e:
+                response, status = {'error': str(e)}, 404
+
+            content = json.dumps(response).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
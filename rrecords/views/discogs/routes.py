@@ -8,6 +8,7 @@ from discogs_client.exceptions import HTTPError
 
 from . import discogs_bp
 from ... import db
+from ...accounts import invalidate
 from ...discogs import sync_folders_task
 
 @app.errorhandler(HTTPError)
@@ -20,23 +21,31 @@ def handle_bad_request(e):
 def login():
     print('logging in')
     client = current_user.open_discogs()
-    _, _, auth_url = client.get_authorize_url(
+    token, secret, auth_url = client.get_authorize_url(
         url_for('discogs_bp.auth', _external=True)
     )
-    session['discogs'] = client
+    # Just the request token: the client is rebuilt from it in auth().
+    session['discogs_oauth'] = {'token': token, 'secret': secret}
     return redirect(auth_url)
 
 @discogs_bp.route('auth', methods=["GET"])
 @login_required
 def auth():
     verifier = request.args.get('oauth_verifier')
-    client = session.pop('discogs')
+    request_token = session.pop('discogs_oauth', None)
+    if request_token is None:
+        flash("Discogs login expired, please try again")
+        return redirect(url_for('main_bp.profile'))
+    client = current_user.open_discogs()
+    client.set_token(request_token['token'], request_token['secret'])
 
     token, secret = client.get_access_token(verifier)
-    current_user.discogs_token = token
-    current_user.discogs_secret = secret
-    current_user.discogs_account = client.identity().username
+    user = current_user.row
+    user.discogs_token = token
+    user.discogs_secret = secret
+    user.discogs_account = client.identity().username
     db.session.commit()
+    invalidate(user.id, discogs=True)
 
     return redirect(url_for('discogs_bp.sync_folders'))
 
@@ -49,9 +58,11 @@ def sync_folders():
 @discogs_bp.route('logout', methods=["GET"])
 @login_required
 def logout():
-    current_user.discogs_token = None
-    current_user.discogs_secret = None
-    current_user.discogs_account = None
+    user = current_user.row
+    user.discogs_token = None
+    user.discogs_secret = None
+    user.discogs_account = None
     db.session.commit()
+    invalidate(user.id, discogs=True)
 
     return redirect(url_for('main_bp.profile'))
\ No newline at end of file
@@ -10,6 +10,7 @@ from ...lastfm import (LastFMNetwork, SessionKeyGenerator)
 
 from . import lastfm_bp
 from ... import db
+from ...accounts import invalidate
 # from ...discogs import sync_folders_task
 
 # @app.errorhandler(HTTPError)
@@ -45,7 +46,9 @@ def auth():
     keygen = SessionKeyGenerator(network)
     session_key = keygen.handshake_get_session_key(token)
     
-    current_user.lastfm_key = session_key
+    user = current_user.row
+    user.lastfm_key = session_key
     db.session.commit()
+    invalidate(user.id)
 
     return redirect(url_for('main_bp.profile'))
@@ -1,17 +1,27 @@
+import os
+import re
 from datetime import datetime, timezone
 from flask import (
-    render_template, session, url_for, abort, request, redirect, flash
+    Response, render_template, url_for, abort, request, redirect, flash,
+    send_file, current_app as app
 )
 from flask_login import login_required, current_user
 
 from . import main_bp
 from ... import db
 from ...models.base import Release, Collection
+from ...models.loading import RELEASE_PAGE, COLLECTION_GRID
 from ...models.scrobbyls import ReleaseScrobbyl
 from ...schemas.base import release_w_disc_schema, collection_schema
 from ...forms.forms import ScrobbylReleaseForm
-from ...discogs import sync_discogs_collection_task as sync_collection_task
-from ...musicbrainz import musicbrainz_match_releases_task as match_releases_task
+from ...signatures import (
+    sync_collection_task, match_releases_task, sync_lock, match_lock
+)
+from ...locks import enqueue_once, has_redis
+from ...covers import VARIANTS, FORMATS, cover_store
+from ...progress import (
+    SYNC, MATCH, snapshot as collection_progress, stream as stream_progress
+)
 
 @main_bp.route('/')
 def index():
@@ -28,72 +38,127 @@ def profile():
 @main_bp.route('/collections', methods=["GET"])
 @login_required
 def collections():
-    collections = collection_schema.dump(current_user.collections)
+    collections = collection_schema.dump(
+        Collection.query.filter_by(user_id=current_user.id)
+    )
     return render_template('collections.html', collections=collections)
 
-def _taskname(task_fn):
-    return task_fn.name[task_fn.name.rindex('.')+1:]
-
-def _task_in_progress(task_fn):
-    task_id = session.get(_taskname(task_fn), None)
-    if task_id is None:
-        return False
-    task = task_fn.AsyncResult(task_id)
-    if task.state in ['PROGRESS', 'PENDING']:
-        return True
-    elif task.state in ['SUCCESS']:
-        return False
-    else:
-        raise ValueError(f"Unexpected task state {task.state}")
+def _releases_page(id):
+    try:
+        releases, next_cursor = Collection.page_releases(
+            id,
+            sort=request.args.get('sort', 'created_at'),
+            direction=request.args.get('dir', 'desc'),
+            after=request.args.get('after'),
+            options=COLLECTION_GRID,
+        )
+    except ValueError:
+        abort(400)
 
+    thumbs = [
+        {'id': r.id, 'cover': r.cover_image, 'cover_sha': r.cover_sha}
+        for r in releases
+    ]
+    next_url = next_cursor and url_for(
+        'main_bp.collection_thumbs', id=id,
+        **(request.args.to_dict() | {'after': next_cursor})
+    )
+    return thumbs, next_url
 
 @main_bp.route('/collection/<id>', methods=["GET"])
 @login_required
 def collection(id):
-    collection = collection_schema.dump([Collection.query.get(id)])[0]
-    releases = Collection.query_releases(id, **request.args.to_dict())
-    thumbs = [{'id': r.id, 'cover': r.cover_image} for r in releases]
-    sync_in_progress = _task_in_progress(sync_collection_task)
-    match_in_progress =  _task_in_progress(match_releases_task)
+    collection = Collection.query.get(id)
+    if collection is None:
+        abort(404)
+    collection = collection_schema.dump([collection])[0]
+    thumbs, next_url = _releases_page(id)
+    progress = collection_progress(id)
     return render_template(
         'thumbs.html',
-        collection=collection, items=thumbs,
-        syncing=sync_in_progress, matching=match_in_progress
+        collection=collection, items=thumbs, next_url=next_url,
+        syncing=progress.get(SYNC, {}).get('running', False),
+        matching=progress.get(MATCH, {}).get('running', False),
     )
 
+@main_bp.route('/collection/<id>/thumbs', methods=["GET"])
+@login_required
+def collection_thumbs(id):
+    """ The next page of thumbnails, for infinite scrolling. """
+    thumbs, next_url = _releases_page(id)
+    return render_template('_thumbs.html', items=thumbs, next_url=next_url)
+
 @main_bp.route('/collection/<id>/update')
 @login_required
 def update_collection(id):
-    task = sync_collection_task.apply_async(args=[current_user.id, id])
-    session[_taskname(sync_collection_task)] = task.id
+    # A sync already queued or running for this collection (from another
+    # tab, a double click, ...) is followed instead of starting another.
+    enqueue_once(sync_lock(id), sync_collection_task, args=[current_user.id, id])
     return redirect(url_for('main_bp.collection', id=id))
 
 @main_bp.route('/collection/<id>/match')
 @login_required
 def match_collection(id):
-    if _task_in_progress(sync_collection_task):
+    if collection_progress(id).get(SYNC, {}).get('running', False):
         flash("Please wait for Discogs sync to finish")
     else:
-        task = match_releases_task.apply_async(args=[id])
-        session[_taskname(match_releases_task)] = task.id
+        enqueue_once(match_lock(id), match_releases_task, args=[id])
     return redirect(url_for('main_bp.collection', id=id))
 
+@main_bp.route('/collection/<id>/progress')
+@login_required
+def collection_progress_stream(id):
+    """ Server-Sent Events with the collection's sync / match progress. """
+    if Collection.query.get(id) is None:
+        abort(404)
+    if not has_redis():
+        # No progress to follow; 204 tells the browser not to reconnect.
+        return '', 204
+    return Response(
+        stream_progress(id), mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @main_bp.route('/release/<id>', methods=["GET", "POST"])
 @login_required
 def release(id):
-    release = release_w_disc_schema.dump(Release.query.get(id))
+    release = Release.query.options(*RELEASE_PAGE).get(id)
+    if release is None:
+        abort(404)
+    cover_sha = release.cover_sha
+    release = release_w_disc_schema.dump(release)
     form = ScrobbylReleaseForm(**release, offset=0)
     if request.method == "GET":
         return render_template(
-            'release.html', form=form
+            'release.html', form=form, cover_sha=cover_sha
         )
     elif request.method == "POST":
         form.timestamp.data = datetime.now(timezone.utc)
         if form.validate_on_submit():
-            scrobbyl = ReleaseScrobbyl.from_form(current_user, form)
+            scrobbyl = ReleaseScrobbyl.from_form(current_user.row, form)
             db.session.commit()
             return redirect(url_for('main_bp.release', id=id))
 
+_SHA = re.compile(r'[0-9a-f]{40}')
+
+@main_bp.route('/cover/<sha>/<variant>.<fmt>')
+def cover(sha, variant, fmt):
+    """ A stored cover. Its URL changes with its content, so it can be
+    cached for good.
+    """
+    if (not _SHA.fullmatch(sha)) or (variant not in VARIANTS) or (fmt not in FORMATS):
+        abort(404)
+    path = cover_store().path(sha, variant, fmt)
+    if not os.path.exists(path):
+        abort(404)
+    response = send_file(
+        path, mimetype=FORMATS[fmt], etag=f"{sha}-{variant}-{fmt}",
+        max_age=app.config.get('COVER_MAX_AGE', 365*24*60*60)
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 @main_bp.route('/admin')
 def admin():
     abort(404)
@@ -1,14 +1,32 @@
 import pytest
-from rrecords import create_app
+from contextlib import contextmanager
+from types import SimpleNamespace
+from sqlalchemy import event
+from sqlalchemy.orm import raiseload
+from rrecords import create_app, db
+
+def _raise_on_lazy_load(state):
+    if state.is_select and not (state.is_column_load or state.is_relationship_load):
+        state.statement = state.statement.options(raiseload('*', sql_only=True))
 
 @pytest.fixture()
-def app():
-    app = create_app()
-    app.config.update({
+def app(tmp_path):
+    # A database (and stores) of the test's own, never the configured one.
+    app = create_app({
         "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path}/test.db",
+        "SESSION_FILE_DIR": str(tmp_path / 'sessions'),
+        "PAYLOAD_STORE": str(tmp_path / 'payloads'),
+        "COVER_STORE": str(tmp_path / 'covers'),
     })
+    with app.app_context():
+        db.create_all()
 
+    # Relationships a view didn't ask to load raise instead of quietly
+    # running a query per row.
+    event.listen(db.session, 'do_orm_execute', _raise_on_lazy_load)
     yield app
+    event.remove(db.session, 'do_orm_execute', _raise_on_lazy_load)
 
 
 @pytest.fixture()
@@ -17,4 +35,95 @@ def client(app):
 
 @pytest.fixture()
 def runner(app):
-    return app.test_cli_runner()
\ No newline at end of file
+    return app.test_cli_runner()
+
+@pytest.fixture()
+def redis(app):
+    """ A fake Redis at REDIS_URL. Yields it inside an app context. """
+    import fakeredis
+    app.config['REDIS_URL'] = 'redis://localhost'
+    app.extensions['redis'] = fakeredis.FakeRedis()
+    with app.app_context():
+        yield app.extensions['redis']
+
+@pytest.fixture()
+def user(app):
+    """ The id of a user linked to a Discogs account. """
+    from rrecords.models.base import User
+
+    with app.app_context():
+        user = User(
+            name="u", email="u@test.com", password="asdfasdf",
+            discogs_token="token", discogs_secret="secret", discogs_account="u"
+        )
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+@pytest.fixture()
+def collection(app, user):
+    """ The id of an (empty) collection of `user`'s. """
+    from rrecords.models.base import Collection
+
+    with app.app_context():
+        collection = Collection(name="c", discogs_id=0, user_id=user)
+        db.session.add(collection)
+        db.session.commit()
+        return collection.id
+
+@pytest.fixture()
+def logged_in(client, user):
+    """ `client`, logged in as `user`. """
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user)
+    return client
+
+@pytest.fixture()
+def max_queries(app):
+    """ `with max_queries(n): ...` fails if the block runs more than n SQL
+    statements. Yields the statements run so far.
+    """
+    @contextmanager
+    def budget(n):
+        statements = []
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', count)
+        assert len(statements) <= n, "\n".join(
+            [f"{len(statements)} queries, expected at most {n}:"] + statements
+        )
+    return budget
+
+class Discogs():
+    """ Just enough of a Discogs client for the OAuth dance. """
+
+    def __init__(self):
+        self.tokens = []
+
+    def get_authorize_url(self, callback_url):
+        return "request-token", "request-secret", "https://discogs.test/authorize"
+
+    def set_token(self, token, secret):
+        self.tokens.append((token, secret))
+
+    def get_access_token(self, verifier):
+        return "access-token", "access-secret"
+
+    def identity(self):
+        return SimpleNamespace(username="discogs-user")
+
+@pytest.fixture()
+def discogs(monkeypatch):
+    """ The Discogs client every user opens, recording the tokens set. """
+    client = Discogs()
+    monkeypatch.setattr(
+        'rrecords.models.base.User.open_discogs', lambda self: client
+    )
+    return client
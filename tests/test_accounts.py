@@ -0,0 +1,105 @@
+import pytest
+from rrecords import db
+
+@pytest.fixture(params=['local', 'redis'])
+def cache(request, app):
+    """ The account cache, in this process or in (fake) Redis. """
+    if request.param == 'redis':
+        request.getfixturevalue('redis')
+    return request.param
+
+@pytest.fixture()
+def user_id(cache, user):
+    """ `user`, once the cache is set up. """
+    return user
+
+@pytest.fixture()
+def fetches(monkeypatch):
+    """ The ids of the users whose identity was fetched from Discogs. """
+    fetched = []
+    def fetch(user):
+        fetched.append(user.id)
+        return {'logged_in': True, 'username': "u", 'folders': []}
+    monkeypatch.setattr('rrecords.accounts._fetch_identity', fetch)
+    return fetched
+
+def test_principal_cached(app, user_id, max_queries):
+    from rrecords.accounts import UserPrincipal, invalidate
+    from rrecords.models.base import User
+
+    with app.app_context():
+        assert UserPrincipal.load(user_id).discogs_linked
+        with max_queries(0):
+            assert UserPrincipal.load(user_id).name == "u"
+
+        User.query.get(user_id).name = "v"
+        db.session.commit()
+        assert UserPrincipal.load(user_id).name == "u"
+        invalidate(user_id)
+        assert UserPrincipal.load(user_id).name == "v"
+
+def test_identity_cached(app, user_id, fetches):
+    from rrecords.accounts import UserPrincipal, discogs_identity, invalidate
+
+    with app.app_context():
+        user = UserPrincipal.load(user_id)
+        discogs_identity(user)
+        discogs_identity(user)
+        assert len(fetches) == 1
+        discogs_identity(user, max_age=0)
+        assert len(fetches) == 2
+
+        # Only dropped along with the principal when asked to.
+        invalidate(user_id)
+        discogs_identity(user)
+        assert len(fetches) == 2
+        invalidate(user_id, discogs=True)
+        discogs_identity(user)
+        assert len(fetches) == 3
+
+def test_logged_into_discogs(app, cache, user_id, fetches, monkeypatch):
+    from rrecords.accounts import UserPrincipal, account_cache, _discogs_key
+
+    refreshes = []
+    monkeypatch.setattr('rrecords.accounts._refresh_in_background', refreshes.append)
+    with app.app_context():
+        user = UserPrincipal.load(user_id)
+        # Nothing cached: looked up there and then.
+        assert user.logged_into_discogs()
+        assert (len(fetches), refreshes) == (1, [])
+
+        # Stale: answered from the cache, and refreshed by a worker if
+        # there's Redis to hand it to.
+        key = _discogs_key(user_id)
+        stale = account_cache().get(key) | {'logged_in': False, 'fetched_at': 0}
+        account_cache().set(key, stale, 60)
+        if cache == 'redis':
+            assert not user.logged_into_discogs()
+            assert (len(fetches), refreshes) == (1, [user_id])
+        else:
+            assert user.logged_into_discogs()
+            assert len(fetches) == 2
+
+def test_discogs_login_logout_invalidate(app, client, user_id, logged_in, discogs, fetches):
+    from rrecords.accounts import UserPrincipal, discogs_identity
+
+    with client.session_transaction() as session:
+        session['discogs_oauth'] = {'token': "t", 'secret': "s"}
+
+    def cached():
+        with app.app_context():
+            user = UserPrincipal.load(user_id)
+            discogs_identity(user)
+            return user.discogs_account, len(fetches)
+
+    assert cached() == ("u", 1)
+    response = client.get('/discogs/auth?oauth_verifier=v')
+    assert response.status_code == 302
+    assert cached() == ("discogs-user", 2)
+
+    client.get('/discogs/logout')
+    with app.app_context():
+        user = UserPrincipal.load(user_id)
+        assert not user.discogs_linked
+        assert not user.logged_into_discogs()
+    assert cached() == (None, 3)
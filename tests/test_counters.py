@@ -0,0 +1,85 @@
+import pytest
+from rrecords import db
+
+@pytest.fixture()
+def collections(app, user, collection):
+    """ Two collections sharing release 1; release 3 isn't in either yet. """
+    from rrecords.models.base import Collection, Release, Track
+
+    with app.app_context():
+        first = Collection.query.get(collection)
+        second = Collection(name="d", discogs_id=1, user_id=user)
+        db.session.add_all([
+            Release(
+                discogs_id=i, master_id=0, title=f"R{i}", collections=members,
+                tracks=[Track(position=f"A{t}", type='track') for t in range(i)]
+            )
+            for i, members in [(1, [first, second]), (2, [first]), (3, [])]
+        ])
+        db.session.flush()
+        Collection.refresh_counts()
+        db.session.commit()
+        return [first.id, second.id]
+
+def _counters(collection_id):
+    from rrecords.models.base import Collection
+    collection = Collection.query.get(collection_id)
+    return (collection.n_synced, collection.n_matched, collection.n_tracks)
+
+def _counted(collection_id):
+    """ The counters, from COUNT queries. """
+    from rrecords.models.base import Release, Track, release_to_collection
+
+    releases = (
+        db.session.query(Release.id)
+        .join(release_to_collection)
+        .filter(release_to_collection.c.collection_id==collection_id)
+    )
+    return (
+        releases.count(),
+        releases.filter(Release.mb_match_id != None).count(),
+        Track.query.filter(Track.release_id.in_(releases.scalar_subquery())).count(),
+    )
+
+def test_counters_follow_changes(app, collections):
+    from rrecords.discogs import _update_membership
+    from rrecords.models.base import Collection, Release
+    from rrecords.models.musicbrainz import MusicbrainzRelease
+
+    with app.app_context():
+        assert [_counters(id) for id in collections] == [(2, 0, 3), (1, 0, 1)]
+
+        # As a sync adds release 3 to the first collection ...
+        release_ids = {3: Release.query.filter_by(discogs_id=3).one().id}
+        _update_membership(collections[0], release_ids, set())
+        Collection.refresh_counts(collections[0])
+        db.session.commit()
+
+        # ... matching release 1 (in both) ...
+        release = Release.query.filter_by(discogs_id=1).one()
+        release.mb_match = MusicbrainzRelease(mb_id='mb-1')
+        Collection.count_matched(release.id)
+        db.session.commit()
+
+        # ... and a sync removing release 2.
+        _update_membership(collections[0], {}, {2})
+        Collection.refresh_counts(collections[0])
+        db.session.commit()
+
+        assert [_counters(id) for id in collections] == [(2, 1, 4), (1, 1, 1)]
+        for id in collections:
+            assert _counters(id) == _counted(id)
+
+def test_rebuild_counts(app, runner, collections):
+    from rrecords.models.base import Collection
+
+    with app.app_context():
+        expected = [_counted(id) for id in collections]
+        Collection.query.update({'n_synced': 9, 'n_matched': 9, 'n_tracks': 9})
+        db.session.commit()
+
+    result = runner.invoke(args=['tasks', 'rebuild_counts'])
+    assert result.exit_code == 0
+    assert "Rebuilt counters for 2 collections" in result.output
+    with app.app_context():
+        assert [_counters(id) for id in collections] == expected
@@ -0,0 +1,64 @@
+import io
+from PIL import Image
+from rrecords.covers import VARIANTS, FORMATS, cover_store
+
+def _jpeg(size):
+    out = io.BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(out, format='JPEG')
+    return out.getvalue()
+
+def test_store_variants(app):
+    with app.app_context():
+        store = cover_store()
+        content = _jpeg((1200, 900))
+        sha = store.put(content)
+        assert store.put(content) == sha
+
+        for variant, size in VARIANTS.items():
+            for fmt in FORMATS:
+                image = Image.open(store.path(sha, variant, fmt))
+                assert image.size == (size, size * 3 // 4)
+
+def test_cover_route_caching(app, client):
+    with app.app_context():
+        sha = cover_store().put(_jpeg((800, 800)))
+
+    response = client.get(f'/cover/{sha}/grid.webp')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/webp'
+    assert 'immutable' in response.headers['Cache-Control']
+    etag = response.headers['ETag']
+
+    response = client.get(
+        f'/cover/{sha}/grid.webp', headers={'If-None-Match': etag}
+    )
+    assert response.status_code == 304
+
+    assert client.get(f'/cover/{sha}/huge.webp').status_code == 404
+    assert client.get(f'/cover/{"0" * 40}/grid.jpeg').status_code == 404
+
+def test_fetch_covers_skips_empty_urls(app, collection, monkeypatch):
+    from rrecords import db
+    from rrecords.covers import CoverDownloader, fetch_covers
+    from rrecords.models.base import Collection, Release
+
+    fetched = []
+    def fetch(self, url):
+        fetched.append(url)
+        return "0" * 40
+    monkeypatch.setattr(CoverDownloader, '_fetch', fetch)
+
+    with app.app_context():
+        owner = db.session.get(Collection, collection)
+        db.session.add_all([
+            Release(discogs_id=i, master_id=0, title=f"R{i}", cover_image=url,
+                    collections=[owner])
+            for i, url in enumerate([None, '', 'https://i.discogs.test/2.jpeg'])
+        ])
+        db.session.commit()
+
+        assert fetch_covers(collection) == 1
+        assert fetched == ['https://i.discogs.test/2.jpeg']
+        assert [r.cover_sha for r in Release.query.order_by(Release.discogs_id)] == [
+            None, None, "0" * 40
+        ]
@@ -0,0 +1,32 @@
+import pytest
+
+@pytest.fixture()
+def base(app):
+    from rrecords.models import base
+    return base
+
+def test_parse_position(base):
+    assert base.parse_position('A1') == ('A', 1, True)
+    assert base.parse_position('CD2-3') == ('CD2', 3, False)
+    assert base.parse_position('1-04') == ('1', 4, False)
+    assert base.parse_position('') == ('?', -1, False)
+
+def test_vinyl_sides_pair_into_discs(base):
+    tracks, discs = base.resolve_disc_layout(
+        ['A1', 'A2', 'B1', 'C1', 'D1', 'D2'], [('Vinyl', 2)]
+    )
+    assert [t['disc_number'] for t in tracks] == [0, 0, 0, 1, 1, 1]
+    assert discs == [{'label': 'LP1', 'format': 0}, {'label': 'LP2', 'format': 0}]
+
+def test_single_side(base):
+    tracks, discs = base.resolve_disc_layout(['A1', 'A2'], [('Vinyl', 1)])
+    assert [t['disc_number'] for t in tracks] == [0, 0]
+    assert discs == [{'label': 'LP1', 'format': 0}]
+
+def test_other_discs_follow_vinyl(base):
+    tracks, discs = base.resolve_disc_layout(
+        ['A1', 'B1', '1-1', '1-2', '2-1'], [('Vinyl', 1), ('CD', 2)]
+    )
+    assert [t['disc_number'] for t in tracks] == [0, 0, 1, 1, 2]
+    assert [d['label'] for d in discs] == ['LP1', '1', '2']
+    assert [d['format'] for d in discs] == [0, 1, 1]
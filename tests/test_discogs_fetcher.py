@@ -0,0 +1,74 @@
+import pytest
+from types import SimpleNamespace
+
+class DiscogsObject():
+    """ A release that spends one request of the client's quota when
+    refreshed.
+    """
+
+    def __init__(self, client, id, refreshed=False):
+        self.client = client
+        self.id = id
+        self.data = {'id': id}
+        self.previous_request = f"/releases/{id}" if refreshed else None
+
+    def refresh(self):
+        quota = self.client._fetcher
+        if quota.rate_limit_remaining is not None:
+            quota.rate_limit_remaining -= 1
+        self.previous_request = f"/releases/{self.id}"
+
+def _client(remaining, limit=60):
+    return SimpleNamespace(_fetcher=SimpleNamespace(
+        rate_limit_remaining=remaining, rate_limit=limit
+    ))
+
+@pytest.fixture()
+def sleeps(app, monkeypatch):
+    from rrecords import discogs
+    slept = []
+    monkeypatch.setattr(discogs.time, 'sleep', slept.append)
+    return slept
+
+def _fetch(client, objects, reserve=5):
+    from rrecords.discogs import DiscogsFetcher
+    fetcher = DiscogsFetcher(client, max_workers=1, reserve=reserve)
+    fetched = list(fetcher.fetch(objects))
+    return fetcher, fetched
+
+def test_no_wait_above_reserve(sleeps):
+    client = _client(10)
+    fetcher, fetched = _fetch(client, [DiscogsObject(client, i) for i in range(5)])
+    assert sorted(o.id for o in fetched) == list(range(5))
+    assert fetcher.api_calls == 5
+    assert sleeps == []
+
+def test_waits_once_quota_is_low(sleeps):
+    # Requests 3 - 5 are made with at most 5 left: spaced out to 60 a minute.
+    client = _client(7, limit=60)
+    _fetch(client, [DiscogsObject(client, i) for i in range(5)])
+    assert sleeps == [1.0, 1.0, 1.0]
+
+    client = _client(2, limit=30)
+    _fetch(client, [DiscogsObject(client, 0)])
+    assert sleeps[3:] == [2.0]
+
+def test_unknown_limit_or_quota(sleeps):
+    # No limit header: one request a second.
+    client = _client(0, limit=None)
+    _fetch(client, [DiscogsObject(client, 0)])
+    assert sleeps == [1.0]
+
+    # No headers seen yet: no waiting.
+    client = _client(None, limit=None)
+    _fetch(client, [DiscogsObject(client, i) for i in range(3)])
+    assert sleeps == [1.0]
+
+def test_refreshed_objects_not_fetched(sleeps):
+    client = _client(0)
+    fetcher, fetched = _fetch(
+        client, [DiscogsObject(client, i, refreshed=True) for i in range(3)]
+    )
+    assert len(fetched) == 3
+    assert (fetcher.api_calls, sleeps) == (0, [])
+    assert client._fetcher.rate_limit_remaining == 0
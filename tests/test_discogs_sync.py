@@ -0,0 +1,83 @@
+import pytest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+MARK = datetime(2024, 1, 10)
+
+def _instance(id, days_after_mark):
+    return SimpleNamespace(id=id, date_added=MARK + timedelta(days=days_after_mark))
+
+class Listing():
+    """ A folder's instance listing, counting how many instances are read. """
+
+    def __init__(self, instances):
+        self.instances = instances
+        self.read = 0
+
+    def sort(self, key, order):
+        self.instances.sort(key=lambda i: i.date_added, reverse=order == 'desc')
+
+    def __iter__(self):
+        for instance in self.instances:
+            self.read += 1
+            yield instance
+
+def _folder(instances, id=0):
+    return SimpleNamespace(id=id, count=len(instances), releases=Listing(instances))
+
+# Synced at MARK, when the folder held these.
+SYNCED = [_instance(1, -30), _instance(2, -20), _instance(3, 0)]
+LOCAL_IDS = {1, 2, 3}
+
+@pytest.fixture()
+def sync(app):
+    # Imported once the app has set up every model.
+    from rrecords import discogs
+    return discogs
+
+def _delta(sync, folder):
+    seen, add_ids, remove_ids = sync._listing_delta(
+        folder, LOCAL_IDS, MARK, len(SYNCED)
+    )
+    return [i.id for i in seen], add_ids, remove_ids
+
+def test_scan_stops_at_mark(sync):
+    listing = Listing([_instance(4, 1), _instance(3, 0), _instance(2, -20)])
+    seen, n_newer, rest = sync._scan_instances(listing, MARK)
+    assert [i.id for i in seen] == [4, 3]
+    assert n_newer == 1
+    assert [i.id for i in rest] == [2]
+
+    seen, n_newer, rest = sync._scan_instances(Listing(list(SYNCED)), None)
+    assert (len(seen), n_newer, rest) == (3, 3, None)
+
+def test_nothing_changed(sync):
+    folder = _folder(list(SYNCED))
+    assert _delta(sync, folder) == ([3], set(), set())
+    assert folder.releases.read == 2
+
+def test_added(sync):
+    folder = _folder(list(SYNCED) + [_instance(4, 1), _instance(5, 2)])
+    assert _delta(sync, folder) == ([5, 4, 3], {4, 5}, set())
+    assert folder.releases.read == 4
+
+def test_removed(sync):
+    folder = _folder([SYNCED[0], SYNCED[2]])
+    assert _delta(sync, folder) == ([3, 1], set(), {2})
+
+def test_removed_and_added(sync):
+    folder = _folder([SYNCED[0], SYNCED[2], _instance(4, 1)])
+    assert _delta(sync, folder) == ([4, 3, 1], {4}, {2})
+
+def test_removed_and_older_moved_in(sync):
+    # Moved in from another folder, keeping its older date_added: the
+    # count is what it was, but the folder is still read in full.
+    folder = _folder([SYNCED[0], SYNCED[2], _instance(9, -25)], id=5)
+    assert _delta(sync, folder) == ([3, 9, 1], {9}, {2})
+    assert folder.releases.read == 3
+
+def test_full_sync_reads_everything(sync):
+    folder = _folder(list(SYNCED))
+    seen, add_ids, remove_ids = sync._listing_delta(folder, {1, 2, 3, 7})
+    assert (add_ids, remove_ids) == (set(), {7})
+    assert folder.releases.read == 3
@@ -0,0 +1,71 @@
+import discogs_client
+import pytest
+from rrecords import db
+
+def _release(client, discogs_id):
+    payload = {
+        'id': discogs_id,
+        'title': "Test",
+        'artists_sort': "Artist",
+        'artists': [
+            {'id': 1, 'name': "Artist"}, {'id': 2, 'name': "Other Artist"}
+        ],
+        'year': 2000,
+        'master_id': 10,
+        'cover_image': f"https://i.discogs.com/{discogs_id}.jpg",
+        'formats': [
+            {'name': 'Vinyl', 'qty': '2', 'descriptions': ['LP', 'Album']}
+        ],
+        'tracklist': [
+            {'position': position, 'type_': 'track', 'title': position, 'duration': '3:00'}
+            for position in ['A1', 'B1', 'C1', 'D1']
+        ],
+    }
+    release = discogs_client.Release(client, dict(payload))
+    release.previous_request = payload['cover_image']  # Never refreshed.
+    return release
+
+def _counts():
+    from rrecords.models.base import (
+        Release, Artist, FormatDescription, Format, Track, Disc,
+        artist_to_release, format_to_description
+    )
+    return {
+        table: db.session.query(table).count() for table in [
+            Release, Artist, FormatDescription, Format, Track, Disc,
+            artist_to_release, format_to_description
+        ]
+    }
+
+@pytest.fixture(params=['on_conflict', 'select_then_insert'])
+def upsert_path(request, monkeypatch):
+    if request.param == 'select_then_insert':
+        monkeypatch.setattr('rrecords.models.base._ON_CONFLICT_INSERTS', {})
+    return request.param
+
+def test_ingest_twice(app, upsert_path):
+    from rrecords.discogs import DiscogsIngest, add_from_discogs
+    from rrecords.models.base import (
+        Release, Artist, FormatDescription, artist_to_release
+    )
+    client = discogs_client.Client('rrecords-tests')
+
+    with app.app_context():
+        first = DiscogsIngest().add_many([_release(client, 1), _release(client, 2)])
+        db.session.commit()
+        counts = _counts()
+
+        # Another run (a new ingest, so nothing is remembered from the
+        # first) and a single release added again.
+        again = DiscogsIngest().add_many([_release(client, 1), _release(client, 2)])
+        db.session.commit()
+        release = add_from_discogs(_release(client, 2), commit=True)
+
+        assert again == first
+        assert release.id == first[2]
+        assert _counts() == counts
+        assert counts[Release] == 2
+        assert counts[Artist] == 2
+        assert counts[FormatDescription] == 2
+        assert counts[artist_to_release] == 4
+        assert Release.query.get(first[1]).artists_sort == "Artist"
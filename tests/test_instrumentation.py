@@ -0,0 +1,115 @@
+import json
+import logging
+import pytest
+from rrecords import create_app, db
+
+@pytest.fixture()
+def slow_query_app(tmp_path):
+    path = tmp_path / 'slow.log'
+    app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path}/test.db",
+        "SLOW_QUERY_MS": 0,
+        "SLOW_QUERY_LOG": str(path),
+    })
+    yield app, path
+    for handler in list(app.logger.handlers):
+        if isinstance(handler, logging.FileHandler):
+            app.logger.removeHandler(handler)
+            handler.close()
+
+def test_slow_query_log_handler_added_once(slow_query_app):
+    from rrecords import instrumentation
+    app, path = slow_query_app
+
+    def file_handlers():
+        return [
+            h for h in app.logger.handlers if isinstance(h, logging.FileHandler)
+        ]
+
+    assert len(file_handlers()) == 1
+    with app.app_context():
+        instrumentation.init_app(app, db.engine)
+        assert len(file_handlers()) == 1
+        assert app.after_request_funcs[None].count(instrumentation._record_request) == 1
+
+        db.session.execute(db.text("SELECT 42 AS answer"))
+        app.logger.warning("Not a slow query")
+    for handler in file_handlers():
+        handler.flush()
+
+    log = path.read_text()
+    assert log.count("AS answer") == 1
+    assert "Not a slow query" not in log
+
+class Clock():
+    """ Stands in for time.perf_counter / time.time, moved by hand. """
+
+    def __init__(self, now=100.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture()
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr('rrecords.instrumentation.time.perf_counter', clock)
+    monkeypatch.setattr('rrecords.instrumentation.time.time', clock)
+    return clock
+
+def _sample(name, **labels):
+    from prometheus_client import REGISTRY
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+def test_stage_timer(clock, caplog):
+    from rrecords.instrumentation import StageTimer
+
+    timer = StageTimer('test_task', started=clock.now - 1)
+    with timer.stage('fetch'):
+        clock.now += 2
+    with pytest.raises(ValueError):
+        with timer.stage('fetch'):
+            clock.now += 1
+            raise ValueError
+    with timer.stage('write'):
+        clock.now += 0.5
+
+    def items():
+        for item in range(2):
+            clock.now += 0.25
+            yield item
+    for item in timer.timed('wait', items()):
+        clock.now += 10
+    timer.count('api_calls')
+    timer.count('api_calls', 2)
+
+    before = _sample('rrecords_task_releases_total', task='test_task')
+    with caplog.at_level(logging.INFO, logger='rrecords.tasks'):
+        record = timer.finish(n_releases=9, collection_id=1)
+
+    assert record == {
+        'task': 'test_task', 'releases': 9, 'seconds': 25.0,
+        'releases_per_s': 0.36,
+        'stages': {'fetch': 3.0, 'wait': 0.5, 'write': 0.5},
+        'events': {'api_calls': 3}, 'collection_id': 1,
+    }
+    assert json.loads(caplog.records[-1].getMessage()) == record
+    assert _sample('rrecords_task_releases_total', task='test_task') == before + 9
+    assert _sample(
+        'rrecords_task_stage_seconds_sum', task='test_task', stage='fetch'
+    ) >= 3.0
+
+def test_queue_depths_from_broker(app, client):
+    import fakeredis
+    from rrecords.instrumentation import CELERY_QUEUE_DEPTH
+
+    # Locks etc. on one Redis, Celery's queues on another.
+    app.config['CELERY_BROKER_URL'] = 'redis://broker'
+    app.config['REDIS_URL'] = 'redis://locks'
+    app.extensions['redis'] = fakeredis.FakeRedis()
+    app.extensions['broker_redis'] = broker = fakeredis.FakeRedis()
+    broker.rpush('celery', 'a', 'b', 'c')
+
+    assert client.get('/metrics').status_code == 200
+    assert CELERY_QUEUE_DEPTH.labels('celery')._value.get() == 3
@@ -0,0 +1,114 @@
+import time
+import pytest
+
+class Signature():
+    """ Records what would have been enqueued. """
+
+    def __init__(self):
+        self.calls = []
+
+    def apply_async(self, args=(), task_id=None):
+        self.calls.append((list(args), task_id))
+
+def test_claim_refuses_second_holder(redis):
+    from rrecords.locks import claim
+
+    with claim('k') as first:
+        with claim('k') as second:
+            assert (first, second) == (True, False)
+        assert redis.get('k') is not None
+    assert redis.get('k') is None
+
+    with claim('k') as again:
+        assert again
+
+def test_claim_takes_over_enqueued_token(redis):
+    from rrecords.locks import claim, enqueue_once
+
+    signature = Signature()
+    task_id = enqueue_once('k', signature, args=[1])
+    with claim('k', token=task_id) as claimed:
+        assert claimed
+        assert enqueue_once('k', signature, args=[1]) == task_id
+    assert signature.calls == [([1], task_id)]
+    assert redis.get('k') is None
+
+def test_renew(redis):
+    from rrecords.locks import acquire, renew, claim
+
+    acquire('k', 'a', 1)
+    assert renew('k', 'a', 100)
+    assert redis.pttl('k') > 1000
+    assert not renew('k', 'b', 100)
+    assert not renew('other', 'a', 100)
+
+    # Outlives its ttl for as long as the block runs.
+    with claim('r', ttl=0.3, renew=True) as claimed:
+        time.sleep(0.6)
+        assert claimed
+        assert redis.get('r') is not None
+
+def test_enqueue_once_returns_existing_task(redis):
+    from rrecords.locks import enqueue_once, release
+
+    signature = Signature()
+    first = enqueue_once('k', signature, args=[1])
+    assert enqueue_once('k', signature, args=[1]) == first
+    assert signature.calls == [([1], first)]
+
+    release('k', first)
+    assert enqueue_once('k', signature, args=[1]) != first
+    assert len(signature.calls) == 2
+
+@pytest.mark.parametrize("action, task", [
+    ('update', 'sync_collection_task'), ('match', 'match_releases_task'),
+])
+def test_routes_enqueue_without_redis(logged_in, user, collection, monkeypatch, action, task):
+    signature = Signature()
+    monkeypatch.setattr(f'rrecords.views.main.routes.{task}', signature)
+    response = logged_in.get(f'/collection/{collection}/{action}')
+    assert response.status_code == 302
+    assert [args for args, _ in signature.calls] == [
+        [user, str(collection)] if action == 'update' else [str(collection)]
+    ]
+
+def test_claims_without_redis(app):
+    from rrecords.locks import has_redis, claim, acquire, renew, release, enqueue_once
+
+    with app.app_context():
+        assert not has_redis()
+        with claim('k', renew=True) as first, claim('k') as second:
+            assert first and second
+        assert acquire('k', 'a', 60) == 'a'
+        assert renew('k', 'b', 60)
+        release('k', 'a')
+
+        signature = Signature()
+        first, second = enqueue_once('k', signature), enqueue_once('k', signature)
+        assert first != second
+        assert [task_id for _, task_id in signature.calls] == [first, second]
+
+def test_tasks_run_without_redis(app, user, collection, monkeypatch):
+    from rrecords import covers, discogs, musicbrainz, db
+    from rrecords.models.base import Collection, Release
+
+    synced = []
+    monkeypatch.setattr(discogs, '_sync_collection', lambda *args: synced.append(args[1:]))
+    monkeypatch.setattr(musicbrainz, '_match_release', lambda release_id: 'matched')
+    monkeypatch.setattr(covers, 'fetch_covers', lambda collection_id: 0)
+
+    with app.app_context():
+        db.session.add(Release(
+            discogs_id=1, master_id=0, collections=[Collection.query.get(collection)]
+        ))
+        db.session.commit()
+
+        discogs.sync_discogs_collection_task.apply(args=[user, collection]).get()
+        assert synced == [(user, collection, True)]
+        assert musicbrainz.musicbrainz_match_release_task.apply(
+            args=[1], kwargs={'lease': ('k', 't'), 'collection_id': collection}
+        ).get() == 'matched'
+        assert musicbrainz.musicbrainz_match_releases_task.apply(
+            args=[collection]
+        ).get() == {'collection_id': collection, 'matched': 1}
+        assert covers.fetch_covers_task.apply(args=[collection]).get() == 0
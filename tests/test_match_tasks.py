@@ -0,0 +1,140 @@
+import json
+import logging
+import pytest
+from rrecords import db
+
+@pytest.fixture()
+def collection_id(redis, collection):
+    from rrecords.models.base import Collection
+    Collection.query.get(collection).n_matched = 3
+    db.session.commit()
+    return collection
+
+def _collect(results, collection_id, task_id):
+    from rrecords.musicbrainz import collect_matches_task
+    return collect_matches_task.apply(
+        args=[results, collection_id, 0.0], task_id=task_id
+    ).get()
+
+def test_collect_matches(redis, collection_id, caplog):
+    from rrecords.locks import acquire
+    from rrecords.progress import Progress, MATCH
+    from rrecords.signatures import match_lock
+
+    # Held since the match task, whose id the chord callback took over.
+    acquire(match_lock(collection_id), 'match-task', 600)
+    Progress(MATCH, collection_id).start(done=0, total=4)
+
+    results = ['matched', 'unmatched', 'matched', 'failed']
+    with caplog.at_level(logging.INFO, logger='rrecords.tasks'):
+        summary = _collect(results, collection_id, 'match-task')
+
+    assert summary == {
+        'collection_id': collection_id, 'matched': 2, 'unmatched': 1, 'failed': 1
+    }
+    assert redis.get(match_lock(collection_id)) is None
+    assert Progress(MATCH, collection_id).get() == {
+        'state': 'done', 'done': 0, 'total': 4, 'n_matched': 3
+    }
+    record = json.loads(caplog.records[-1].getMessage())
+    assert record['task'] == 'match_collection'
+    assert record['releases'] == 4
+    assert record['events'] == {'matched': 2, 'unmatched': 1, 'failed': 1}
+
+def test_collect_leaves_another_claim(redis, collection_id):
+    from rrecords.locks import acquire
+    from rrecords.signatures import match_lock
+
+    # A newer match took the claim over once this one's had lapsed.
+    acquire(match_lock(collection_id), 'newer-task', 600)
+    assert _collect([], collection_id, 'match-task') == {'collection_id': collection_id}
+    assert redis.get(match_lock(collection_id)) == b'newer-task'
+
+@pytest.fixture()
+def release_ids(redis, collection):
+    """ The collection's unmatched releases; it also has a matched one. """
+    from rrecords.models.base import Collection, Release
+    from rrecords.models.musicbrainz import MusicbrainzRelease
+
+    members = [Collection.query.get(collection)]
+    releases = [
+        Release(discogs_id=i, master_id=0, collections=members) for i in range(3)
+    ]
+    releases[2].mb_match = MusicbrainzRelease(mb_id='mb-2')
+    db.session.add_all(releases)
+    db.session.commit()
+    return [r.id for r in releases[:2]]
+
+@pytest.fixture()
+def matched(monkeypatch):
+    """ The ids of the releases matched (all of them successfully). """
+    from rrecords import musicbrainz
+    release_ids = []
+    def match(release_id):
+        release_ids.append(release_id)
+        return 'matched'
+    monkeypatch.setattr(musicbrainz, '_match_release', match)
+    return release_ids
+
+def test_match_releases_refuses_duplicate(redis, collection, release_ids, matched):
+    from rrecords.locks import acquire
+    from rrecords.musicbrainz import musicbrainz_match_releases_task
+    from rrecords.signatures import match_lock
+
+    acquire(match_lock(collection), 'running-task', 600)
+    result = musicbrainz_match_releases_task.apply(args=[collection], task_id='second')
+    assert result.get() == 'duplicate'
+    assert matched == []
+    assert redis.get(match_lock(collection)) == b'running-task'
+
+def test_match_releases_replaced_by_chord(redis, collection, release_ids, monkeypatch):
+    from rrecords.musicbrainz import musicbrainz_match_releases_task
+    from rrecords.signatures import match_lock
+
+    replaced = []
+    monkeypatch.setattr(musicbrainz_match_releases_task, 'replace', replaced.append)
+    musicbrainz_match_releases_task.apply(args=[collection], task_id='match-task')
+
+    [chord] = replaced
+    lease = (match_lock(collection), 'match-task')
+    assert sorted(
+        (task.task, task.args, task.kwargs) for task in chord.tasks
+    ) == [
+        ('scrobbylr.musicbrainz.match_release', (release_id,),
+         {'lease': lease, 'collection_id': collection})
+        for release_id in sorted(release_ids)
+    ]
+    assert chord.body.task == 'scrobbylr.musicbrainz.collect_matches'
+    assert chord.body.args[0] == collection
+    # Held until the chord's callback is done.
+    assert redis.get(match_lock(collection)) == b'match-task'
+
+def test_match_releases_runs_chord(redis, collection, release_ids, matched):
+    from rrecords.musicbrainz import musicbrainz_match_releases_task
+    from rrecords.signatures import match_lock
+
+    result = musicbrainz_match_releases_task.apply(args=[collection], task_id='match-task')
+    assert result.get() == {'collection_id': collection, 'matched': 2}
+    assert sorted(matched) == sorted(release_ids)
+    assert redis.get(match_lock(collection)) is None
+
+def test_claimed_release_skipped(redis, collection, release_ids, matched):
+    from rrecords.locks import acquire
+    from rrecords.musicbrainz import musicbrainz_match_release_task
+    from rrecords.progress import Progress, MATCH
+    from rrecords.signatures import match_lock, match_release_claim
+
+    acquire(match_lock(collection), 'match-task', 1)
+    acquire(match_release_claim(release_ids[0]), 'other-task', 60)
+    Progress(MATCH, collection).start(done=0, total=2)
+
+    status = musicbrainz_match_release_task.apply(
+        args=[release_ids[0]],
+        kwargs={'lease': (match_lock(collection), 'match-task'), 'collection_id': collection}
+    ).get()
+    assert status == 'in_progress'
+    assert matched == []
+    # Still counted as done, and the collection's lease still renewed.
+    assert Progress(MATCH, collection).get()['done'] == 1
+    assert redis.pttl(match_lock(collection)) > 1000
+    assert redis.get(match_release_claim(release_ids[0])) == b'other-task'
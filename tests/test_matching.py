@@ -0,0 +1,175 @@
+import pytest
+from collections import Counter
+from types import SimpleNamespace
+from rrecords import db
+
+TITLE = "Abbey Road"
+TRACKS = ["Come Together", "Something"]
+
+def _summary(id, ext_score, title=TITLE, **fields):
+    return {'id': id, 'ext:score': str(ext_score), 'title': title} | fields
+
+def _confident(id, ext_score=100):
+    return _summary(
+        id, ext_score, date='1969-09-26', **{
+            'medium-track-count': len(TRACKS), 'medium-count': 1,
+            'medium-list': [{'format': '12" Vinyl'}],
+        }
+    )
+
+def _mb_release(id):
+    return {'id': id, 'medium-list': [{'track-list': [
+        {'id': f"{id}-{i}", 'position': str(i + 1), 'number': f"A{i + 1}",
+         'length': '200000', 'recording': {'id': f"rec-{i}", 'title': title}}
+        for i, title in enumerate(TRACKS)
+    ]}]}
+
+class Musicbrainz():
+    """ Stands in for MusicbrainzNGS: search results by page, releases by
+    id, counting what's asked for.
+    """
+
+    def __init__(self, pages=(), url_match=None):
+        self.pages = list(pages)
+        self.url_match = url_match
+        self.searches = []
+        self.fetched = []
+        self.counts = Counter()
+
+    def search_releases(self, limit, offset, **kwargs):
+        self.searches.append(offset)
+        self.counts['mb_requests'] += 1
+        page = offset // limit
+        return {'release-list': self.pages[page] if page < len(self.pages) else []}
+
+    def search_by_url(self, url, **kwargs):
+        if self.url_match is None:
+            return None
+        relation = {'release': {'id': self.url_match}}
+        return {'url': {'release-relation-list': [relation]}}
+
+    def get_release_data(self, mb_release_id):
+        self.fetched.append(mb_release_id)
+        return _mb_release(mb_release_id)
+
+@pytest.fixture()
+def mb(app):
+    from rrecords import musicbrainz
+    return musicbrainz
+
+def _release(formats=('Vinyl',)):
+    return SimpleNamespace(formats=[SimpleNamespace(name=name) for name in formats])
+
+ATTRIBUTES = {'release': TITLE, 'artist': "The Beatles", 'date': 1969,
+              'mediums': 1, 'tracks': len(TRACKS)}
+
+def test_summary_score(mb):
+    assert mb._summary_score(_release(), ATTRIBUTES, _confident('a')) == pytest.approx(1)
+
+    # Half the search score, and the title: nothing else agrees.
+    summary = _summary('b', 50, date='1987', **{'medium-list': [{'format': 'CD'}]})
+    assert mb._summary_score(_release(), ATTRIBUTES, summary) == pytest.approx(0.275)
+    # ... though not being vinyl does, for a CD.
+    assert mb._summary_score(_release(['CD']), ATTRIBUTES, summary) == pytest.approx(0.375)
+
+def _candidates(mb, stub, confidence=0.85):
+    decision = {'pages': 0}
+    matcher = mb.MusicbrainzMatcher(mb=stub)
+    candidates = matcher._candidates(_release(), ATTRIBUTES, 90, confidence, decision)
+    return [summary['id'] for _, summary in candidates], decision['pages']
+
+def _page(prefix, n=None, ext_score=95):
+    return [_summary(f"{prefix}{i}", ext_score) for i in range(n or 25)]
+
+def test_candidates_stop_at_max_pages(mb):
+    stub = Musicbrainz([_page(page) for page in 'abcdef'])
+    ids, pages = _candidates(mb, stub)
+    assert pages == mb._MAX_PAGES
+    assert len(ids) == mb._MAX_PAGES * mb._PAGE_SIZE
+    assert stub.searches == [i * mb._PAGE_SIZE for i in range(mb._MAX_PAGES)]
+    assert stub.counts['mb_requests'] == mb._MAX_PAGES
+
+def test_candidates_stop_below_threshold(mb):
+    # The second page drops below the threshold part way through.
+    stub = Musicbrainz([_page('a'), _page('b', 3) + _page('c', 22, 80), _page('d')])
+    ids, pages = _candidates(mb, stub)
+    assert pages == 2
+    assert len(ids) == 28
+
+def test_candidates_stop_when_confident(mb):
+    stub = Musicbrainz([_page('a', 24) + [_confident('best', 91)], _page('b')])
+    ids, pages = _candidates(mb, stub)
+    assert pages == 1
+    assert ids[0] == 'best'
+
+class Backend():
+    """ Stands in for the musicbrainzngs module. """
+
+    def __init__(self):
+        self.calls = 0
+
+    def search_releases(self, **kwargs):
+        self.calls += 1
+        return {'release-list': []}
+
+    def get_release_by_id(self, id, includes=[]):
+        self.calls += 1
+        return {'release': _mb_release(id)}
+
+def test_requests_counted_once_fetched(mb, app):
+    from rrecords.mbclient import MusicbrainzClient
+    from rrecords.payloads import PayloadStore
+
+    backend = Backend()
+    with app.app_context():
+        ngs = mb.MusicbrainzNGS(backend=MusicbrainzClient(backend))
+        for _ in range(2):
+            ngs.search_releases(release=TITLE, limit=25, offset=0)
+            ngs.get_release_data('a')
+        assert backend.calls == 2
+        assert ngs.counts['mb_requests'] == 2
+
+        ngs._store = PayloadStore(app.config['PAYLOAD_STORE'])
+        for _ in range(2):
+            ngs.get_release_data('b')
+        assert backend.calls == 3
+        assert ngs.counts['mb_requests'] == 3
+        assert ngs.counts['payload_store_hits'] == 1
+
+@pytest.fixture()
+def release_id(app):
+    from rrecords.models.base import Release, Artist, Format, Track
+
+    with app.app_context():
+        release = Release(discogs_id=1, master_id=0, title=TITLE, year=1969)
+        release.artists = [Artist(discogs_id=1, name="The Beatles")]
+        release.formats = [Format(name='Vinyl', qty=1)]
+        release.tracks = [
+            Track(position=f"A{i + 1}", type='track', title=title,
+                  duration='3:20', duration_s=200)
+            for i, title in enumerate(TRACKS)
+        ]
+        db.session.add(release)
+        db.session.commit()
+        return release.id
+
+@pytest.mark.parametrize("stub, method", [
+    (lambda: Musicbrainz([[_summary('other', 95), _confident('best')]]), 'search'),
+    (lambda: Musicbrainz(url_match='best'), 'url'),
+])
+def test_match_release_fetches_once(mb, app, release_id, stub, method):
+    from rrecords.models.base import Release
+    from rrecords.models.loading import MATCHER
+
+    stub = stub()
+    with app.app_context():
+        release = Release.query.options(*MATCHER).get(release_id)
+        matcher = mb.MusicbrainzMatcher(mb=stub)
+        assert matcher.match_release(release)
+
+        assert stub.fetched == ['best']
+        assert matcher.last_decision['method'] == method
+        assert matcher.last_decision['fetches'] == 1
+        assert 'mb_release' not in matcher.last_decision
+        assert release.mb_match.mb_id == 'best'
+        assert [t.mb_match.title for t in release.tracks] == TRACKS
@@ -0,0 +1,25 @@
+from rrecords import db
+
+def _release_data(title="Come Together"):
+    return {
+        'mb_id': 'mb-1',
+        'tracks': [
+            {'mb_id': 't-1', 'title': title, 'position': '1', 'number': 1},
+            {'mb_id': 't-2', 'title': "Something", 'position': '2', 'number': 2},
+        ],
+    }
+
+def test_get_or_create_twice(app):
+    from rrecords.models.musicbrainz import MusicbrainzRelease, MusicbrainzTrack
+
+    with app.app_context():
+        first = MusicbrainzRelease.get_or_create(_release_data())
+        again = MusicbrainzRelease.get_or_create(_release_data("Come Together (Remastered)"))
+
+        assert again.id == first.id
+        assert MusicbrainzRelease.query.count() == 1
+        assert MusicbrainzTrack.query.count() == 2
+        # Tracks are updated in place.
+        track = MusicbrainzTrack.query.filter_by(mb_id='t-1').one()
+        assert track.title == "Come Together (Remastered)"
+        assert track.mb_release_id == first.id
@@ -0,0 +1,109 @@
+import pytest
+import time
+from concurrent.futures import ThreadPoolExecutor
+from rrecords.mbclient import MusicbrainzClient
+
+class SlowMB():
+    def __init__(self):
+        self.calls = 0
+
+    def get_release_by_id(self, id, includes=[]):
+        self.calls += 1
+        time.sleep(0.05)
+        return {'release': {'id': id}}
+
+def test_caches_responses():
+    mb = SlowMB()
+    client = MusicbrainzClient(mb)
+    client.get_release_by_id('a', includes=['recordings'])['release'].pop('id')
+    assert client.get_release_by_id('a', includes=['recordings']) == {'release': {'id': 'a'}}
+    client.get_release_by_id('b', includes=['recordings'])
+    assert mb.calls == 2
+    assert client.stats() | {'size': None} == {
+        'hits': 1, 'misses': 2, 'coalesced': 0, 'size': None
+    }
+
+def test_coalesces_in_flight_requests():
+    mb = SlowMB()
+    client = MusicbrainzClient(mb)
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda _: client.get_release_by_id('a'), range(4)))
+    assert mb.calls == 1
+    assert all(r == {'release': {'id': 'a'}} for r in results)
+
+def test_expires_and_evicts():
+    mb = SlowMB()
+    client = MusicbrainzClient(mb, ttl=0, maxsize=1)
+    client.get_release_by_id('a')
+    client.get_release_by_id('a')
+    assert mb.calls == 2
+    assert client.stats()['size'] == 1
+
+class Clock():
+    """ Redis' TIME, moved on by the bucket's sleeps. """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+@pytest.fixture()
+def clock(monkeypatch):
+    from types import SimpleNamespace
+    from fakeredis.commands_mixins import server_mixin
+    from rrecords import mbclient
+
+    clock = Clock()
+    monkeypatch.setattr(server_mixin, 'time', SimpleNamespace(time=clock.time))
+    monkeypatch.setattr(mbclient, 'time', SimpleNamespace(
+        sleep=clock.sleep, monotonic=time.monotonic
+    ))
+    return clock
+
+def _bucket(redis, **kwargs):
+    from rrecords.mbclient import RedisTokenBucket
+    return RedisTokenBucket(redis, 'test:bucket', **kwargs)
+
+def test_bucket_burst(redis, clock):
+    bucket = _bucket(redis, rate=1.0, capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == []
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(1.0)]
+
+def test_bucket_refill(redis, clock):
+    bucket = _bucket(redis, rate=2.0, capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+
+    # A second refills two of the three tokens.
+    clock.now += 1
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.sleeps == []
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+    # Never past capacity, however long it's idle.
+    clock.now += 60
+    for _ in range(3):
+        bucket.acquire()
+    assert len(clock.sleeps) == 1
+    bucket.acquire()
+    assert clock.sleeps[1:] == [pytest.approx(0.5)]
+
+def test_bucket_blocks_across_clients(redis, clock):
+    # Two buckets on the same key share its tokens, like two workers.
+    first, second = _bucket(redis), _bucket(redis)
+    first.acquire()
+    second.acquire()
+    first.acquire()
+    assert clock.sleeps == [pytest.approx(1.0)] * 2
+    assert clock.now == pytest.approx(1002.0)
@@ -0,0 +1,63 @@
+import json
+import pytest
+from musicbrainzngs import ResponseError
+from rrecords.mbindex import MusicbrainzIndex
+
+RELEASE = {
+    'id': 'mb-1',
+    'title': 'Abbey Road',
+    'date': '1969-09-26',
+    'artist-credit': [{'name': 'The Beatles', 'joinphrase': ''}],
+    'media': [{
+        'position': 1, 'format': '12" Vinyl',
+        'tracks': [{
+            'id': 't-1', 'position': 1, 'number': 'A1', 'length': 259000,
+            'recording': {'id': 'r-1', 'title': 'Come Together'}
+        }]
+    }],
+    'relations': [{
+        'type': 'discogs',
+        'url': {'resource': 'https://www.discogs.com/release/123/'}
+    }],
+}
+
+@pytest.fixture()
+def index(tmp_path):
+    dump = tmp_path / 'release'
+    dump.write_text(json.dumps(RELEASE) + "\n")
+    index = MusicbrainzIndex(str(tmp_path / 'mb.db'))
+    assert index.load(str(dump)) == 1
+    return index
+
+def test_search_releases(index):
+    results = index.search_releases(
+        release='Abbey Road', artist='Beatles', tracks=1, strict=False
+    )
+    assert results['release-count'] == 1
+    assert results['release-list'][0]['id'] == 'mb-1'
+    assert results['release-list'][0]['medium-track-count'] == 1
+
+def test_browse_urls(index):
+    results = index.browse_urls(
+        'https://www.discogs.com/release/123', includes=['release-rels']
+    )
+    assert results['url']['release-relation-list'][0]['release']['id'] == 'mb-1'
+    with pytest.raises(ResponseError):
+        index.browse_urls('https://www.discogs.com/release/456')
+
+def test_get_release_by_id(index):
+    release = index.get_release_by_id('mb-1', includes=['recordings'])['release']
+    track = release['medium-list'][0]['track-list'][0]
+    assert track['recording']['title'] == 'Come Together'
+    assert track['length'] == '259000'
+
+def test_index_opened_once(app, index):
+    from rrecords.musicbrainz import MusicbrainzNGS
+
+    app.config['MB_INDEX'] = index.path
+    with app.app_context():
+        first, second = MusicbrainzNGS(), MusicbrainzNGS()
+        assert first.MB is second.MB
+        assert first.MB.search_releases(
+            release='Abbey Road', artist='Beatles', tracks=1, strict=False
+        )['release-count'] == 1
@@ -0,0 +1,92 @@
+import os
+import pytest
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from flask_migrate import upgrade
+from sqlalchemy import text
+from rrecords import create_app, db
+
+MIGRATIONS = os.path.join(os.path.dirname(__file__), '..', 'migrations')
+BASELINE = '5d33df4f29d4'
+
+@pytest.fixture()
+def baseline_app(tmp_path):
+    """ An app whose database is at the baseline schema, as one made by
+    db.create_all() before there were migrations.
+    """
+    app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path}/test.db",
+    })
+    with app.app_context():
+        upgrade(directory=MIGRATIONS, revision=BASELINE)
+    return app
+
+def _execute(statements):
+    for statement in statements:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+def _rows(statement):
+    return [tuple(row) for row in db.session.execute(text(statement))]
+
+def test_format_descriptions_merged(baseline_app):
+    with baseline_app.app_context():
+        _execute([
+            "INSERT INTO releases (id, discogs_id, master_id) VALUES (1, 1, 1)",
+            "INSERT INTO formats (id, release_id, name, qty) VALUES (1, 1, 'Vinyl', 1), (2, 1, 'CD', 1)",
+            "INSERT INTO format_descriptions (id, text) VALUES (1, 'LP'), (2, 'Album'), (3, 'LP'), (4, 'LP')",
+            "INSERT INTO format_to_description_associations VALUES (1, 3), (1, 4), (1, 2), (2, 1), (2, 4)",
+        ])
+        upgrade(directory=MIGRATIONS, revision='b4e2f81c07a5')
+
+        assert _rows("SELECT id, text FROM format_descriptions ORDER BY id") == [
+            (1, 'LP'), (2, 'Album')
+        ]
+        assert _rows(
+            "SELECT format_id, format_description_id"
+            " FROM format_to_description_associations ORDER BY 1, 2"
+        ) == [(1, 1), (1, 2), (2, 1)]
+
+def test_musicbrainz_duplicates_merged(baseline_app):
+    with baseline_app.app_context():
+        _execute([
+            "INSERT INTO mb_releases (id, mb_id) VALUES (1, 'r'), (2, 'r'), (3, 'other')",
+            "INSERT INTO mb_tracks (id, mb_id, mb_release_id) VALUES"
+            " (1, 't', 1), (2, 't', 2), (3, 'u', 2), (4, 'v', 3)",
+            "INSERT INTO releases (id, discogs_id, master_id, mb_match_id) VALUES"
+            " (1, 1, 1, 2), (2, 2, 2, 3)",
+            "INSERT INTO tracks (id, release_id, mb_match_id) VALUES (1, 1, 2), (2, 1, 3)",
+        ])
+        upgrade(directory=MIGRATIONS, revision='0c9d5e3a41b7')
+
+        assert _rows("SELECT id FROM mb_releases ORDER BY id") == [(1,), (3,)]
+        assert _rows("SELECT id, mb_release_id FROM mb_tracks ORDER BY id") == [
+            (1, 1), (3, 1), (4, 3)
+        ]
+        assert _rows("SELECT id, mb_match_id FROM releases ORDER BY id") == [(1, 1), (2, 3)]
+        assert _rows("SELECT id, mb_match_id FROM tracks ORDER BY id") == [(1, 1), (2, 3)]
+
+def test_collection_counters_filled_in(baseline_app):
+    with baseline_app.app_context():
+        _execute([
+            "INSERT INTO users (id, name, email, password) VALUES (1, 'u', 'u@test.com', 'x')",
+            "INSERT INTO collections (id, name, discogs_id, user_id) VALUES (1, 'c', 0, 1), (2, 'd', 1, 1)",
+            "INSERT INTO mb_releases (id, mb_id) VALUES (1, 'r')",
+            "INSERT INTO releases (id, discogs_id, master_id, mb_match_id) VALUES"
+            " (1, 1, 1, 1), (2, 2, 2, NULL)",
+            "INSERT INTO tracks (id, release_id) VALUES (1, 1), (2, 1), (3, 2)",
+            "INSERT INTO release_to_collection_associations VALUES (1, 1), (1, 2)",
+        ])
+        upgrade(directory=MIGRATIONS, revision='5f8b2d6e9a14')
+
+        assert _rows(
+            "SELECT id, n_synced, n_matched, n_tracks FROM collections ORDER BY id"
+        ) == [(1, 2, 1, 3), (2, 0, 0, 0)]
+
+def test_head_matches_models(baseline_app):
+    with baseline_app.app_context():
+        upgrade(directory=MIGRATIONS)
+        with db.engine.connect() as connection:
+            context = MigrationContext.configure(connection)
+            assert compare_metadata(context, db.metadata) == []
@@ -0,0 +1,70 @@
+import pytest
+from datetime import datetime
+from rrecords import db
+
+# (title, artists_sort, year, created_at day): NULLs and ties in every column.
+RELEASES = [
+    ("B", "Artist 1", 1970, 1),
+    ("A", None, None, 2),
+    ("B", "Artist 2", 1970, 2),
+    ("C", "Artist 1", None, 1),
+    ("A", "Artist 2", 1980, 3),
+    ("D", None, 1970, 3),
+    ("A", "Artist 1", None, 1),
+]
+
+@pytest.fixture()
+def collection(app, collection):
+    """ `collection`, holding RELEASES. """
+    from rrecords.models.base import Collection, Release
+
+    with app.app_context():
+        members = [Collection.query.get(collection)]
+        db.session.add_all([
+            Release(
+                discogs_id=i, master_id=0, title=title, artists_sort=artist,
+                year=year, created_at=datetime(2024, 1, day), collections=members
+            )
+            for i, (title, artist, year, day) in enumerate(RELEASES)
+        ])
+        db.session.commit()
+    return collection
+
+def _expected(releases, sort, direction):
+    # NULLs first ascending, last descending; id breaks ties.
+    def key(release):
+        value = getattr(release, sort)
+        return (value is not None, value if value is not None else 0, release.id)
+    return [r.id for r in sorted(releases, key=key, reverse=direction == 'desc')]
+
+@pytest.mark.parametrize("direction", ['asc', 'desc'])
+@pytest.mark.parametrize("sort", ['title', 'artists_sort', 'year', 'created_at'])
+@pytest.mark.parametrize("limit", [1, 2, 3])
+def test_pages_cover_every_release_once(app, collection, sort, direction, limit):
+    from rrecords.models.base import Collection, Release
+
+    with app.app_context():
+        ids, cursor, n_pages = [], None, 0
+        while True:
+            releases, cursor = Collection.page_releases(
+                collection, sort=sort, direction=direction, after=cursor,
+                limit=limit
+            )
+            ids += [r.id for r in releases]
+            n_pages += 1
+            if cursor is None:
+                break
+
+        assert ids == _expected(Release.query.all(), sort, direction)
+        assert n_pages == -(-len(RELEASES) // limit)
+
+def test_bad_arguments(app, collection):
+    from rrecords.models.base import Collection
+
+    with app.app_context():
+        with pytest.raises(ValueError):
+            Collection.page_releases(collection, sort='id; DROP TABLE releases')
+        with pytest.raises(ValueError):
+            Collection.page_releases(collection, direction='sideways')
+        with pytest.raises(ValueError):
+            Collection.page_releases(collection, after='not a cursor')
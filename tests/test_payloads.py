@@ -0,0 +1,98 @@
+import pytest
+from rrecords import db
+from rrecords.payloads import PayloadStore, DISCOGS_RELEASE, MB_RELEASE
+
+class Clock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture()
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr('rrecords.payloads.time.time', clock)
+    return clock
+
+def test_ttl(tmp_path, clock):
+    store = PayloadStore(str(tmp_path), ttl=60)
+    requests = []
+    def fetch(payload, new_etag):
+        def fetch_fn(etag):
+            requests.append(etag)
+            return payload, new_etag
+        return fetch_fn
+
+    assert store.fetch(DISCOGS_RELEASE, 1, fetch({'title': "A"}, 'e1')) == {'title': "A"}
+    clock.now += 59
+    assert store.fetch(DISCOGS_RELEASE, 1, fetch({'title': "B"}, 'e2')) == {'title': "A"}
+    assert requests == [None]
+
+    # Stale: asked for again with its ETag. Unchanged, it's fresh again.
+    clock.now += 1
+    assert store.get(DISCOGS_RELEASE, 1) is None
+    assert store.get(DISCOGS_RELEASE, 1, fresh_only=False) == {'title': "A"}
+    assert store.fetch(DISCOGS_RELEASE, 1, fetch(None, 'e1')) == {'title': "A"}
+    assert store.get(DISCOGS_RELEASE, 1) == {'title': "A"}
+
+    clock.now += 60
+    assert store.fetch(DISCOGS_RELEASE, 1, fetch({'title': "B"}, 'e2')) == {'title': "B"}
+    assert requests == [None, 'e1', 'e1']
+
+def test_no_ttl(tmp_path, clock):
+    store = PayloadStore(str(tmp_path))
+    store.put(MB_RELEASE, 'x', {'id': 'x'})
+    clock.now += 10**9
+    assert store.fetch(MB_RELEASE, 'x', None) == {'id': 'x'}
+    assert list(store.items(MB_RELEASE)) == [('x', {'id': 'x'})]
+
+def _discogs_payload(title, track_titles):
+    return {
+        'id': 1, 'title': title, 'artists_sort': "Artist (2)", 'year': 1999,
+        'master_id': 10, 'thumb': '', 'cover_image': '',
+        'tracklist': [{'position': '', 'type_': 'heading', 'title': "Side A", 'duration': ''}] + [
+            {'position': f"A{i + 1}", 'type_': 'track', 'title': t, 'duration': '2:00'}
+            for i, t in enumerate(track_titles)
+        ],
+    }
+
+def _mb_payload(track_titles):
+    return {'id': 'mb-1', 'medium-list': [{'track-list': [
+        {'id': f"t-{i}", 'position': str(i + 1), 'number': f"A{i + 1}",
+         'length': '120000', 'recording': {'id': f"rec-{i}", 'title': t}}
+        for i, t in enumerate(track_titles)
+    ]}]}
+
+def test_rederive(app, runner):
+    from rrecords.payloads import payload_store
+    from rrecords.models.base import Release, Track
+    from rrecords.models.musicbrainz import MusicbrainzRelease, MusicbrainzTrack
+
+    with app.app_context():
+        db.session.add(Release(
+            discogs_id=1, master_id=10, title="Old", year=2000,
+            tracks=[Track(position=f"A{i}", type='track', title="old") for i in (1, 2)],
+        ))
+        db.session.add(MusicbrainzRelease(mb_id='mb-1', tracks=[
+            MusicbrainzTrack(mb_id=f"t-{i}", title="old") for i in (0, 1)
+        ]))
+        # One without a payload is left alone.
+        db.session.add(Release(discogs_id=2, master_id=0, title="Kept"))
+        db.session.commit()
+
+        store = payload_store()
+        store.put(DISCOGS_RELEASE, 1, _discogs_payload("New", ["One", "Two"]))
+        store.put(MB_RELEASE, 'mb-1', _mb_payload(["Uno", "Dos"]))
+
+    result = runner.invoke(args=['tasks', 'rederive'])
+    assert result.exit_code == 0, result.output
+
+    with app.app_context():
+        release = Release.query.filter_by(discogs_id=1).one()
+        assert (release.title, release.artists_sort, release.year) == ("New", "Artist", 1999)
+        tracks = Track.query.filter_by(release_id=release.id).order_by(Track.id)
+        assert [(t.title, t.duration_s) for t in tracks] == [("One", 120), ("Two", 120)]
+        assert Release.query.filter_by(discogs_id=2).one().title == "Kept"
+        mb_tracks = MusicbrainzTrack.query.order_by(MusicbrainzTrack.mb_id)
+        assert [(t.title, t.duration_s) for t in mb_tracks] == [("Uno", 120), ("Dos", 120)]
@@ -0,0 +1,60 @@
+import json
+import time
+
+def _published(pubsub):
+    events = []
+    while (message := pubsub.get_message(timeout=0.01)) is not None:
+        events.append(json.loads(message['data']))
+    return events
+
+def test_updates_throttled(redis):
+    from rrecords.progress import Progress, SYNC, channel
+
+    pubsub = redis.pubsub()
+    pubsub.subscribe(channel(1))
+    assert pubsub.get_message(timeout=1)['type'] == 'subscribe'
+    progress = Progress(SYNC, 1, interval=0.2)
+
+    progress.start(done=0, total=3)
+    progress.update(done=1)
+    progress.incr(done=1)
+    assert [e['done'] for e in _published(pubsub)] == [0]
+    assert progress.get() == {'state': 'running', 'done': 2, 'total': 3}
+
+    time.sleep(0.25)
+    progress.update(done=3)
+    progress.finish(n_synced=3)
+    assert [(e['state'], e['done']) for e in _published(pubsub)] == [
+        ('running', 3), ('done', 3)
+    ]
+    assert _published(pubsub) == []
+
+def test_snapshot(redis):
+    from rrecords.progress import Progress, SYNC, MATCH, snapshot
+    from rrecords.signatures import sync_lock
+
+    Progress(SYNC, 1).start(done=5)
+    Progress(MATCH, 1).start(done=7)
+    redis.set(sync_lock(1), 'task')
+
+    # A match that isn't running any more leaves its progress behind.
+    assert snapshot(1) == {
+        SYNC: {'kind': SYNC, 'collection_id': 1, 'state': 'running', 'done': 5,
+               'running': True},
+        MATCH: {'kind': MATCH, 'collection_id': 1, 'running': False},
+    }
+
+def test_without_redis(app, logged_in, collection):
+    from rrecords.progress import Progress, SYNC, snapshot
+
+    with app.app_context():
+        # What a task reports goes nowhere, rather than failing the task.
+        progress = Progress(SYNC, collection)
+        progress.start(done=0, total=2)
+        progress.update(done=1)
+        progress.incr(done=1)
+        progress.finish(n_synced=2)
+        assert progress.get() == {}
+        assert snapshot(collection) == {}
+    assert logged_in.get(f'/collection/{collection}/progress').status_code == 204
+    assert logged_in.get(f'/collection/{collection}').status_code == 200
@@ -0,0 +1,47 @@
+import pytest
+from rrecords import db
+
+@pytest.fixture()
+def make_release(app):
+    from rrecords.models.base import (
+        User, Release, Track, Format, FormatDescription, Artist
+    )
+
+    def make(n_tracks):
+        with app.app_context():
+            user = User(
+                name=f"u{n_tracks}", email=f"u{n_tracks}@test.com",
+                password="asdfasdf"
+            )
+            release = Release(
+                discogs_id=-n_tracks, master_id=0, title="Test", year=2000
+            )
+            artist = Artist(discogs_id=-n_tracks, name="Artist")
+            description = FormatDescription(text=f"LP {n_tracks}")
+            release.artists = [artist]
+            release.formats = [Format(
+                name='Vinyl', qty=1, descriptions=[description]
+            )]
+            release.tracks = [
+                Track(position=f"{'AB'[i % 2]}{i}", type='track', title=f"T{i}",
+                      duration='1:00', duration_s=60)
+                for i in range(n_tracks)
+            ]
+            db.session.add_all([user, release])
+            db.session.flush()
+            release.resolve_discs()
+            db.session.commit()
+            return user.id, release.id
+
+    yield make
+
+@pytest.mark.parametrize("n_tracks", [2, 20])
+def test_release_page_query_budget(client, make_release, max_queries, n_tracks):
+    user_id, release_id = make_release(n_tracks)
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+
+    with max_queries(8):
+        response = client.get(f"/release/{release_id}")
+    assert response.status_code == 200
+    assert response.data.count(b'T1') >= 1
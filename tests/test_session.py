@@ -0,0 +1,35 @@
+def test_session_holds_only_request_token(app, client, logged_in, discogs):
+    response = client.get('/discogs/login')
+    assert response.status_code == 302
+    assert response.location == "https://discogs.test/authorize"
+
+    with client.session_transaction() as session:
+        assert session['discogs_oauth'] == {
+            'token': "request-token", 'secret': "request-secret"
+        }
+        assert set(session) <= {'_user_id', '_fresh', '_id', 'discogs_oauth'}
+    # The cookie only holds the session id.
+    cookies = [
+        c for c in client.cookie_jar if c.name == app.config['SESSION_COOKIE_NAME']
+    ]
+    assert len(cookies) == 1
+    assert "request" not in cookies[0].value
+
+    response = client.get('/discogs/auth?oauth_verifier=v')
+    assert response.location.endswith('/discogs/sync_folders')
+    assert discogs.tokens == [("request-token", "request-secret")]
+    with client.session_transaction() as session:
+        assert 'discogs_oauth' not in session
+
+def test_auth_without_request_token(app, client, user, logged_in, discogs):
+    from rrecords.models.base import User
+
+    response = client.get('/discogs/auth?oauth_verifier=v', follow_redirects=False)
+    assert response.location.endswith('/profile')
+    with client.session_transaction() as session:
+        assert session['_flashes'] == [
+            ('message', "Discogs login expired, please try again")
+        ]
+    assert discogs.tokens == []
+    with app.app_context():
+        assert User.query.get(user).discogs_token == "token"
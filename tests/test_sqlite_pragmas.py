@@ -0,0 +1,36 @@
+from sqlalchemy import text
+from rrecords import create_app, db
+
+def _pragmas(app, *names):
+    with app.app_context():
+        # A new connection each time, not one from the pool.
+        db.engine.dispose()
+        with db.engine.connect() as connection:
+            return {
+                name: connection.execute(text(f"PRAGMA {name}")).scalar()
+                for name in names
+            }
+
+def test_pragmas_applied_on_connect(app):
+    assert _pragmas(
+        app, 'foreign_keys', 'journal_mode', 'busy_timeout', 'synchronous',
+        'cache_size', 'mmap_size', 'temp_store'
+    ) == {
+        'foreign_keys': 1,
+        'journal_mode': 'wal',
+        'busy_timeout': 5000,
+        'synchronous': 1,       # NORMAL
+        'cache_size': -64000,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 2,        # MEMORY
+    }
+
+def test_pragmas_overridden(tmp_path):
+    app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path}/test.db",
+        "SQLITE_PRAGMAS": {'busy_timeout': 100, 'journal_mode': None},
+    })
+    assert _pragmas(app, 'busy_timeout', 'journal_mode', 'foreign_keys') == {
+        'busy_timeout': 100, 'journal_mode': 'delete', 'foreign_keys': 1,
+    }
@@ -0,0 +1,37 @@
+import pytest
+from types import SimpleNamespace
+from scipy.optimize import linear_sum_assignment
+
+@pytest.fixture()
+def mb(app):
+    from rrecords import musicbrainz
+    return musicbrainz
+
+def _release(*tracks):
+    return SimpleNamespace(tracks=[
+        SimpleNamespace(position=p, title=t, duration_s=d) for p, t, d in tracks
+    ])
+
+def test_normalize_title(mb):
+    assert mb._normalize_title("Come Together (Remastered 2009)") == "come together"
+    assert mb._normalize_title("Something - 2019 Remaster") == "something"
+    assert mb._normalize_title("Gimme Shelter feat. Merry Clayton") == "gimme shelter"
+    assert mb._normalize_title("Help!") == "help"
+
+def test_track_distance_matrix(mb):
+    dc = _release(('A1', 'Come Together', 259), ('A2', 'Something', None))
+    mb_release = _release(
+        ('A1', 'Something (Remastered)', 182),
+        ('A2', 'Come Together', 260),
+        ('A3', "Maxwell's Silver Hammer", 207),
+    )
+    distances = mb._track_distance_matrix(dc, mb_release)
+    assert distances.shape == (2, 3)
+    assert distances[0, 1] == 0.1 * 100
+    assert list(linear_sum_assignment(distances)[1]) == [1, 0]
+
+def test_duration_term(mb):
+    dc = _release(('A1', 'Intro', 60), ('A2', 'Intro', None))
+    mb_release = _release(('1', 'Intro', 70), ('2', 'Intro', 300))
+    engine = mb.TrackDistance(title=0, position=0, duration=1)
+    assert engine(dc.tracks, mb_release.tracks).tolist() == [[10, 100], [0, 0]]
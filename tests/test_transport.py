@@ -0,0 +1,36 @@
+import pytest
+from rrecords.transport import Fixtures, FixtureMissing, Transport
+
+
+def test_record_then_replay(tmp_path):
+    recorder = Transport('record', fixtures=Fixtures(tmp_path))
+    for body in ['first', 'second']:
+        recorder.request(
+            'discogs', 'GET', 'https://api.discogs.com/releases/1?b=2&a=1&token=abc',
+            send=lambda: (200, {'Content-Type': 'application/json'}, body.encode())
+        )
+
+    replayer = Transport('replay', fixtures=Fixtures(tmp_path))
+    bodies = [
+        replayer.request('discogs', 'GET', 'https://api.discogs.com/releases/1?a=1&b=2&token=xyz')['body']
+        for _ in range(3)
+    ]
+    assert bodies == ['first', 'second', 'second']
+
+    with pytest.raises(FixtureMissing):
+        replayer.request('discogs', 'GET', 'https://api.discogs.com/releases/2')
+
+
+def test_replay_rate_limits(tmp_path):
+    Transport('record', fixtures=Fixtures(tmp_path)).request(
+        'musicbrainz', 'GET', 'https://musicbrainz.org/ws/2/release/abc',
+        send=lambda: (200, {}, '<metadata/>')
+    )
+    replayer = Transport(
+        'replay', fixtures=Fixtures(tmp_path), rate_limits={'musicbrainz': 0.001}
+    )
+    statuses = [
+        replayer.request('musicbrainz', 'GET', 'https://musicbrainz.org/ws/2/release/abc')['status']
+        for _ in range(3)
+    ]
+    assert statuses == [200, 503, 503]